@@ -22,7 +22,7 @@ ATOM_LIST -> ATOM
 """
 
 from typing import List, Any, Optional
-import ply.yacc as yacc
+from das.parser_cache import build_parser
 from das.atomese_lex import AtomeseLex
 from das.metta_lex import BASIC_TYPE
 from das.exceptions import AtomeseSyntaxError, UndefinedSymbolError
@@ -40,15 +40,16 @@ class AtomeseYacc(BaseYacc):
                  |"""
         p[0] = 'SUCCESS'
 
+    # Top level atoms are passed to the action broker as they're parsed so
+    # they aren't kept in a list (which would hold the whole file)
+
     def p_LIST_OF_TOP_LEVEL_ATOMS_base(self, p):
         """LIST_OF_TOP_LEVEL_ATOMS : TOP_LEVEL_ATOM"""
-        p[0] = [p[1]]
-        if self.check_mode or not self.action_broker:
-            return
+        pass
 
     def p_LIST_OF_TOP_LEVEL_ATOMS_recursion(self, p):
         """LIST_OF_TOP_LEVEL_ATOMS : LIST_OF_TOP_LEVEL_ATOMS TOP_LEVEL_ATOM"""
-        p[0] = [*p[1], p[2]]
+        pass
 
     def p_TOP_LEVEL_ATOM(self, p):
         """TOP_LEVEL_ATOM : ATOM"""
@@ -145,12 +146,17 @@ class AtomeseYacc(BaseYacc):
         super().__init__(**kwargs)
         self.lex_wrap = AtomeseLex()
         super().setup()
-        self.parser = yacc.yacc(module=self)
+        self.parser = build_parser(self)
         self.types = set()
         self.nodes = set()
         named_type_hash = self._get_named_type_hash(BASIC_TYPE)
         self.parent_type[named_type_hash] = named_type_hash
 
+    def reset(self, action_broker: Any) -> None:
+        super().reset(action_broker)
+        self.types = set()
+        self.nodes = set()
+
     def _new_link(self, link_type, targets):
         if link_type not in self.types:
             self.types.add(link_type)
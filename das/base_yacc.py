@@ -27,6 +27,7 @@ from typing import List, Any, Optional
 import ply.yacc as yacc
 from das.expression_hasher import ExpressionHasher
 from das.expression import Expression
+from das.exceptions import UndefinedSymbolError
 from das.metta_lex import BASIC_TYPE
 
 class BaseYacc:
@@ -38,11 +39,15 @@ class BaseYacc:
         self.action_broker = kwargs.pop('action_broker', None)
         self.check_mode = False
         self.hasher = ExpressionHasher()
+        self.use_action_broker_cache = kwargs.pop('use_action_broker_cache', False)
+        self._reset_state()
+
+    def _reset_state(self):
         self.pending_terminal_names = []
         self.pending_expression_names = []
         self.pending_named_types = []
         self.pending_expressions = []
-        if kwargs.pop('use_action_broker_cache', False):
+        if self.use_action_broker_cache:
             self.named_type_hash = self.action_broker.named_type_hash
             self.named_types = self.action_broker.named_types
             self.symbol_hash = self.action_broker.symbol_hash
@@ -64,6 +69,17 @@ class BaseYacc:
         if self.action_broker is not None:
             expression = self._typedef(BASIC_TYPE, BASIC_TYPE)
             self.action_broker.new_top_level_typedef_expression(expression)
+
+    def reset(self, action_broker: Any) -> None:
+        """
+        Reuse this parser (and its tables) to parse the input of another
+        action broker.
+        """
+        self.action_broker = action_broker
+        self._reset_state()
+        self.lexer.lineno = 1
+        self.lexer.eof_reported_flag = False
+        self.setup()
         
     def _get_terminal_hash(self, named_type, terminal_name):
         key = (named_type, terminal_name)
@@ -200,18 +216,34 @@ class BaseYacc:
         while self._revisit_pending_expressions():
             pass
 
+    def _resolve_pending_symbols(self):
+        self._revisit_pending_symbols()
+        missing_symbols = []
+        missing_symbols.extend([name for (name, expression) in self.pending_terminal_names])
+        missing_symbols.extend([name for (name, expression) in self.pending_expression_names])
+        missing_symbols.extend([type_designator for ((name, type_designator), expression) in self.pending_named_types])
+        if missing_symbols:
+            raise UndefinedSymbolError(list(set(missing_symbols)))
+        assert not self.pending_expressions
+
+    # The lexer is passed explicitly because PLY's default is the last one
+    # built (by any parser)
+
+    def _parse(self, input_string):
+        return self.parser.parse(input_string, lexer=self.lexer)
+
     def parse(self, input_string):
         self.file_name = ""
-        return self.parser.parse(input_string)
+        return self._parse(input_string)
 
     def parse_action_broker_input(self):
         self.file_name = self.action_broker.file_path
         input_string = self.action_broker.input_string
-        return self.parser.parse(input_string)
+        return self._parse(input_string)
 
     def check(self, input_string):
         self.file_name = ""
         self.check_mode = True
-        answer = self.parser.parse(input_string)
+        answer = self._parse(input_string)
         self.check_mode = False
         return answer
@@ -0,0 +1,74 @@
+import math
+from hashlib import md5
+from typing import Iterable, List, Optional, Union
+
+# Filters are split in blocks of this size (in bytes) to be persisted
+BLOCK_SIZE = 4 * 1024 * 1024
+
+class BloomFilter:
+    """
+    Bloom filter over atom handles. Handles are MD5 digests already so bit
+    positions are taken straight from the handle bits (double hashing).
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        assert 0 < error_rate < 1
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(64, int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.hash_count = max(1, int(round((self.size / self.capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        # Blocks changed since the last call to blocks()
+        self.dirty_blocks = set()
+
+    def __contains__(self, handle: Union[str, bytes]) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(handle))
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, handle: Union[str, bytes]) -> List[int]:
+        if isinstance(handle, str):
+            try:
+                value = int(handle, 16)
+            except ValueError:
+                value = int.from_bytes(md5(handle.encode("utf-8")).digest(), "big")
+        else:
+            value = int.from_bytes(handle, "big")
+        h1 = value >> 64
+        h2 = (value & 0xFFFFFFFFFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, handle: Union[str, bytes]) -> None:
+        bits = self.bits
+        for position in self._positions(handle):
+            bits[position >> 3] |= 1 << (position & 7)
+            self.dirty_blocks.add((position >> 3) // BLOCK_SIZE)
+        self.count += 1
+
+    def update(self, handles: Iterable[Union[str, bytes]]) -> None:
+        for handle in handles:
+            self.add(handle)
+
+    def saturated(self) -> bool:
+        return self.count > self.capacity
+
+    def block_count(self) -> int:
+        return (len(self.bits) + BLOCK_SIZE - 1) // BLOCK_SIZE
+
+    def blocks(self, only_dirty: bool = False) -> List[tuple]:
+        indexes = sorted(self.dirty_blocks) if only_dirty else range(self.block_count())
+        self.dirty_blocks = set()
+        return [(i, bytes(self.bits[i * BLOCK_SIZE:(i + 1) * BLOCK_SIZE])) for i in indexes]
+
+    @staticmethod
+    def from_blocks(capacity: int, error_rate: float, count: int, blocks: Iterable[bytes]) -> Optional["BloomFilter"]:
+        bloom_filter = BloomFilter(capacity, error_rate)
+        bits = bytearray().join(blocks)
+        if len(bits) != len(bloom_filter.bits):
+            return None
+        bloom_filter.bits = bits
+        bloom_filter.count = count
+        return bloom_filter
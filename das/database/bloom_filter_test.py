@@ -0,0 +1,43 @@
+from das.expression_hasher import ExpressionHasher
+from das.database.bloom_filter import BloomFilter
+
+def _handles(prefix, n):
+    return [ExpressionHasher._compute_hash(f"{prefix}{i}") for i in range(n)]
+
+def test_no_false_negatives():
+    bloom_filter = BloomFilter(1000)
+    handles = _handles("node", 1000)
+    bloom_filter.update(handles)
+    assert len(bloom_filter) == 1000
+    assert all(handle in bloom_filter for handle in handles)
+    assert not bloom_filter.saturated()
+    bloom_filter.add(_handles("extra", 1)[0])
+    assert bloom_filter.saturated()
+
+def test_false_positive_rate():
+    bloom_filter = BloomFilter(1000, error_rate=0.01)
+    bloom_filter.update(_handles("node", 1000))
+    false_positives = sum(1 for handle in _handles("blah", 10000) if handle in bloom_filter)
+    assert false_positives < 300
+
+def test_non_hex_handles():
+    bloom_filter = BloomFilter(10)
+    bloom_filter.add("<Concept: human>")
+    bloom_filter.add(bytes.fromhex(_handles("node", 1)[0]))
+    assert "<Concept: human>" in bloom_filter
+    assert _handles("node", 1)[0] in bloom_filter
+    assert "<Concept: monkey>" not in bloom_filter
+
+def test_blocks():
+    bloom_filter = BloomFilter(1000)
+    handles = _handles("node", 500)
+    bloom_filter.update(handles)
+    assert bloom_filter.dirty_blocks == {0}
+    blocks = bloom_filter.blocks(only_dirty=True)
+    assert len(blocks) == 1 and blocks[0][0] == 0
+    assert not bloom_filter.dirty_blocks
+    assert bloom_filter.blocks(only_dirty=True) == []
+    copy = BloomFilter.from_blocks(1000, 0.01, 500, [block for _, block in bloom_filter.blocks()])
+    assert copy.count == 500
+    assert all(handle in copy for handle in handles)
+    assert BloomFilter.from_blocks(2000, 0.01, 500, [block for _, block in bloom_filter.blocks()]) is None
@@ -0,0 +1,128 @@
+import os
+from datetime import timedelta
+from threading import Lock, RLock
+from typing import Any, Dict
+
+from couchbase.auth import PasswordAuthenticator as CouchbasePasswordAuthenticator
+from couchbase.bucket import Bucket
+from couchbase.cluster import Cluster as CouchbaseDB, ClusterOptions, ClusterTimeoutOptions
+from couchbase.management.collections import CollectionSpec as CouchbaseCollectionSpec
+from couchbase.options import LockMode as CouchbaseLockMode
+from pymongo import MongoClient as MongoDBClient
+from pymongo.database import Database
+
+from das.database.couchbase_schema import CollectionNames as CouchbaseCollections
+from das.logger import logger
+
+# Defaults of the connection options. They can be overridden by the
+# environment variables below or by the keyword arguments of the
+# ConnectionManager methods (e.g. DistributedAtomSpace(mongodb_max_pool_size=10))
+CONNECTION_OPTIONS = {
+    'mongodb_max_pool_size': 100,
+    'mongodb_min_pool_size': 0,
+    'mongodb_timeout_ms': 30000,
+    'couchbase_kv_timeout': 2.5,
+    'couchbase_connect_timeout': 5.0,
+}
+
+CONNECTION_OPTIONS_ENVIRONMENT = {
+    'mongodb_max_pool_size': 'DAS_MONGODB_MAX_POOL_SIZE',
+    'mongodb_min_pool_size': 'DAS_MONGODB_MIN_POOL_SIZE',
+    'mongodb_timeout_ms': 'DAS_MONGODB_TIMEOUT_MS',
+    'couchbase_kv_timeout': 'DAS_COUCHBASE_KV_TIMEOUT',
+    'couchbase_connect_timeout': 'DAS_COUCHBASE_CONNECT_TIMEOUT',
+}
+
+def connection_options(**kwargs) -> Dict[str, Any]:
+    answer = {}
+    for name, default in CONNECTION_OPTIONS.items():
+        value = kwargs.get(name, None)
+        if value is None:
+            value = os.environ.get(CONNECTION_OPTIONS_ENVIRONMENT[name], None)
+        answer[name] = default if value is None else type(default)(value)
+    return answer
+
+class ConnectionManager:
+    """
+    Process-wide pool of database connections. MongoDB clients and Couchbase
+    clusters are created once per server (and options) and shared by all the
+    atom spaces opened in the process.
+    """
+    __instance = None
+    __instance_lock = Lock()
+
+    @staticmethod
+    def get_instance():
+        with ConnectionManager.__instance_lock:
+            if ConnectionManager.__instance is None:
+                return ConnectionManager()
+            return ConnectionManager.__instance
+
+    def __init__(self):
+        if ConnectionManager.__instance is not None:
+            raise Exception("Invalid re-instantiation of ConnectionManager")
+        self.lock = RLock()
+        self.mongo_clients = {}
+        self.couchbase_clusters = {}
+        self.couchbase_buckets = {}
+        ConnectionManager.__instance = self
+
+    def mongo_database(self, database_name: str, **kwargs) -> Database:
+        hostname = os.environ.get('DAS_MONGODB_HOSTNAME')
+        port = os.environ.get('DAS_MONGODB_PORT')
+        username = os.environ.get('DAS_DATABASE_USERNAME')
+        password = os.environ.get('DAS_DATABASE_PASSWORD')
+        options = connection_options(**kwargs)
+        key = (hostname, port, username, options['mongodb_max_pool_size'],
+            options['mongodb_min_pool_size'], options['mongodb_timeout_ms'])
+        with self.lock:
+            client = self.mongo_clients.get(key, None)
+            if client is None:
+                logger().info(f"New MongoDB connection pool: {hostname}:{port}")
+                client = MongoDBClient(
+                    f'mongodb://{username}:{password}@{hostname}:{port}',
+                    maxPoolSize=options['mongodb_max_pool_size'],
+                    minPoolSize=options['mongodb_min_pool_size'],
+                    connectTimeoutMS=options['mongodb_timeout_ms'],
+                    serverSelectionTimeoutMS=options['mongodb_timeout_ms'])
+                self.mongo_clients[key] = client
+        return client[database_name]
+
+    def couchbase_bucket(self, bucket_name: str, **kwargs) -> Bucket:
+        hostname = os.environ.get('DAS_COUCHBASE_HOSTNAME')
+        username = os.environ.get('DAS_DATABASE_USERNAME')
+        password = os.environ.get('DAS_DATABASE_PASSWORD')
+        options = connection_options(**kwargs)
+        key = (hostname, username, options['couchbase_kv_timeout'], options['couchbase_connect_timeout'])
+        with self.lock:
+            cluster = self.couchbase_clusters.get(key, None)
+            if cluster is None:
+                logger().info(f"New Couchbase cluster connection: {hostname}")
+                timeout_options = ClusterTimeoutOptions(
+                    kv_timeout=timedelta(seconds=options['couchbase_kv_timeout']),
+                    config_total_timeout=timedelta(seconds=options['couchbase_connect_timeout']))
+                cluster = CouchbaseDB(
+                    f'couchbase://{hostname}',
+                    ClusterOptions(
+                        CouchbasePasswordAuthenticator(username, password),
+                        timeout_options=timeout_options),
+                    lockmode=CouchbaseLockMode.WAIT)
+                self.couchbase_clusters[key] = cluster
+            bucket = self.couchbase_buckets.get((key, bucket_name), None)
+            if bucket is None:
+                bucket = cluster.bucket(bucket_name)
+                self._create_couchbase_collections(bucket)
+                self.couchbase_buckets[(key, bucket_name)] = bucket
+        return bucket
+
+    def _create_couchbase_collections(self, bucket: Bucket) -> None:
+        collection_manager = bucket.collections()
+        for entry in CouchbaseCollections:
+            try:
+                collection_manager.create_collection(CouchbaseCollectionSpec(entry.value))
+            except Exception:
+                #TODO: should we provide a warning here?
+                pass
+
+def connection_manager():
+    return ConnectionManager.get_instance()
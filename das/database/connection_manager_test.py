@@ -0,0 +1,46 @@
+from threading import Barrier, Thread
+from das.database.connection_manager import connection_manager, connection_options, ConnectionManager, CONNECTION_OPTIONS
+from das.distributed_atom_space import DistributedAtomSpace
+
+def test_connection_options(monkeypatch):
+    assert connection_options() == CONNECTION_OPTIONS
+    monkeypatch.setenv('DAS_MONGODB_MAX_POOL_SIZE', '10')
+    monkeypatch.setenv('DAS_COUCHBASE_KV_TIMEOUT', '7.5')
+    options = connection_options(mongodb_timeout_ms=1000)
+    assert options['mongodb_max_pool_size'] == 10
+    assert options['couchbase_kv_timeout'] == 7.5
+    assert options['mongodb_timeout_ms'] == 1000
+    assert options['mongodb_min_pool_size'] == CONNECTION_OPTIONS['mongodb_min_pool_size']
+
+def test_shared_connections():
+    manager = connection_manager()
+    assert manager is connection_manager()
+    assert manager.mongo_database('das').client is manager.mongo_database('das2').client
+    assert manager.couchbase_bucket('das') is manager.couchbase_bucket('das')
+    pool_count = len(manager.mongo_clients)
+    manager.mongo_database('das', mongodb_max_pool_size=5)
+    manager.mongo_database('das2', mongodb_max_pool_size=5)
+    assert len(manager.mongo_clients) == pool_count + 1
+
+def test_shared_atom_space_connections():
+    das1 = DistributedAtomSpace()
+    das2 = DistributedAtomSpace(node_cache_size=1000)
+    # Only the connections are shared, each atom space has its own caches
+    assert das1.db is not das2.db
+    assert das1.mongo_db.client is das2.mongo_db.client
+    assert das1.couch_db is das2.couch_db
+
+def test_concurrent_connection_manager(monkeypatch):
+    monkeypatch.setattr(ConnectionManager, "_ConnectionManager__instance", None)
+    started = Barrier(8)
+    answers = []
+    def get_instance():
+        started.wait()
+        answers.append(connection_manager())
+    threads = [Thread(target=get_instance) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(answers) == 8
+    assert all(answer is answers[0] for answer in answers)
@@ -1,34 +1,172 @@
-import os
-from signal import raise_signal
-from typing import List, Dict, Optional, Union, Any, Tuple
+import random
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Union, Any, Tuple, Iterator, FrozenSet
 
 from couchbase.bucket import Bucket
 from couchbase.collection import CBCollection as CouchbaseCollection
 from couchbase.exceptions import DocumentNotFoundException
+from pymongo.collection import Collection
 from pymongo.database import Database
+from pymongo.errors import OperationFailure
 
 from das.expression_hasher import ExpressionHasher
 from das.database.couchbase_schema import CollectionNames as CouchbaseCollectionNames
 from das.database.mongo_schema import CollectionNames as MongoCollectionNames, FieldNames as MongoFieldNames
+from das.database.mongo_schema import SECONDARY_INDEXES
 
 from .db_interface import DBInterface, WILDCARD, UNORDERED_LINK_TYPES
+from .key_value_cache import KeyValueCache, CachePolicy, freeze
+from .bloom_filter import BloomFilter
+from .ngram_index import name_ngrams, ngram_key, literal_pattern
+from .handle_encoding import HandleEncoding, HandleCodec, EncodedCollection
+from .pattern_index import PatternIndex
+from .index_advisor import PatternUsage
+from .statistics import StatisticsCatalog
+from .posting_list import head_block_count, head_bounds, blocks_containing, intersect_postings
+
+# Default limits (in bytes) of the read-through caches kept in front
+# of the Couchbase collections queried by CouchMongoDB
+COUCHBASE_CACHE_SIZE = {
+    CouchbaseCollectionNames.INCOMING_SET: 64 * 1024 * 1024,
+    CouchbaseCollectionNames.OUTGOING_SET: 64 * 1024 * 1024,
+    CouchbaseCollectionNames.PATTERNS: 256 * 1024 * 1024,
+    CouchbaseCollectionNames.TEMPLATES: 128 * 1024 * 1024,
+    CouchbaseCollectionNames.NAME_NGRAMS: 64 * 1024 * 1024,
+}
+
+# Number of blocks of a multi-block Couchbase value being read ahead
+# while the previous ones are consumed by streaming readers
+COUCHBASE_READ_AHEAD = 4
+
+# Number of parallel cursors (each one reading a range of _id) used
+# to load node documents in prefetch()
+PREFETCH_CURSORS = 8
+PREFETCH_BATCH_SIZE = 10000
+
+# Page size used to list nodes from MongoDB when they aren't all prefetched
+NODE_PAGE_SIZE = 10000
+
+# Max number of handles in the $in filter of each batched query
+MONGO_BATCH_SIZE = 10000
+
+# Bloom filters are sized with room for the atoms added after they're built
+BLOOM_FILTER_GROWTH = 1.5
+BLOOM_FILTER_SLACK = 100000
+
+BLOOM_FILTER_CAPACITY = 'capacity'
+BLOOM_FILTER_ERROR_RATE = 'error_rate'
+BLOOM_FILTER_COUNT = 'count'
+BLOOM_FILTER_BLOCKS = 'blocks'
+BLOOM_FILTER_BITS = 'bits'
+
+# Metadata documents (in the metadata collection)
+HANDLE_ENCODING = 'handle_encoding'
+PATTERN_INDEX = 'pattern_index'
+PATTERN_USAGE = 'pattern_usage'
+STATISTICS = 'statistics'
+# Recorded by loads into a database whose nodes all have their name n-grams
+# indexed (databases loaded before the n-gram index was added don't)
+NGRAM_INDEX = 'ngram_index'
+METADATA_VALUE = 'value'
+
+# Rows of a materialized view are stored in blocks of this size (in
+# documents VIEW_NAME_VERSION_0, VIEW_NAME_VERSION_1, ... after the view's
+# head). Each save writes a new version so the blocks of the previous one
+# are still there while the head is replaced.
+VIEW_BLOCK_SIZE = 10000
+VIEW_BLOCKS = 'blocks'
+VIEW_VERSION = 'version'
+VIEW_HEAD = 'view'
+VIEW_ROWS = 'rows'
+VIEW_DEFINITION = 'definition'
+
+# Keys which aren't materialized in the pattern index and bind at least this
+# number of targets are answered by intersecting the targets' incoming sets
+INCOMING_SET_MIN_BOUND_TARGETS = 2
+
+# Links collections are probed from the most to the least likely arity
+LINK_COLLECTION_PROBING_ORDER = ['2', '1', 'N']
+
+NODE_DOCUMENT_PROJECTION = [
+    MongoFieldNames.ID_HASH,
+    MongoFieldNames.TYPE_NAME,
+    MongoFieldNames.NODE_NAME,
+    MongoFieldNames.TYPE,
+]
+
+TYPE_DOCUMENT_PROJECTION = [
+    MongoFieldNames.ID_HASH,
+    MongoFieldNames.TYPE_NAME,
+    MongoFieldNames.TYPE_NAME_HASH,
+    MongoFieldNames.TYPE,
+]
+
+def _handle_ranges(count: int) -> List[Tuple[Optional[str], Optional[str]]]:
+    # Splits the space of (hex) handles in count contiguous ranges
+    # [lower, upper) with open ends in the first and last ranges
+    count = max(1, min(count, 0x10000))
+    # Bounds are padded to the size of a handle so they can be encoded as one
+    bounds = [f'{(i * 0x10000) // count:04x}'.ljust(32, '0') for i in range(1, count)]
+    return list(zip([None, *bounds], [*bounds, None]))
 
 class CouchMongoDB(DBInterface):
 
-    def __init__(self, couch_db: Bucket, mongo_db: Database):
+    def __init__(
+        self,
+        couch_db: Bucket,
+        mongo_db: Database,
+        couchbase_cache_size: Optional[Dict[str, int]] = None,
+        couchbase_cache_policy: CachePolicy = CachePolicy.LRU,
+        prefetch_cursors: int = PREFETCH_CURSORS,
+        node_cache_size: Optional[int] = None,
+        node_bloom_filter: bool = False,
+        handle_encoding: Optional[HandleEncoding] = None,
+        pattern_index: Optional[PatternIndex] = None):
+
         self.couch_db = couch_db
         self.mongo_db = mongo_db
         self.couch_incoming_collection = couch_db.collection(CouchbaseCollectionNames.INCOMING_SET)
         self.couch_outgoing_collection = couch_db.collection(CouchbaseCollectionNames.OUTGOING_SET)
         self.couch_patterns_collection = couch_db.collection(CouchbaseCollectionNames.PATTERNS)
         self.couch_templates_collection = couch_db.collection(CouchbaseCollectionNames.TEMPLATES)
-        self.mongo_link_collection = {
-            '1': self.mongo_db.get_collection(MongoCollectionNames.LINKS_ARITY_1),
-            '2': self.mongo_db.get_collection(MongoCollectionNames.LINKS_ARITY_2),
-            'N': self.mongo_db.get_collection(MongoCollectionNames.LINKS_ARITY_N),
+        self.couch_name_ngrams_collection = couch_db.collection(CouchbaseCollectionNames.NAME_NGRAMS)
+        self.couch_collection = {
+            CouchbaseCollectionNames.INCOMING_SET: self.couch_incoming_collection,
+            CouchbaseCollectionNames.OUTGOING_SET: self.couch_outgoing_collection,
+            CouchbaseCollectionNames.PATTERNS: self.couch_patterns_collection,
+            CouchbaseCollectionNames.TEMPLATES: self.couch_templates_collection,
+            CouchbaseCollectionNames.NAME_NGRAMS: self.couch_name_ngrams_collection,
+        }
+        cache_size = dict(COUCHBASE_CACHE_SIZE)
+        if couchbase_cache_size is not None:
+            cache_size.update(couchbase_cache_size)
+        self.couchbase_executor = ThreadPoolExecutor(max_workers=COUCHBASE_READ_AHEAD)
+        # Secondary indexes are built one at a time in background
+        self.mongo_index_executor = ThreadPoolExecutor(max_workers=1)
+        self.mongo_index_builds = {}
+        self.couchbase_cache = {
+            collection_name: KeyValueCache(cache_size[collection_name], couchbase_cache_policy)
+            for collection_name in self.couch_collection
         }
-        self.mongo_nodes_collection = self.mongo_db.get_collection(MongoCollectionNames.NODES)
-        self.mongo_types_collection = self.mongo_db.get_collection(MongoCollectionNames.ATOM_TYPES)
+        self.mongo_views_collection = self.mongo_db.get_collection(MongoCollectionNames.MATERIALIZED_VIEWS)
+        # See get_view_definitions()
+        self.view_definitions = None
+        self.mongo_bloom_filters_collection = self.mongo_db.get_collection(MongoCollectionNames.BLOOM_FILTERS)
+        self.mongo_metadata_collection = self.mongo_db.get_collection(MongoCollectionNames.METADATA)
+        # Handles are hex strings in memory and in this class' API whatever
+        # the encoding used to store them (see handle_encoding.py)
+        self.requested_handle_encoding = handle_encoding
+        self.handle_codec = HandleCodec(HandleEncoding.HEX)
+        self._setup_handle_encoding()
+        # Pattern keys which are materialized by the loader (see pattern_index.py)
+        self.requested_pattern_index = pattern_index
+        self.pattern_index = PatternIndex()
+        self._setup_pattern_index()
+        # Pattern keys requested since the last save_pattern_usage()
+        self.pattern_usage = PatternUsage()
+        self.link_handles = {}
         self.wildcard_hash = ExpressionHasher._compute_hash(WILDCARD)
         self.named_type_hash = None
         self.named_type_hash_reverse = None
@@ -37,6 +175,18 @@ class CouchMongoDB(DBInterface):
         self.terminal_hash = None
         self.parent_type = None
         self.node_documents = None
+        # composite_type_hash -> ([handles], [names]) of the prefetched nodes
+        self.nodes_by_type = None
+        self.type_documents = None
+        self.prefetch_cursors = prefetch_cursors
+        # If node_cache_size is set, node documents are fetched on demand and
+        # kept in a cache bounded to that size (in bytes) instead of being
+        # all loaded by prefetch()
+        self.node_cache_size = node_cache_size
+        self.node_bloom_filter = node_bloom_filter
+        self.node_handles = None
+        # Whether get_matched_node_name() can use the n-gram index
+        self.ngram_index = False
         self.typedef_mark_hash = ExpressionHasher._compute_hash(":")
         self.typedef_base_type_hash = ExpressionHasher._compute_hash("Type")
         self.typedef_composite_type_hash = ExpressionHasher.composite_hash([
@@ -44,6 +194,56 @@ class CouchMongoDB(DBInterface):
             self.typedef_base_type_hash,
             self.typedef_base_type_hash])
 
+    def _is_empty(self) -> bool:
+        return self.mongo_db.get_collection(MongoCollectionNames.NODES).find_one() is None
+
+    def _setup_pattern_index(self) -> None:
+        # Same as the handle encoding: the requested policies can only change
+        # the ones recorded in the database while it's empty
+        document = self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: PATTERN_INDEX})
+        stored = PatternIndex.from_dict(document[METADATA_VALUE]) if document else self.pattern_index
+        requested = self.requested_pattern_index or stored
+        if requested != stored and not self._is_empty():
+            raise ValueError(f'Pattern index policies in this database are: {stored.to_dict()}')
+        if document is None or requested != stored:
+            self.mongo_metadata_collection.replace_one(
+                {MongoFieldNames.ID_HASH: PATTERN_INDEX}, {METADATA_VALUE: requested.to_dict()}, upsert=True)
+        self.pattern_index = requested
+
+    def _setup_handle_encoding(self) -> None:
+        # The encoding recorded in the database is used unless the database
+        # is empty, in which case the requested one (if any) is recorded
+        document = self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: HANDLE_ENCODING})
+        if document is not None:
+            stored_encoding = HandleEncoding(document[METADATA_VALUE])
+        else:
+            # Databases without this record were loaded with hex handles
+            # (or just cleared, keeping the current encoding)
+            stored_encoding = self.handle_codec.encoding
+        encoding = HandleEncoding(self.requested_handle_encoding or stored_encoding)
+        if encoding != stored_encoding and not self._is_empty():
+            raise ValueError(f'Handles in this database are stored as {stored_encoding.value}')
+        if document is None or encoding != stored_encoding:
+            self.mongo_metadata_collection.replace_one(
+                {MongoFieldNames.ID_HASH: HANDLE_ENCODING}, {METADATA_VALUE: encoding.value}, upsert=True)
+        self.handle_codec = HandleCodec(encoding)
+        self.mongo_link_collection = {
+            '1': self.mongo_collection(MongoCollectionNames.LINKS_ARITY_1),
+            '2': self.mongo_collection(MongoCollectionNames.LINKS_ARITY_2),
+            'N': self.mongo_collection(MongoCollectionNames.LINKS_ARITY_N),
+        }
+        self.mongo_nodes_collection = self.mongo_collection(MongoCollectionNames.NODES)
+        self.mongo_types_collection = self.mongo_collection(MongoCollectionNames.ATOM_TYPES)
+
+    def mongo_collection(self, collection_name: str) -> Collection:
+        """
+        Atoms collection which reads and writes documents with hex handles.
+        """
+        collection = self.mongo_db.get_collection(collection_name)
+        if self.handle_codec.binary:
+            return EncodedCollection(collection, self.handle_codec)
+        return collection
+
     def _get_atom_type_hash(self, atom_type):
         #TODO: implement a proper mongo collection to atom types so instead
         #      of this lazy hashmap, we should load the hashmap during prefetch
@@ -59,31 +259,31 @@ class CouchMongoDB(DBInterface):
         node_handle = self.terminal_hash.get(composite_name, None)
         if node_handle is None:
             node_handle = ExpressionHasher.terminal_hash(node_type, node_name)
-            self.terminal_hash[composite_name] = node_handle
+            if self.node_cache_size is None:
+                self.terminal_hash[composite_name] = node_handle
         return node_handle
 
-    def prefetch(self) -> None:
-        self.named_type_hash = {}
-        self.named_type_hash_reverse = {}
-        self.named_types = {}
-        self.symbol_hash = {}
-        self.terminal_hash = {}
-        self.parent_type = {}
-        self.node_documents = {}
-        for document in self.mongo_nodes_collection.find():
-            node_id = document[MongoFieldNames.ID_HASH]
-            node_type = document[MongoFieldNames.TYPE_NAME]
-            node_name = document[MongoFieldNames.NODE_NAME]
-            self.node_documents[node_id] = document
-            self.terminal_hash[(node_type, node_name)] = node_id
-        for document in self.mongo_types_collection.find():
-            hash_id = document[MongoFieldNames.ID_HASH]
+    def _get_node_document(self, handle: str) -> Optional[Dict]:
+        if self.node_cache_size is None:
+            return self.node_documents.get(handle, None)
+        document = self.node_documents.get(handle)
+        if document is None:
+            if self.node_bloom_filter and self.node_handles is not None and handle not in self.node_handles:
+                return None
+            document = self.mongo_nodes_collection.find_one(
+                {MongoFieldNames.ID_HASH: handle}, NODE_DOCUMENT_PROJECTION)
+            if document is not None:
+                self.node_documents.put(handle, document)
+        return document
+
+    def _cache_type_documents(self, documents: List[Dict]) -> None:
+        for document in documents:
+            self.type_documents[document[MongoFieldNames.ID_HASH]] = document
+        # Parent types are resolved in memory, without a query per type
+        for hash_id, document in self.type_documents.items():
             named_type = document[MongoFieldNames.TYPE_NAME]
             named_type_hash = document[MongoFieldNames.TYPE_NAME_HASH]
-            composite_type_hash = document[MongoFieldNames.TYPE]
-            type_document = self.mongo_types_collection.find_one({
-                MongoFieldNames.ID_HASH: composite_type_hash
-            })
+            type_document = self.type_documents.get(document[MongoFieldNames.TYPE], None)
             self.named_type_hash[named_type] = named_type_hash
             self.named_type_hash_reverse[named_type_hash] = named_type
             if type_document is not None:
@@ -91,38 +291,422 @@ class CouchMongoDB(DBInterface):
                 self.parent_type[named_type_hash] = type_document[MongoFieldNames.TYPE_NAME_HASH]
             self.symbol_hash[named_type] = hash_id
 
+    def _cache_node_documents(self, documents: List[Dict]) -> None:
+        if self.node_cache_size is not None:
+            return
+        for document in documents:
+            node_id = document[MongoFieldNames.ID_HASH]
+            node_type = document[MongoFieldNames.TYPE_NAME]
+            node_name = document[MongoFieldNames.NODE_NAME]
+            if node_id not in self.node_documents:
+                handles, names = self.nodes_by_type.setdefault(document[MongoFieldNames.TYPE], ([], []))
+                handles.append(node_id)
+                names.append(node_name)
+            self.node_documents[node_id] = document
+            self.terminal_hash[(node_type, node_name)] = node_id
+
+    def _fetch_node_documents(self, id_range: Tuple[Optional[str], Optional[str]]) -> List[Dict]:
+        lower_bound, upper_bound = id_range
+        id_filter = {}
+        if lower_bound is not None:
+            id_filter['$gte'] = lower_bound
+        if upper_bound is not None:
+            id_filter['$lt'] = upper_bound
+        mongo_filter = {MongoFieldNames.ID_HASH: id_filter} if id_filter else {}
+        cursor = self.mongo_nodes_collection.find(mongo_filter, NODE_DOCUMENT_PROJECTION)
+        return list(cursor.batch_size(PREFETCH_BATCH_SIZE))
+
+    def _fetch_handles(self, collection: Collection, id_range: Tuple[Optional[str], Optional[str]]) -> List[str]:
+        lower_bound, upper_bound = id_range
+        id_filter = {}
+        if lower_bound is not None:
+            id_filter['$gte'] = lower_bound
+        if upper_bound is not None:
+            id_filter['$lt'] = upper_bound
+        mongo_filter = {MongoFieldNames.ID_HASH: id_filter} if id_filter else {}
+        cursor = collection.find(mongo_filter, [MongoFieldNames.ID_HASH])
+        return [document[MongoFieldNames.ID_HASH] for document in cursor.batch_size(PREFETCH_BATCH_SIZE)]
+
+    def _build_bloom_filter(self, collection: Collection) -> BloomFilter:
+        count = collection.estimated_document_count()
+        bloom_filter = BloomFilter(int(count * BLOOM_FILTER_GROWTH) + BLOOM_FILTER_SLACK)
+        id_ranges = _handle_ranges(self.prefetch_cursors)
+        with ThreadPoolExecutor(max_workers=len(id_ranges)) as executor:
+            for handles in executor.map(lambda id_range: self._fetch_handles(collection, id_range), id_ranges):
+                bloom_filter.update(handles)
+        return bloom_filter
+
+    def _save_bloom_filter(self, name: str, bloom_filter: BloomFilter, only_dirty: bool = False) -> None:
+        for i, block in bloom_filter.blocks(only_dirty):
+            self.mongo_bloom_filters_collection.replace_one(
+                {MongoFieldNames.ID_HASH: f'{name}_{i}'}, {BLOOM_FILTER_BITS: block}, upsert=True)
+        self.mongo_bloom_filters_collection.replace_one({MongoFieldNames.ID_HASH: name}, {
+            BLOOM_FILTER_CAPACITY: bloom_filter.capacity,
+            BLOOM_FILTER_ERROR_RATE: bloom_filter.error_rate,
+            BLOOM_FILTER_COUNT: bloom_filter.count,
+            BLOOM_FILTER_BLOCKS: bloom_filter.block_count(),
+        }, upsert=True)
+
+    def _load_bloom_filter(self, name: str) -> Optional[BloomFilter]:
+        header = self.mongo_bloom_filters_collection.find_one({MongoFieldNames.ID_HASH: name})
+        if header is None:
+            return None
+        blocks = []
+        for i in range(header[BLOOM_FILTER_BLOCKS]):
+            document = self.mongo_bloom_filters_collection.find_one({MongoFieldNames.ID_HASH: f'{name}_{i}'})
+            if document is None:
+                return None
+            blocks.append(document[BLOOM_FILTER_BITS])
+        return BloomFilter.from_blocks(
+            header[BLOOM_FILTER_CAPACITY],
+            header[BLOOM_FILTER_ERROR_RATE],
+            header[BLOOM_FILTER_COUNT],
+            blocks)
+
+    def _load_valid_bloom_filter(self, collection: Collection) -> Optional[BloomFilter]:
+        bloom_filter = self._load_bloom_filter(collection.name)
+        # A filter which missed some insertion can't be trusted
+        if bloom_filter is not None and bloom_filter.count < collection.estimated_document_count():
+            bloom_filter = None
+        return bloom_filter
+
+    def _update_bloom_filter(
+        self,
+        collection: Collection,
+        bloom_filter: Optional[BloomFilter],
+        new_handles: List[str],
+        persist: bool = True) -> BloomFilter:
+
+        if bloom_filter is None or (persist and bloom_filter.count + len(new_handles) > bloom_filter.capacity):
+            # Missing or full filters are rebuilt from the collection. Filters
+            # which aren't persisted yet keep taking handles past their
+            # capacity (with more false positives) and are rebuilt once
+            # they're saved.
+            bloom_filter = self._build_bloom_filter(collection)
+            self._save_bloom_filter(collection.name, bloom_filter)
+        elif new_handles:
+            bloom_filter.update(new_handles)
+            if persist:
+                self._save_bloom_filter(collection.name, bloom_filter, only_dirty=True)
+        return bloom_filter
+
+    def _load_link_locator(self) -> None:
+        self.link_handles = {
+            key: self._load_valid_bloom_filter(collection)
+            for key, collection in self.mongo_link_collection.items()
+        }
+
+    def update_link_locator(self, handles: Dict[str, List[str]], persist: bool = True) -> None:
+        """
+        Adds the handles of links just inserted in each links collection
+        (keyed by '1', '2' or 'N') to the locator filters and persist them.
+        Loads add them in memory only (persist=False) and save the filters
+        once they're done (see save_link_locator()) because handles are
+        random so each batch changes most of the blocks of the filters.
+        That also spares a rebuild each time a filter fills up during a load.
+        """
+        for key, collection in self.mongo_link_collection.items():
+            self.link_handles[key] = self._update_bloom_filter(
+                collection, self.link_handles.get(key, None), handles.get(key, []), persist)
+
+    def save_link_locator(self) -> None:
+        """
+        Persist the blocks of the locator filters changed since they were
+        last saved. Until then the persisted filters count less handles than
+        their collections so they're rebuilt if they're loaded.
+        """
+        for key, collection in self.mongo_link_collection.items():
+            bloom_filter = self.link_handles.get(key, None)
+            if bloom_filter is None:
+                continue
+            if bloom_filter.saturated():
+                # Sized for the links loaded so far
+                self.link_handles[key] = self._build_bloom_filter(collection)
+                self._save_bloom_filter(collection.name, self.link_handles[key])
+            else:
+                self._save_bloom_filter(collection.name, bloom_filter, only_dirty=True)
+
+    def update_node_filter(self, handles: List[str]) -> None:
+        """
+        Adds the handles of nodes just inserted to the persisted nodes filter
+        (only used, and so only kept, with node_cache_size and
+        node_bloom_filter set).
+        """
+        if self.node_cache_size is None or not self.node_bloom_filter:
+            return
+        bloom_filter = self.node_handles
+        if bloom_filter is None:
+            bloom_filter = self._load_valid_bloom_filter(self.mongo_nodes_collection)
+        self.node_handles = self._update_bloom_filter(self.mongo_nodes_collection, bloom_filter, handles)
+
+    def _locate_link(self, handle: str) -> List[str]:
+        # Links collections (in probing order) which may have the passed handle
+        return [
+            key for key in LINK_COLLECTION_PROBING_ORDER
+            if self.link_handles.get(key, None) is None or handle in self.link_handles[key]
+        ]
+
+    def prefetch(self) -> None:
+        self._setup_handle_encoding()
+        self._setup_pattern_index()
+        self.named_type_hash = {}
+        self.named_type_hash_reverse = {}
+        self.named_types = {}
+        self.symbol_hash = {}
+        self.terminal_hash = {}
+        self.parent_type = {}
+        self.type_documents = {}
+        self.node_handles = None
+        self.view_definitions = None
+        self.ngram_index = self._is_empty() or \
+            self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: NGRAM_INDEX}) is not None
+        self._cache_type_documents(list(self.mongo_types_collection.find({}, TYPE_DOCUMENT_PROJECTION)))
+        id_ranges = _handle_ranges(self.prefetch_cursors)
+        if self.node_cache_size is None:
+            self.node_documents = {}
+            self.nodes_by_type = {}
+            with ThreadPoolExecutor(max_workers=len(id_ranges)) as executor:
+                for documents in executor.map(self._fetch_node_documents, id_ranges):
+                    self._cache_node_documents(documents)
+        else:
+            self.node_documents = KeyValueCache(self.node_cache_size)
+            self.nodes_by_type = None
+            if self.node_bloom_filter:
+                self.node_handles = self._load_valid_bloom_filter(self.mongo_nodes_collection)
+                if self.node_handles is None:
+                    self.node_handles = self._update_bloom_filter(self.mongo_nodes_collection, None, [])
+        self._load_link_locator()
+
+    def refresh_prefetched(self, type_documents: List[Dict], node_documents: List[Dict]) -> None:
+        """
+        Add documents just inserted by the loader to the prefetched caches
+        so they don't need to be re-read from MongoDB.
+        """
+        self._cache_type_documents(type_documents)
+        self._cache_node_documents(node_documents)
+        self.view_definitions = None
+
+    def save_ngram_index(self) -> None:
+        """
+        Record that every node has its name n-grams indexed. Called after
+        loads into databases which were empty or already had the record.
+        """
+        self.mongo_metadata_collection.replace_one(
+            {MongoFieldNames.ID_HASH: NGRAM_INDEX}, {METADATA_VALUE: True}, upsert=True)
+
     def _retrieve_mongo_document(self, handle: str, arity=-1) -> dict:
         mongo_filter = {MongoFieldNames.ID_HASH: handle}
         if arity > 0:
             if arity == 2:
-                collection = self.mongo_link_collection['2']
+                key = '2'
             elif arity == 1:
-                collection = self.mongo_link_collection['1']
+                key = '1'
             else:
-                collection = self.mongo_link_collection['N']
-            return collection.find_one(mongo_filter)
-        document = self.node_documents.get(handle, None)
+                key = 'N'
+            bloom_filter = self.link_handles.get(key, None)
+            if bloom_filter is not None and handle not in bloom_filter:
+                return None
+            return self.mongo_link_collection[key].find_one(mongo_filter)
+        document = self._get_node_document(handle)
         if document:
             return document
         # The order of keys in search is important. Greater to smallest probability of proper arity
-        for collection in [self.mongo_link_collection[key] for key in ['2', '1', 'N']]:
+        for collection in [self.mongo_link_collection[key] for key in self._locate_link(handle)]:
             document = collection.find_one(mongo_filter)
             if document:
                 return document
         return None
 
-    def _retrieve_couchbase_value(self, collection: CouchbaseCollection, key: str) -> List[str]:
+    def _find_by_handles(
+        self,
+        collection: Collection,
+        handles: List[str],
+        projection=None,
+        mongo_filter: Optional[Dict] = None) -> List[Dict]:
+
+        answer = []
+        for i in range(0, len(handles), MONGO_BATCH_SIZE):
+            batch_filter = {MongoFieldNames.ID_HASH: {'$in': handles[i:i + MONGO_BATCH_SIZE]}}
+            if mongo_filter:
+                batch_filter.update(mongo_filter)
+            answer.extend(collection.find(batch_filter, projection))
+        return answer
+
+    def _get_node_documents(self, handles: List[str]) -> Dict[str, Dict]:
+        # Batched version of _get_node_document()
+        if self.node_cache_size is None:
+            return {
+                handle: self.node_documents[handle]
+                for handle in handles if handle in self.node_documents
+            }
+        answer = {}
+        missing = []
+        for handle in handles:
+            document = self.node_documents.get(handle)
+            if document is not None:
+                answer[handle] = document
+            elif not self.node_bloom_filter or self.node_handles is None or handle in self.node_handles:
+                missing.append(handle)
+        for document in self._find_by_handles(self.mongo_nodes_collection, missing, NODE_DOCUMENT_PROJECTION):
+            handle = document[MongoFieldNames.ID_HASH]
+            self.node_documents.put(handle, document)
+            answer[handle] = document
+        return answer
+
+    def _retrieve_mongo_documents(self, arities: Dict[str, int]) -> Dict[str, Dict]:
+        # Batched version of _retrieve_mongo_document() for the handles in
+        # arities (handle -> arity), with a single query per collection
+        answer = self._get_node_documents([handle for handle, arity in arities.items() if arity <= 0])
+        link_handles = {key: [] for key in LINK_COLLECTION_PROBING_ORDER}
+        for handle, arity in arities.items():
+            if handle in answer:
+                continue
+            if arity > 0:
+                key = '2' if arity == 2 else '1' if arity == 1 else 'N'
+                bloom_filter = self.link_handles.get(key, None)
+                if bloom_filter is None or handle in bloom_filter:
+                    link_handles[key].append(handle)
+            else:
+                for key in self._locate_link(handle):
+                    link_handles[key].append(handle)
+        for key, handles in link_handles.items():
+            for document in self._find_by_handles(self.mongo_link_collection[key], handles):
+                answer[document[MongoFieldNames.ID_HASH]] = document
+        return answer
+
+    def _fetch_couchbase_value(self, collection: CouchbaseCollection, key: str) -> List[str]:
+        codec = self.handle_codec
         try:
-            value = collection.get(key)
+            value = collection.get(key, **codec.couchbase_options)
         except DocumentNotFoundException as e:
-            return []
-        if isinstance(value.content, list):
-            return value.content
+            return ()
+        block_count = head_block_count(value.content)
+        if block_count is None:
+            return freeze(codec.decode_value(value.content))
+        # All the blocks are requested at once
+        block_keys = [key + f'_{i}' for i in range(block_count)]
+        blocks = collection.get_multi(block_keys, **codec.couchbase_options)
+        answer = []
+        for block_key in block_keys:
+            answer.extend(codec.decode_value(blocks[block_key].content))
+        return freeze(answer)
+
+    def _retrieve_couchbase_value(self, collection_name: str, key: str) -> Tuple:
+        collection = self.couch_collection[collection_name]
+        cache = self.couchbase_cache[collection_name]
+        value = cache.get(key)
+        if value is None:
+            value = self._fetch_couchbase_value(collection, key)
+            cache.put(key, value)
+        # Values are frozen (see KeyValueCache) so the cached one is returned
+        return value
+
+    def _iterate_couchbase_value(self, collection_name: str, key: str) -> Iterator[Any]:
+        """
+        Iterate over the entries of a Couchbase value without building the
+        whole list. Blocks of multi-block values are read ahead in parallel
+        and yielded as they arrive, in order. Only single-block values go
+        to the cache.
+        """
+        collection = self.couch_collection[collection_name]
+        cache = self.couchbase_cache[collection_name]
+        value = cache.get(key)
+        if value is not None:
+            yield from value
+            return
+        codec = self.handle_codec
+        try:
+            value = collection.get(key, **codec.couchbase_options).content
+        except DocumentNotFoundException as e:
+            return
+        block_count = head_block_count(value)
+        if block_count is None:
+            value = freeze(codec.decode_value(value))
+            cache.put(key, value)
+            yield from value
+            return
+        pending = deque()
+        next_block = 0
+        while next_block < block_count or pending:
+            while next_block < block_count and len(pending) < COUCHBASE_READ_AHEAD:
+                pending.append(self.couchbase_executor.submit(
+                    collection.get, key + f'_{next_block}', **codec.couchbase_options))
+                next_block += 1
+            yield from freeze(codec.decode_value(pending.popleft().result().content))
+
+    def _retrieve_posting_directory(self, collection_name: str, key: str) -> Tuple[Optional[Tuple], Optional[Tuple]]:
+        """
+        Return (value, None) if the value is small (or was loaded without
+        block bounds) or (None, bounds) with the bounds of its blocks, so
+        they can be fetched selectively by _retrieve_posting_blocks().
+        """
+        cache = self.couchbase_cache[collection_name]
+        value = cache.get(key)
+        if value is not None:
+            return value, None
+        directory_key = f'{key}_directory'
+        bounds = cache.get(directory_key)
+        if bounds is not None:
+            return None, bounds
+        codec = self.handle_codec
+        try:
+            head = self.couch_collection[collection_name].get(key, **codec.couchbase_options).content
+        except DocumentNotFoundException as e:
+            return (), None
+        if head_block_count(head) is None:
+            value = freeze(codec.decode_value(head))
+            cache.put(key, value)
+            return value, None
+        bounds = head_bounds(head)
+        if bounds is None:
+            return self._retrieve_couchbase_value(collection_name, key), None
+        bounds = freeze(bounds)
+        cache.put(directory_key, bounds)
+        return None, bounds
+
+    def _retrieve_posting_blocks(self, collection_name: str, key: str, bounds: List, handles: List[str]) -> List[Any]:
+        # Entries of the blocks which may contain any of the (sorted) handles
+        collection = self.couch_collection[collection_name]
+        cache = self.couchbase_cache[collection_name]
+        codec = self.handle_codec
         answer = []
-        for i in range(value.content):
-            answer.extend(collection.get(key + f'_{i}').content)
+        missing = []
+        blocks = {}
+        for i in blocks_containing(bounds, handles):
+            block_key = f'{key}_{i}'
+            block = cache.get(block_key)
+            if block is None:
+                missing.append(block_key)
+            else:
+                blocks[block_key] = block
+        if missing:
+            for block_key, result in collection.get_multi(missing, **codec.couchbase_options).items():
+                block = freeze(codec.decode_value(result.content))
+                cache.put(block_key, block)
+                blocks[block_key] = block
+        for block_key in sorted(blocks, key=lambda k: int(k.rsplit('_', 1)[1])):
+            answer.extend(blocks[block_key])
         return answer
 
+    def invalidate_couchbase_cache(self, collection_name: Optional[str] = None, keys: Optional[List[str]] = None) -> None:
+        collection_names = [collection_name] if collection_name is not None else self.couchbase_cache.keys()
+        for name in collection_names:
+            cache = self.couchbase_cache.get(name, None)
+            if cache is None:
+                continue
+            if keys is None:
+                cache.clear()
+            else:
+                for key in keys:
+                    cache.invalidate(key)
+                    cache.invalidate(f'{key}_directory')
+
+    def couchbase_cache_statistics(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            collection_name.value: cache.statistics_dict()
+            for collection_name, cache in self.couchbase_cache.items()
+        }
+
     def _build_named_type_hash_template(self, template: Union[str, List[Any]]) -> List[Any]:
         if isinstance(template, str):
             return self._get_atom_type_hash(template)
@@ -157,28 +741,78 @@ class CouchMongoDB(DBInterface):
                 answer.append(key)
             index += 1
 
-    def _build_deep_representation(self, handle, arity=-1):
-        answer = {}
-        document = self.node_documents.get(handle, None)
-        if document is None:
-            document = self._retrieve_mongo_document(handle, arity)
-            answer["type"] = document[MongoFieldNames.TYPE_NAME]
-            answer["targets"] = []
-            for target_handle in self._get_mongo_document_keys(document):
-                answer["targets"].append(self._build_deep_representation(target_handle))
-        else:
-            answer["type"] = document[MongoFieldNames.TYPE_NAME]
-            answer["name"] = document[MongoFieldNames.NODE_NAME]
-        return answer
+    def _build_deep_representations(self, handles: List[str], arities: List[int]) -> List[Dict]:
+        # Documents are fetched level by level (all the targets of a level
+        # in one batch) and each subtree is built only once
+        documents = {}
+        level = {}
+        for handle, arity in zip(handles, arities):
+            level.setdefault(handle, arity)
+        while level:
+            level_documents = self._retrieve_mongo_documents(level)
+            next_level = {}
+            for handle in level:
+                document = level_documents.get(handle, None)
+                if document is None:
+                    raise ValueError(f'Invalid handle: {handle}')
+                documents[handle] = document
+                if MongoFieldNames.NODE_NAME not in document:
+                    for target_handle in self._get_mongo_document_keys(document):
+                        if target_handle not in documents:
+                            next_level[target_handle] = -1
+            level = next_level
+        memo = {}
+        def build(handle):
+            answer = memo.get(handle, None)
+            if answer is None:
+                document = documents[handle]
+                answer = {"type": document[MongoFieldNames.TYPE_NAME]}
+                if MongoFieldNames.NODE_NAME in document:
+                    answer["name"] = document[MongoFieldNames.NODE_NAME]
+                else:
+                    answer["targets"] = [build(target) for target in self._get_mongo_document_keys(document)]
+                memo[handle] = answer
+            return answer
+        return [build(handle) for handle in handles]
 
+    def _get_all_nodes_paged(
+        self,
+        node_type_hash: str,
+        names: bool,
+        offset: int = 0,
+        limit: Optional[int] = None) -> List[str]:
+
+        field = MongoFieldNames.NODE_NAME if names else MongoFieldNames.ID_HASH
+        mongo_filter = {MongoFieldNames.TYPE: node_type_hash}
+        if limit is not None:
+            cursor = self.mongo_nodes_collection \
+                .find(mongo_filter, NODE_DOCUMENT_PROJECTION) \
+                .sort(MongoFieldNames.ID_HASH) \
+                .skip(offset) \
+                .limit(limit)
+            return [document[field] for document in cursor]
+        answer = []
+        last_handle = None
+        while True:
+            mongo_filter = {MongoFieldNames.TYPE: node_type_hash}
+            if last_handle is not None:
+                mongo_filter[MongoFieldNames.ID_HASH] = {'$gt': last_handle}
+            cursor = self.mongo_nodes_collection \
+                .find(mongo_filter, NODE_DOCUMENT_PROJECTION) \
+                .sort(MongoFieldNames.ID_HASH)
+            if last_handle is None and offset:
+                cursor = cursor.skip(offset)
+            page = list(cursor.limit(NODE_PAGE_SIZE))
+            answer.extend(document[field] for document in page)
+            if len(page) < NODE_PAGE_SIZE:
+                return answer
+            last_handle = page[-1][MongoFieldNames.ID_HASH]
 
     # DB interface methods
 
     def node_exists(self, node_type: str, node_name: str) -> bool:
         node_handle = self._get_node_handle(node_type, node_name)
-        # TODO: use a specific query to nodes table
-        document = self._retrieve_mongo_document(node_handle)
-        return document is not None
+        return self._get_node_document(node_handle) is not None
 
     def link_exists(self, link_type: str, target_handles: List[str]) -> bool:
         link_handle = ExpressionHasher.expression_hash(self._get_atom_type_hash(link_type), target_handles)
@@ -193,7 +827,7 @@ class CouchMongoDB(DBInterface):
         return link_handle
 
     def get_link_targets(self, link_handle: str) -> List[str]:
-        answer = self._retrieve_couchbase_value(self.couch_outgoing_collection, link_handle)
+        answer = self._retrieve_couchbase_value(CouchbaseCollectionNames.OUTGOING_SET, link_handle)
         if not answer:
             raise ValueError(f"Invalid handle: {link_handle}")
         return answer[1:]
@@ -204,6 +838,101 @@ class CouchMongoDB(DBInterface):
             raise ValueError(f'Invalid handle: {link_handle}')
         return True
 
+    def _pattern_query(self, link_type: str, target_handles: List[str]) -> Tuple[Optional[str], List[str]]:
+        if link_type == WILDCARD:
+            link_type_hash = WILDCARD
+        else:
+            link_type_hash = self._get_atom_type_hash(link_type)
+        if link_type in UNORDERED_LINK_TYPES:
+            target_handles = sorted(target_handles)
+        return link_type_hash, target_handles
+
+    def _match_by_incoming_sets(self, link_type_hash: str, target_handles: List[str]) -> List[Any]:
+        # Links with all the bound targets are in the intersection of their
+        # incoming sets. Then the link documents are filtered by type (in the
+        # query) and by the positions of the targets.
+        # Incoming sets split in blocks are intersected last, reading only the
+        # blocks which may contain the handles left
+        bound_targets = set(handle for handle in target_handles if handle != WILDCARD)
+        postings = []
+        directories = []
+        for handle in bound_targets:
+            value, bounds = self._retrieve_posting_directory(CouchbaseCollectionNames.INCOMING_SET, handle)
+            if bounds is None:
+                postings.append(value)
+            else:
+                directories.append((len(bounds), handle, bounds))
+        directories.sort()
+        if not postings:
+            _, handle, _ = directories.pop(0)
+            postings.append(self._retrieve_couchbase_value(CouchbaseCollectionNames.INCOMING_SET, handle))
+        candidates = intersect_postings(postings)
+        for _, handle, bounds in directories:
+            if not candidates:
+                break
+            candidates = intersect_postings([candidates, self._retrieve_posting_blocks(
+                CouchbaseCollectionNames.INCOMING_SET, handle, bounds, candidates)])
+        if not candidates:
+            return []
+        arity = len(target_handles)
+        collection = self.mongo_link_collection['2' if arity == 2 else '1' if arity == 1 else 'N']
+        mongo_filter = {} if link_type_hash == WILDCARD else {MongoFieldNames.TYPE_NAME_HASH: link_type_hash}
+        answer = []
+        for document in self._find_by_handles(collection, candidates, mongo_filter=mongo_filter):
+            targets = self._get_mongo_document_keys(document)
+            if len(targets) == arity and all(query in [WILDCARD, target] for query, target in zip(target_handles, targets)):
+                answer.append((document[MongoFieldNames.ID_HASH], tuple(targets)))
+        return answer
+
+    def _match_by_type_templates(self, link_type: str, arity: int) -> List[Any]:
+        # Keys binding no targets are only missing the links of black listed
+        # types, which are taken from the type templates
+        if link_type == WILDCARD:
+            pattern_hash = ExpressionHasher.composite_hash([WILDCARD, *([WILDCARD] * arity)])
+            answer = list(self._retrieve_couchbase_value(CouchbaseCollectionNames.PATTERNS, pattern_hash))
+            link_types = self.pattern_index.black_list
+        else:
+            answer = []
+            link_types = [link_type]
+        for named_type in link_types:
+            named_type_hash = self._get_atom_type_hash(named_type)
+            if named_type_hash is None:
+                continue
+            entries = self._retrieve_couchbase_value(CouchbaseCollectionNames.TEMPLATES, named_type_hash)
+            answer.extend(entry for entry in entries if len(entry[1]) == arity)
+        return answer
+
+    def _intersect_matched_links(
+        self,
+        link_type: str,
+        link_type_hash: str,
+        target_handles: List[str],
+        bound: FrozenSet[int]) -> List[Any]:
+
+        # The pattern key isn't materialized so its posting list is built by
+        # intersecting the incoming sets of its targets or the posting lists
+        # of narrower keys
+        if not bound:
+            return self._match_by_type_templates(link_type, len(target_handles))
+        if len(bound) >= INCOMING_SET_MIN_BOUND_TARGETS:
+            return self._match_by_incoming_sets(link_type_hash, target_handles)
+        cover = self.pattern_index.cover(link_type, bound)
+        if cover is None:
+            return self._match_by_incoming_sets(link_type_hash, target_handles)
+        answer = None
+        for positions in cover:
+            key = [handle if i in positions else WILDCARD for i, handle in enumerate(target_handles)]
+            pattern_hash = ExpressionHasher.composite_hash([link_type_hash, *key])
+            entries = self._retrieve_couchbase_value(CouchbaseCollectionNames.PATTERNS, pattern_hash)
+            if answer is None:
+                answer = {entry[0]: entry for entry in entries}
+            else:
+                handles = set(entry[0] for entry in entries)
+                answer = {handle: entry for handle, entry in answer.items() if handle in handles}
+            if not answer:
+                return []
+        return list(answer.values())
+
     def get_matched_links(self, link_type: str, target_handles: List[str]):
         if link_type != WILDCARD and WILDCARD not in target_handles:
             try:
@@ -212,31 +941,64 @@ class CouchMongoDB(DBInterface):
                 return [link_handle] if document else []
             except ValueError:
                 return []
-        if link_type == WILDCARD:
-            link_type_hash = WILDCARD
-        else:
-            link_type_hash = self._get_atom_type_hash(link_type)
+        link_type_hash, target_handles = self._pattern_query(link_type, target_handles)
         if link_type_hash is None:
             return []
-        if link_type in UNORDERED_LINK_TYPES:
-            target_handles = sorted(target_handles)
+        bound = frozenset(i for i, handle in enumerate(target_handles) if handle != WILDCARD)
+        self.pattern_usage.record(link_type, len(target_handles), bound)
+        if not self.pattern_index.materialized(link_type, bound):
+            return self._intersect_matched_links(link_type, link_type_hash, target_handles, bound)
         pattern_hash = ExpressionHasher.composite_hash([link_type_hash, *target_handles])
-        return self._retrieve_couchbase_value(self.couch_patterns_collection, pattern_hash)
+        return self._retrieve_couchbase_value(CouchbaseCollectionNames.PATTERNS, pattern_hash)
 
-    def get_all_nodes(self, node_type: str, names: bool = False) -> List[str]:
+    def get_matched_links_iterator(self, link_type: str, target_handles: List[str]) -> Iterator[Any]:
+        if link_type != WILDCARD and WILDCARD not in target_handles:
+            return iter(self.get_matched_links(link_type, target_handles))
+        link_type_hash, target_handles = self._pattern_query(link_type, target_handles)
+        if link_type_hash is None:
+            return iter([])
+        bound = frozenset(i for i, handle in enumerate(target_handles) if handle != WILDCARD)
+        self.pattern_usage.record(link_type, len(target_handles), bound)
+        if not self.pattern_index.materialized(link_type, bound):
+            return iter(self._intersect_matched_links(link_type, link_type_hash, target_handles, bound))
+        pattern_hash = ExpressionHasher.composite_hash([link_type_hash, *target_handles])
+        return self._iterate_couchbase_value(CouchbaseCollectionNames.PATTERNS, pattern_hash)
+
+    def get_all_nodes(
+        self,
+        node_type: str,
+        names: bool = False,
+        offset: int = 0,
+        limit: Optional[int] = None) -> List[str]:
+
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError(f'Invalid page: offset={offset} limit={limit}')
         node_type_hash = self._get_atom_type_hash(node_type)
         if node_type_hash is None:
             raise ValueError(f'Invalid node type: {node_type}')
-        if names:
-            return [\
-                document[MongoFieldNames.NODE_NAME] \
-                for document in self.node_documents.values() \
-                if document[MongoFieldNames.TYPE] == node_type_hash]
-        else:
-            return [\
-                document[MongoFieldNames.ID_HASH] \
-                for document in self.node_documents.values() \
-                if document[MongoFieldNames.TYPE] == node_type_hash]
+        if self.node_cache_size is not None:
+            return self._get_all_nodes_paged(node_type_hash, names, offset, limit)
+        handles, node_names = self.nodes_by_type.get(node_type_hash, ([], []))
+        answer = node_names if names else handles
+        end = None if limit is None else offset + limit
+        return answer[offset:end]
+
+    def sample_nodes(self, node_type: str, count: int, names: bool = False) -> List[str]:
+        """
+        Return up to count nodes of the passed type chosen at random.
+        """
+        if count < 0:
+            raise ValueError(f'Invalid sample size: {count}')
+        node_type_hash = self._get_atom_type_hash(node_type)
+        if self.node_cache_size is not None:
+            field = MongoFieldNames.NODE_NAME if names else MongoFieldNames.ID_HASH
+            return [document[field] for document in self.mongo_nodes_collection.aggregate([
+                {'$match': {MongoFieldNames.TYPE: node_type_hash}},
+                {'$sample': {'size': count}},
+                {'$project': {field: 1}}])]
+        handles, node_names = self.nodes_by_type.get(node_type_hash, ([], []))
+        answer = node_names if names else handles
+        return [answer[i] for i in random.sample(range(len(answer)), min(count, len(answer)))]
 
     def get_matched_type_template(self, template: List[Any]) -> List[str]:
         try:
@@ -244,31 +1006,72 @@ class CouchMongoDB(DBInterface):
             template_hash = ExpressionHasher.composite_hash(template)
         except KeyError as exception:
             raise ValueError(f'{exception}\nInvalid type')
-        return self._retrieve_couchbase_value(self.couch_templates_collection, template_hash)
+        return self._retrieve_couchbase_value(CouchbaseCollectionNames.TEMPLATES, template_hash)
+
+    def get_matched_type_template_iterator(self, template: List[Any]) -> Iterator[Any]:
+        try:
+            template = self._build_named_type_hash_template(template)
+            template_hash = ExpressionHasher.composite_hash(template)
+        except KeyError as exception:
+            raise ValueError(f'{exception}\nInvalid type')
+        return self._iterate_couchbase_value(CouchbaseCollectionNames.TEMPLATES, template_hash)
 
     def get_matched_type(self, link_type: str) -> List[str]:
         named_type_hash = self._get_atom_type_hash(link_type)
-        return self._retrieve_couchbase_value(self.couch_templates_collection, named_type_hash)
+        return self._retrieve_couchbase_value(CouchbaseCollectionNames.TEMPLATES, named_type_hash)
 
     def get_node_name(self, node_handle: str) -> str:
-        document = self.node_documents.get(node_handle, None)
+        document = self._get_node_document(node_handle)
         if not document:
             raise ValueError(f'Invalid node handle: {node_handle}')
         return document[MongoFieldNames.NODE_NAME]
 
+    def _get_ngram_candidates(self, node_type_hash: str, substring: str) -> List[str]:
+        # Handles of the nodes having all the n-grams of substring
+        postings = [
+            self._retrieve_couchbase_value(CouchbaseCollectionNames.NAME_NGRAMS, ngram_key(node_type_hash, ngram))
+            for ngram in name_ngrams(substring)
+        ]
+        postings.sort(key=len)
+        answer = set(postings[0])
+        for posting in postings[1:]:
+            if not answer:
+                break
+            answer.intersection_update(posting)
+        return list(answer)
+
     def get_matched_node_name(self, node_type: str, substring: str) -> str: 
         node_type_hash = self._get_atom_type_hash(node_type)
         mongo_filter = {
             MongoFieldNames.TYPE: node_type_hash,
             MongoFieldNames.NODE_NAME: {'$regex': substring}
         }
-        return [document[MongoFieldNames.ID_HASH] for document in self.mongo_nodes_collection.find(mongo_filter)]
+        literal = literal_pattern(substring)
+        # Databases without a complete n-gram index are scanned
+        if literal is None or not self.ngram_index:
+            return [document[MongoFieldNames.ID_HASH] for document in self.mongo_nodes_collection.find(mongo_filter)]
+        candidates = self._get_ngram_candidates(node_type_hash, literal[0])
+        if not candidates:
+            return []
+        if self.node_cache_size is None:
+            text, prefix = literal
+            answer = []
+            for handle in candidates:
+                document = self.node_documents.get(handle, None)
+                if document is None or document[MongoFieldNames.TYPE] != node_type_hash:
+                    continue
+                name = document[MongoFieldNames.NODE_NAME]
+                if name.startswith(text) if prefix else text in name:
+                    answer.append(handle)
+            return answer
+        return [document[MongoFieldNames.ID_HASH] for document in self._find_by_handles(
+            self.mongo_nodes_collection, candidates, [MongoFieldNames.ID_HASH], mongo_filter)]
 
     #################################
 
     def get_atom_as_dict(self, handle, arity=-1) -> dict:
         answer = {}
-        document = self.node_documents.get(handle, None) if arity <= 0 else None
+        document = self._get_node_document(handle) if arity <= 0 else None
         if document is None:
             document = self._retrieve_mongo_document(handle, arity)
             if document:
@@ -283,7 +1086,12 @@ class CouchMongoDB(DBInterface):
         return answer
 
     def get_atom_as_deep_representation(self, handle: str, arity=-1) -> str:
-        return self._build_deep_representation(handle, arity)
+        return self._build_deep_representations([handle], [arity])[0]
+
+    def get_atoms_as_deep_representation(self, handles: List[str], arities: Optional[List[int]] = None) -> List[Dict]:
+        if arities is None:
+            arities = [-1] * len(handles)
+        return self._build_deep_representations(handles, arities)
 
     def count_atoms(self) -> Tuple[int, int]:
         node_count = self.mongo_nodes_collection.estimated_document_count()
@@ -291,3 +1099,156 @@ class CouchMongoDB(DBInterface):
         for collection in self.mongo_link_collection.values():
             link_count += collection.estimated_document_count()
         return (node_count, link_count)
+
+    def update_statistics(self, statistics: StatisticsCatalog) -> None:
+        # Statistics of each load (or transaction) are merged into the stored
+        # ones, which are dropped with the rest of the database when it's cleared
+        document = self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: STATISTICS})
+        stored = StatisticsCatalog.from_dict(document[METADATA_VALUE] if document else None)
+        stored.merge(statistics)
+        self.mongo_metadata_collection.replace_one(
+            {MongoFieldNames.ID_HASH: STATISTICS}, {METADATA_VALUE: stored.to_dict()}, upsert=True)
+
+    def statistics(self) -> Dict[str, Any]:
+        document = self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: STATISTICS})
+        return StatisticsCatalog.from_dict(document[METADATA_VALUE] if document else None).to_dict()
+
+    def save_pattern_usage(self) -> None:
+        """
+        Add the pattern keys requested by this process to the ones recorded
+        in the database.
+        """
+        usage = self.pattern_usage
+        self.pattern_usage = PatternUsage()
+        stored = self.stored_pattern_usage()
+        stored.merge(usage)
+        self.mongo_metadata_collection.replace_one(
+            {MongoFieldNames.ID_HASH: PATTERN_USAGE}, {METADATA_VALUE: stored.to_dict()}, upsert=True)
+
+    def stored_pattern_usage(self) -> PatternUsage:
+        document = self.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: PATTERN_USAGE})
+        return PatternUsage.from_dict(document[METADATA_VALUE] if document else None)
+
+    def _wait_for_mongo_indexes(self) -> None:
+        for future in list(self.mongo_index_builds.values()):
+            future.exception()
+
+    def build_mongo_indexes(self, wait: bool = False) -> None:
+        """
+        Create the secondary indexes in SECONDARY_INDEXES which don't exist.
+        They're built in background unless wait is True.
+        """
+        self._wait_for_mongo_indexes()
+        self.mongo_index_builds = {}
+        for collection_name, index_name, fields in SECONDARY_INDEXES:
+            collection = self.mongo_db.get_collection(collection_name)
+            self.mongo_index_builds[(collection_name, index_name)] = self.mongo_index_executor.submit(
+                collection.create_index, fields, name=index_name, background=True)
+        if wait:
+            self._wait_for_mongo_indexes()
+
+    def drop_mongo_indexes(self) -> None:
+        """
+        Drop the secondary indexes in SECONDARY_INDEXES (before bulk loads,
+        which are faster without them).
+        """
+        self._wait_for_mongo_indexes()
+        self.mongo_index_builds = {}
+        for collection_name, index_name, _ in SECONDARY_INDEXES:
+            collection = self.mongo_db.get_collection(collection_name)
+            if index_name in collection.index_information():
+                collection.drop_index(index_name)
+
+    def mongo_index_status(self) -> List[Dict[str, Any]]:
+        """
+        State of each secondary index: 'ready', 'building', 'failed' (with
+        the error) or 'missing'.
+        """
+        answer = []
+        existing = {}
+        for collection_name, index_name, fields in SECONDARY_INDEXES:
+            if collection_name not in existing:
+                existing[collection_name] = self.mongo_db.get_collection(collection_name).index_information()
+            status = {
+                'collection': collection_name.value,
+                'name': index_name,
+                'fields': [field for field, _ in fields],
+            }
+            future = self.mongo_index_builds.get((collection_name, index_name), None)
+            if future is not None and not future.done():
+                status['status'] = 'building'
+            elif future is not None and future.exception() is not None:
+                status['status'] = 'failed'
+                status['error'] = str(future.exception())
+            else:
+                status['status'] = 'ready' if index_name in existing[collection_name] else 'missing'
+            answer.append(status)
+        return answer
+
+    def mongo_index_sizes(self) -> Dict[str, Dict[str, int]]:
+        """
+        Size in bytes of every index (secondary or not) of the atom
+        collections, as reported by the server.
+        """
+        answer = {}
+        for collection_name in sorted(set(collection_name for collection_name, _, _ in SECONDARY_INDEXES)):
+            try:
+                stats = self.mongo_db.command('collStats', collection_name.value)
+            except OperationFailure:
+                # The collection doesn't exist (yet)
+                continue
+            answer[collection_name.value] = dict(stats.get('indexSizes', {}))
+        return answer
+
+    def save_view(self, name: str, view: Dict[str, Any]) -> None:
+        rows = view[VIEW_ROWS]
+        blocks = [rows[i:i + VIEW_BLOCK_SIZE] for i in range(0, len(rows), VIEW_BLOCK_SIZE)]
+        version = uuid.uuid4().hex
+        for i, block in enumerate(blocks):
+            self.mongo_views_collection.replace_one(
+                {MongoFieldNames.ID_HASH: f'{name}_{version}_{i}'},
+                {VIEW_HEAD: name, VIEW_VERSION: version, VIEW_ROWS: block},
+                upsert=True)
+        head = {key: value for key, value in view.items() if key != VIEW_ROWS}
+        head[VIEW_BLOCKS] = len(blocks)
+        head[VIEW_VERSION] = version
+        self.mongo_views_collection.replace_one({MongoFieldNames.ID_HASH: name}, head, upsert=True)
+        self.mongo_views_collection.delete_many({VIEW_HEAD: name, VIEW_VERSION: {'$ne': version}})
+        self.view_definitions = None
+
+    def get_view(self, name: str) -> Optional[Dict[str, Any]]:
+        while True:
+            head = self.mongo_views_collection.find_one({MongoFieldNames.ID_HASH: name})
+            if head is None or VIEW_BLOCKS not in head:
+                return None
+            view = {
+                key: value for key, value in head.items()
+                if key not in [MongoFieldNames.ID_HASH, VIEW_BLOCKS, VIEW_VERSION]
+            }
+            view[VIEW_ROWS] = []
+            # Views saved before blocks were versioned have no version
+            version = head.get(VIEW_VERSION, None)
+            prefix = name if version is None else f'{name}_{version}'
+            for i in range(head[VIEW_BLOCKS]):
+                document = self.mongo_views_collection.find_one({MongoFieldNames.ID_HASH: f'{prefix}_{i}'})
+                if document is None:
+                    # Saved again (and its blocks deleted) while it was read
+                    break
+                view[VIEW_ROWS].extend(document[VIEW_ROWS])
+            else:
+                return view
+
+    def get_view_definitions(self) -> Dict[str, Dict[str, Any]]:
+        # Definitions are read by every query so they're cached until views
+        # are saved or dropped, the database is prefetched again or loaded
+        if self.view_definitions is None:
+            self.view_definitions = {
+                document[MongoFieldNames.ID_HASH]: document[VIEW_DEFINITION]
+                for document in self.mongo_views_collection.find({VIEW_BLOCKS: {'$exists': True}})
+            }
+        return dict(self.view_definitions)
+
+    def drop_view(self, name: str) -> None:
+        self.view_definitions = None
+        self.mongo_views_collection.delete_many({VIEW_HEAD: name})
+        self.mongo_views_collection.delete_one({MongoFieldNames.ID_HASH: name})
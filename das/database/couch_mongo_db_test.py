@@ -8,8 +8,9 @@ from couchbase.bucket import Bucket
 from couchbase.cluster import Cluster
 from pymongo import MongoClient as MongoDBClient
 
-from das.database.db_interface import DBInterface
-from das.database.couch_mongo_db import CouchMongoDB
+from das.database.db_interface import DBInterface, WILDCARD
+from das.database.couch_mongo_db import CouchMongoDB, NGRAM_INDEX, VIEW_BLOCKS, VIEW_DEFINITION, VIEW_HEAD, VIEW_ROWS
+from das.database.posting_list import intersect_postings, block_bounds, blocks_containing, head_block_count, posting_head
 from das.database.couchbase_schema import CollectionNames as CouchbaseCollectionNames
 from das.database.mongo_schema import CollectionNames as MongoCollectionNames, FieldNames as MongoFieldNames
 
@@ -204,6 +205,21 @@ def test_get_all_nodes(db: DBInterface):
     nodes_in_db = db.get_all_nodes('blah')
     assert len(nodes_in_db) == 0
     
+def test_get_all_nodes_paging_and_sampling(db: DBInterface):
+    nodes_in_db = db.get_all_nodes('Concept')
+    names_in_db = db.get_all_nodes('Concept', names=True)
+    assert db.get_all_nodes('Concept', offset=10) == nodes_in_db[10:]
+    assert db.get_all_nodes('Concept', offset=4, limit=5) == nodes_in_db[4:9]
+    assert db.get_all_nodes('Concept', names=True, limit=3) == names_in_db[:3]
+    assert db.get_all_nodes('Concept', offset=20) == []
+    sample = db.sample_nodes('Concept', 5)
+    assert len(sample) == 5 and len(set(sample)) == 5
+    assert all(node in nodes_in_db for node in sample)
+    assert sorted(db.sample_nodes('Concept', 100, names=True)) == sorted(names_in_db)
+    assert db.sample_nodes('blah', 5) == []
+    with pytest.raises(ValueError):
+        db.get_all_nodes('Concept', offset=-1)
+
 def test_get_matched_links(db: DBInterface):
     # TODO: once we have API to add nodes/links, add a
     #       testcase like Eval(PN, List(X, Y)) where the
@@ -285,7 +301,283 @@ def test_get_matched_node_name(db: DBInterface):
     assert sorted(db.get_matched_node_name('blah', 'Concept')) == []
     assert sorted(db.get_matched_node_name('Concept', 'blah')) == []
 
+def test_get_matched_node_name_with_ngram_index(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    animal = db.get_node_handle('Concept', 'animal')
+    assert sorted(db.get_matched_node_name('Concept', 'mal')) == sorted([mammal, animal])
+    assert db.get_matched_node_name('Concept', '^ani') == [animal]
+    assert db.get_matched_node_name('Concept', '^nim') == []
+    assert db.get_matched_node_name('Concept', 'h.man') == [human]
+    assert db.get_matched_node_name('Concept', 'ammal$') == [mammal]
+    assert db.get_matched_node_name('blah', 'mal') == []
+
+def test_get_matched_node_name_without_ngram_index(db: DBInterface, monkeypatch):
+    mammal = db.get_node_handle('Concept', 'mammal')
+    animal = db.get_node_handle('Concept', 'animal')
+    assert db.ngram_index
+    document = db.mongo_metadata_collection.find_one({MongoFieldNames.ID_HASH: NGRAM_INDEX})
+    db.mongo_metadata_collection.delete_one({MongoFieldNames.ID_HASH: NGRAM_INDEX})
+    try:
+        # Databases loaded before the n-gram index have no record of it
+        # and their node names are scanned
+        db.prefetch()
+        assert not db.ngram_index
+        def fail(*args):
+            raise AssertionError("n-gram index used")
+        monkeypatch.setattr(db, "_get_ngram_candidates", fail)
+        assert sorted(db.get_matched_node_name('Concept', 'mal')) == sorted([mammal, animal])
+    finally:
+        db.mongo_metadata_collection.insert_one(document)
+
+def test_get_matched_node_name_in_batches(couch_db, mongo_db, monkeypatch):
+    monkeypatch.setattr("das.database.couch_mongo_db.MONGO_BATCH_SIZE", 1)
+    db = CouchMongoDB(couch_db, mongo_db, node_cache_size=1000)
+    db.prefetch()
+    mammal = db.get_node_handle('Concept', 'mammal')
+    animal = db.get_node_handle('Concept', 'animal')
+    assert sorted(db.get_matched_node_name('Concept', 'mal')) == sorted([mammal, animal])
+
+def test_get_atoms_as_deep_representation(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    link = db.get_link_handle('Inheritance', [human, mammal])
+    assert db.get_atom_as_deep_representation(link, 2) == {
+        'type': 'Inheritance',
+        'targets': [{'type': 'Concept', 'name': 'human'}, {'type': 'Concept', 'name': 'mammal'}]}
+    answer = db.get_atoms_as_deep_representation([link, human, link], [2, -1, -1])
+    assert answer[0] == answer[2] == db.get_atom_as_deep_representation(link)
+    assert answer[1] == {'type': 'Concept', 'name': 'human'}
+    with pytest.raises(ValueError):
+        db.get_atoms_as_deep_representation([link, 'blah'])
+
 def test_atom_count(db: DBInterface):
     node_count, link_count = db.count_atoms()
     assert node_count == 14
     assert link_count == 26
+
+def test_couchbase_cache(db: DBInterface):
+    mammal = db.get_node_handle('Concept', 'mammal')
+    db.invalidate_couchbase_cache()
+    v1 = db.get_matched_links('Inheritance', ['*', mammal])
+    v2 = db.get_matched_links('Inheritance', ['*', mammal])
+    # Hits answer the cached list without copying it
+    assert v1 is v2
+    assert len(v1) == 4
+    statistics = db.couchbase_cache_statistics()['patterns']
+    assert statistics['misses'] == 1
+    assert statistics['hits'] == 1
+    db.invalidate_couchbase_cache('patterns')
+    assert db.couchbase_cache_statistics()['patterns']['entries'] == 0
+
+def test_matched_links_iterator(db: DBInterface):
+    mammal = db.get_node_handle('Concept', 'mammal')
+    assert list(db.get_matched_links_iterator('Inheritance', ['*', mammal])) == \
+        list(db.get_matched_links('Inheritance', ['*', mammal]))
+    assert list(db.get_matched_links_iterator('Inheritance', ['blah', mammal])) == []
+    assert sorted(db.get_matched_type_template_iterator(['Inheritance', 'Concept', 'Concept'])) == \
+        sorted(db.get_matched_type_template(['Inheritance', 'Concept', 'Concept']))
+
+def test_multi_block_couchbase_values(db: DBInterface):
+    collection = db.couch_collection[CouchbaseCollectionNames.PATTERNS]
+    blocks = [[f'h{i}_{j}' for j in range(3)] for i in range(7)]
+    collection.upsert('multi_block_test_key', len(blocks))
+    for i, block in enumerate(blocks):
+        collection.upsert(f'multi_block_test_key_{i}', block)
+    expected = [handle for block in blocks for handle in block]
+    try:
+        assert db._fetch_couchbase_value(collection, 'multi_block_test_key') == tuple(expected)
+        assert list(db._iterate_couchbase_value(CouchbaseCollectionNames.PATTERNS, 'multi_block_test_key')) == expected
+        assert list(db._iterate_couchbase_value(CouchbaseCollectionNames.PATTERNS, 'blah')) == []
+    finally:
+        collection.remove('multi_block_test_key')
+        for i in range(len(blocks)):
+            collection.remove(f'multi_block_test_key_{i}')
+
+def test_bounded_node_cache(couch_db, mongo_db):
+    bounded_db = CouchMongoDB(couch_db, mongo_db, node_cache_size=1000, node_bloom_filter=True)
+    bounded_db.prefetch()
+    assert len(bounded_db.node_documents) == 0
+    assert len(bounded_db.terminal_hash) == 0
+    for node_type, node_name in NODE_SPECS:
+        assert bounded_db.node_exists(node_type, node_name)
+        handle = bounded_db.get_node_handle(node_type, node_name)
+        assert bounded_db.get_node_name(handle) == node_name
+    assert not bounded_db.node_exists('Concept', 'blah')
+    assert bounded_db.node_documents.current_size <= 1000
+    nodes_in_db = bounded_db.get_all_nodes('Concept')
+    assert len(nodes_in_db) == 14
+    assert sorted(bounded_db.get_all_nodes('Concept', names=True)) == sorted(name for _, name in NODE_SPECS)
+    assert len(bounded_db.get_all_nodes('blah')) == 0
+    assert len(bounded_db.get_all_nodes('Concept', offset=10)) == 4
+    assert bounded_db.get_all_nodes('Concept', offset=4, limit=5) == sorted(nodes_in_db)[4:9]
+    assert len(bounded_db.sample_nodes('Concept', 5)) == 5
+    assert sorted(bounded_db.get_matched_node_name('Concept', 'mal')) == sorted([
+        bounded_db.get_node_handle('Concept', 'mammal'),
+        bounded_db.get_node_handle('Concept', 'animal')])
+
+def test_link_locator(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    assert all(db.link_handles[key] is not None for key in ['1', '2', 'N'])
+    handle = db.get_link_handle('Inheritance', [human, mammal])
+    assert db._locate_link(handle) == ['2']
+    assert db._locate_link(db.get_link_handle('Inheritance', [mammal, human])) == []
+    assert db.get_atom_as_dict(handle)['handle'] == handle
+    assert db.get_atom_as_dict(db.get_link_handle('Inheritance', [mammal, human])) == {}
+
+def test_deferred_link_locator_save(db: DBInterface):
+    name = db.mongo_link_collection['2'].name
+    count = db._load_bloom_filter(name).count
+    handle = 'f' * 32
+    db.update_link_locator({'2': [handle]}, persist=False)
+    assert handle in db.link_handles['2']
+    assert db._load_bloom_filter(name).count == count
+    db.save_link_locator()
+    saved = db._load_bloom_filter(name)
+    assert saved.count == count + 1
+    assert handle in saved
+
+def test_link_locator_filled_by_a_load(db: DBInterface, monkeypatch):
+    name = db.mongo_link_collection['2'].name
+    builds = []
+    build_bloom_filter = db._build_bloom_filter
+    def counted_build(collection):
+        builds.append(collection.name)
+        return build_bloom_filter(collection)
+    monkeypatch.setattr(db, "_build_bloom_filter", counted_build)
+    capacity = db.link_handles['2'].capacity
+    handles = [f'{i:032x}' for i in range(capacity + 10)]
+    # Filters filled up by a load aren't rebuilt until they're saved
+    for i in range(0, len(handles), 100):
+        db.update_link_locator({'2': handles[i:i + 100]}, persist=False)
+    assert builds == []
+    assert db.link_handles['2'].saturated()
+    assert all(handle in db.link_handles['2'] for handle in handles)
+    try:
+        db.save_link_locator()
+        assert builds == [name]
+        assert not db.link_handles['2'].saturated()
+    finally:
+        db.link_handles = {}
+        db._save_bloom_filter(name, build_bloom_filter(db.mongo_link_collection['2']))
+
+def test_node_filter_mode(couch_db, mongo_db):
+    db = CouchMongoDB(couch_db, mongo_db)
+    db.prefetch()
+    db.update_node_filter(['f' * 32])
+    assert db.node_handles is None
+
+def test_bloom_filter_negative_lookups(couch_db, mongo_db):
+    db = CouchMongoDB(couch_db, mongo_db, node_cache_size=1000, node_bloom_filter=True)
+    db.prefetch()
+    human = db.get_node_handle('Concept', 'human')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    db.update_node_filter([])
+    assert db.node_handles is not None
+    assert human in db.node_handles
+    assert db.get_node_handle('Concept', 'blah') not in db.node_handles
+    handle = db.get_link_handle('Inheritance', [mammal, human])
+    assert handle not in db.link_handles['2']
+    assert not db.link_exists('Inheritance', [mammal, human])
+    assert db.link_exists('Inheritance', [human, mammal])
+
+def test_view_saved_while_read(db: DBInterface, monkeypatch):
+    name = 'concurrent_view_test'
+    monkeypatch.setattr("das.database.couch_mongo_db.VIEW_BLOCK_SIZE", 2)
+    rows = [{'X': f'{i:032x}'} for i in range(5)]
+    db.save_view(name, {VIEW_DEFINITION: {}, VIEW_ROWS: rows})
+    collection = db.mongo_views_collection
+    find_one = collection.find_one
+    def find_one_and_save(mongo_filter, *args, **kwargs):
+        answer = find_one(mongo_filter, *args, **kwargs)
+        if mongo_filter[MongoFieldNames.ID_HASH] == name and answer[VIEW_BLOCKS] == 3:
+            # Saved again after its head was read
+            db.save_view(name, {VIEW_DEFINITION: {}, VIEW_ROWS: rows[:3]})
+        return answer
+    monkeypatch.setattr(collection, "find_one", find_one_and_save)
+    try:
+        assert db.get_view(name)[VIEW_ROWS] == rows[:3]
+        # Only the blocks of the last version are kept
+        assert collection.count_documents({VIEW_HEAD: name}) == 2
+    finally:
+        monkeypatch.undo()
+        db.drop_view(name)
+    assert db.get_view(name) is None
+    assert collection.count_documents({VIEW_HEAD: name}) == 0
+
+def test_intersect_postings():
+    assert intersect_postings([]) == []
+    assert intersect_postings([["c", "a", "b", "a"]]) == ["a", "b", "c"]
+    assert intersect_postings([["a", "b", "d", "f", "g"], ["b", "c", "g"], ["g", "b", "z"]]) == ["b", "g"]
+    assert intersect_postings([["a", "b"], ["c"]]) == []
+
+def test_match_by_incoming_sets(db: DBInterface):
+    human = db.get_node_handle('Concept', 'human')
+    monkey = db.get_node_handle('Concept', 'monkey')
+    mammal = db.get_node_handle('Concept', 'mammal')
+    incoming = db._retrieve_couchbase_value(CouchbaseCollectionNames.INCOMING_SET, human)
+    assert incoming == tuple(sorted(incoming))
+    similarity = db._get_atom_type_hash('Similarity')
+    expected = db.get_matched_links('Similarity', [human, WILDCARD])
+    # Targets of unordered links are sorted (and so are wildcards)
+    assert sorted(db._match_by_incoming_sets(similarity, sorted([human, WILDCARD]))) == sorted(expected)
+    human_monkey = sorted([human, monkey])
+    assert sorted(db._match_by_incoming_sets(similarity, human_monkey)) == sorted(db.get_matched_links(WILDCARD, human_monkey))
+    assert db._match_by_incoming_sets(WILDCARD, [human, mammal]) == [(db.get_link_handle('Inheritance', [human, mammal]), (human, mammal))]
+    assert db._match_by_incoming_sets(similarity, [human, mammal]) == []
+
+def test_block_skipping_posting_lists(db: DBInterface):
+    collection = db.couch_collection[CouchbaseCollectionNames.INCOMING_SET]
+    human = db.get_node_handle('Concept', 'human')
+    monkey = db.get_node_handle('Concept', 'monkey')
+    # A hub with a sorted posting list split in blocks of 3 handles, two of
+    # them links between human and monkey
+    links = sorted(db._retrieve_couchbase_value(CouchbaseCollectionNames.INCOMING_SET, monkey))
+    handles = sorted(set([*[f'{i:032x}' for i in range(10)], *links]))
+    blocks = [handles[i:i + 3] for i in range(0, len(handles), 3)]
+    hub = 'block_skipping_test_key'
+    for i, block in enumerate(blocks):
+        collection.upsert(f'{hub}_{i}', block)
+    collection.upsert(hub, posting_head([block_bounds(block) for block in blocks]))
+    try:
+        assert db._fetch_couchbase_value(collection, hub) == tuple(handles)
+        assert list(db._iterate_couchbase_value(CouchbaseCollectionNames.INCOMING_SET, hub)) == handles
+        value, bounds = db._retrieve_posting_directory(CouchbaseCollectionNames.INCOMING_SET, hub)
+        assert value is None and len(bounds) == len(blocks)
+        assert db._retrieve_posting_blocks(CouchbaseCollectionNames.INCOMING_SET, hub, bounds, [handles[4]]) == blocks[1]
+        human_links = db._retrieve_couchbase_value(CouchbaseCollectionNames.INCOMING_SET, human)
+        # Only the blocks with human's links are read to intersect with them
+        expected = intersect_postings([human_links, links])
+        assert len(expected) == 2
+        selected = db._retrieve_posting_blocks(CouchbaseCollectionNames.INCOMING_SET, hub, bounds, expected)
+        assert len(selected) < len(handles)
+        assert intersect_postings([human_links, selected]) == expected
+    finally:
+        db.invalidate_couchbase_cache()
+        collection.remove(hub)
+        for i in range(len(blocks)):
+            collection.remove(f'{hub}_{i}')
+
+def test_posting_list_directory():
+    bounds = [["a", "c"], ["d", "f"], ["g", "k"]]
+    assert blocks_containing(bounds, ["b"]) == [0]
+    assert blocks_containing(bounds, ["c", "h", "z"]) == [0, 2]
+    assert blocks_containing(bounds, ["ca", "l"]) == []
+    assert head_block_count(3) == 3
+    assert head_block_count(posting_head(bounds)) == 3
+    assert head_block_count(["a", "b"]) is None
+    assert block_bounds([["h1", ["t1"]], ["h2", ["t2"]]]) == ["h1", "h2"]
+
+def test_mongo_secondary_indexes(db: DBInterface):
+    db.build_mongo_indexes(wait=True)
+    status = db.mongo_index_status()
+    assert status and all(index['status'] == 'ready' for index in status)
+    nodes = [index for index in status if index['collection'] == MongoCollectionNames.NODES.value]
+    assert [MongoFieldNames.TYPE.value, MongoFieldNames.NODE_NAME.value] in [index['fields'] for index in nodes]
+    assert set(index['collection'] for index in status) == set([
+        'nodes', 'atom_types', 'links_1', 'links_2', 'links_n'])
+    db.drop_mongo_indexes()
+    assert all(index['status'] == 'missing' for index in db.mongo_index_status())
+    db.build_mongo_indexes(wait=True)
+    assert all(index['status'] == 'ready' for index in db.mongo_index_status())
@@ -6,3 +6,4 @@ class CollectionNames(str, Enum):
     PATTERNS = 'patterns'
     TEMPLATES = 'templates'
     NAMED_ENTITIES = 'names'
+    NAME_NGRAMS = 'name_ngrams'
@@ -1,5 +1,7 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+from das.database.statistics import StatisticsCatalog
 
 WILDCARD = '*'
 UNORDERED_LINK_TYPES = ['Similarity', 'Set']
@@ -61,11 +63,47 @@ class DBInterface(ABC):
 
     #############################
 
+    # Streaming variants of the above. DBs which can read (potentially huge)
+    # answers progressively should override them.
+
+    def get_matched_links_iterator(self, link_type: str, target_handles: List[str]) -> Iterator[Any]:
+        return iter(self.get_matched_links(link_type, target_handles))
+
+    def get_matched_type_template_iterator(self, template: List[Any]) -> Iterator[Any]:
+        return iter(self.get_matched_type_template(template))
+
+    #############################
+
     def get_atom_as_dict(self, handle: str, arity: int):
         pass
 
     def get_atom_as_deep_representation(self, handle: str, arity: int):
         pass
 
+    def get_atoms_as_deep_representation(self, handles: List[str], arities: Optional[List[int]] = None) -> List[Dict]:
+        if arities is None:
+            arities = [-1] * len(handles)
+        return [self.get_atom_as_deep_representation(handle, arity) for handle, arity in zip(handles, arities)]
+
     def count_atoms(self):
         pass
+
+    def update_statistics(self, statistics: StatisticsCatalog) -> None:
+        pass
+
+    def statistics(self) -> Dict[str, Any]:
+        pass
+
+    # Materialized views (see das.pattern_matcher.materialized_view)
+
+    def save_view(self, name: str, view: Dict[str, Any]) -> None:
+        pass
+
+    def get_view(self, name: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    def get_view_definitions(self) -> Dict[str, Dict[str, Any]]:
+        return {}
+
+    def drop_view(self, name: str) -> None:
+        pass
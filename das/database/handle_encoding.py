@@ -0,0 +1,224 @@
+import struct
+from enum import Enum
+from typing import Any, Dict, Iterator, List, Optional
+
+from das.database.couchbase_schema import CollectionNames as CouchbaseCollectionNames
+from das.database.mongo_schema import FieldNames as MongoFieldNames
+from das.database.posting_list import compress_handles, decompress_handles, compress_entries, decompress_entries
+
+class HandleEncoding(str, Enum):
+    HEX = 'hex'
+    BINARY = 'binary'
+    # BINARY with compressed posting lists in Couchbase (see posting_list.py)
+    COMPRESSED = 'compressed'
+
+HANDLE_SIZE = 16
+HEX_HANDLE_SIZE = 2 * HANDLE_SIZE
+
+# Document fields which contain handles (besides key_0, key_1, ...)
+HANDLE_FIELDS = {
+    MongoFieldNames.ID_HASH.value,
+    MongoFieldNames.TYPE.value,
+    MongoFieldNames.TYPE_NAME_HASH.value,
+    MongoFieldNames.COMPOSITE_TYPE.value,
+    MongoFieldNames.KEYS.value,
+}
+
+# Couchbase collections whose values are lists of handles or of
+# (handle, [target handles]) entries
+HANDLE_LIST_COLLECTIONS = {
+    CouchbaseCollectionNames.INCOMING_SET.value,
+    CouchbaseCollectionNames.OUTGOING_SET.value,
+    CouchbaseCollectionNames.PATTERNS.value,
+    CouchbaseCollectionNames.TEMPLATES.value,
+    CouchbaseCollectionNames.NAME_NGRAMS.value,
+}
+
+# First byte of binary Couchbase values
+_HANDLE_LIST = 1
+_TARGETS_LIST = 2
+_COMPRESSED_HANDLE_LIST = 3
+_COMPRESSED_TARGETS_LIST = 4
+
+def _is_handle_field(field: str) -> bool:
+    return field in HANDLE_FIELDS or field.startswith(MongoFieldNames.KEY_PREFIX.value + '_')
+
+class HandleCodec:
+    """
+    Converts handles between the hex strings used in memory and in the API
+    and the representation used in storage. With HandleEncoding.BINARY,
+    handles are stored as 16-byte values (BSON binary in MongoDB and packed
+    binary documents in Couchbase). HandleEncoding.COMPRESSED also stores
+    Couchbase values as delta + varint compressed posting lists.
+    """
+
+    def __init__(self, encoding: HandleEncoding = HandleEncoding.HEX):
+        self.encoding = HandleEncoding(encoding)
+        self.compressed = self.encoding == HandleEncoding.COMPRESSED
+        self.binary = self.encoding == HandleEncoding.BINARY or self.compressed
+        if self.binary:
+            # Couchbase's default (JSON) transcoder doesn't accept binary
+            # values and the legacy one still reads JSON ones (block counts)
+            from couchbase.transcoder import LegacyTranscoder
+            self.couchbase_options = {'transcoder': LegacyTranscoder()}
+        else:
+            self.couchbase_options = {}
+
+    def encode_handle(self, value: Any) -> Any:
+        if not self.binary:
+            return value
+        if isinstance(value, str):
+            if len(value) == HEX_HANDLE_SIZE:
+                try:
+                    return bytes.fromhex(value)
+                except ValueError:
+                    pass
+            return value
+        if isinstance(value, (list, tuple)):
+            return [self.encode_handle(element) for element in value]
+        return value
+
+    def decode_handle(self, value: Any) -> Any:
+        if isinstance(value, bytes):
+            return value.hex()
+        if isinstance(value, list):
+            return [self.decode_handle(element) for element in value]
+        return value
+
+    def encode_document(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.binary:
+            return document
+        return {
+            field: self.encode_handle(value) if _is_handle_field(field) else value
+            for field, value in document.items()
+        }
+
+    def decode_document(self, document: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if not self.binary or document is None:
+            return document
+        return {
+            field: self.decode_handle(value) if _is_handle_field(field) else value
+            for field, value in document.items()
+        }
+
+    def encode_filter(self, mongo_filter: Any) -> Any:
+        if not self.binary or not isinstance(mongo_filter, dict):
+            return mongo_filter
+        answer = {}
+        for field, value in mongo_filter.items():
+            if field in ['$and', '$or', '$nor']:
+                answer[field] = [self.encode_filter(element) for element in value]
+            elif _is_handle_field(field):
+                if isinstance(value, dict):
+                    answer[field] = {operator: self.encode_handle(operand) for operator, operand in value.items()}
+                else:
+                    answer[field] = self.encode_handle(value)
+            else:
+                answer[field] = value
+        return answer
+
+    def encode_value(self, collection_name: str, value: List[Any]) -> Any:
+        # Value of a Couchbase document (a block of a posting list)
+        if not self.binary or collection_name not in HANDLE_LIST_COLLECTIONS:
+            return value
+        if self.compressed:
+            if value and not isinstance(value[0], str):
+                return bytes([_COMPRESSED_TARGETS_LIST]) + compress_entries(value)
+            return bytes([_COMPRESSED_HANDLE_LIST]) + compress_handles(value)
+        if value and not isinstance(value[0], str):
+            chunks = [bytes([_TARGETS_LIST])]
+            for handle, targets in value:
+                chunks.append(bytes.fromhex(handle))
+                chunks.append(struct.pack('>H', len(targets)))
+                chunks.extend(bytes.fromhex(target) for target in targets)
+        else:
+            chunks = [bytes([_HANDLE_LIST])]
+            chunks.extend(bytes.fromhex(handle) for handle in value)
+        return b''.join(chunks)
+
+    def decode_value(self, value: Any) -> Any:
+        if not isinstance(value, (bytes, bytearray)):
+            return value
+        if not value:
+            return []
+        if value[0] == _HANDLE_LIST:
+            return [value[i:i + HANDLE_SIZE].hex() for i in range(1, len(value), HANDLE_SIZE)]
+        if value[0] == _COMPRESSED_HANDLE_LIST:
+            return decompress_handles(value, 1)
+        if value[0] == _COMPRESSED_TARGETS_LIST:
+            return decompress_entries(value, 1)
+        answer = []
+        position = 1
+        while position < len(value):
+            handle = value[position:position + HANDLE_SIZE].hex()
+            count, = struct.unpack_from('>H', value, position + HANDLE_SIZE)
+            position += HANDLE_SIZE + 2
+            targets = [value[position + i * HANDLE_SIZE:position + (i + 1) * HANDLE_SIZE].hex() for i in range(count)]
+            position += count * HANDLE_SIZE
+            answer.append([handle, targets])
+        return answer
+
+class EncodedCursor:
+    """
+    Wraps a pymongo Cursor decoding the documents it returns.
+    """
+
+    def __init__(self, cursor, codec: HandleCodec):
+        self.cursor = cursor
+        self.codec = codec
+
+    def sort(self, *args, **kwargs) -> "EncodedCursor":
+        self.cursor = self.cursor.sort(*args, **kwargs)
+        return self
+
+    def skip(self, *args, **kwargs) -> "EncodedCursor":
+        self.cursor = self.cursor.skip(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs) -> "EncodedCursor":
+        self.cursor = self.cursor.limit(*args, **kwargs)
+        return self
+
+    def batch_size(self, *args, **kwargs) -> "EncodedCursor":
+        self.cursor = self.cursor.batch_size(*args, **kwargs)
+        return self
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for document in self.cursor:
+            yield self.codec.decode_document(document)
+
+class EncodedCollection:
+    """
+    Wraps a pymongo Collection so handles in filters and documents are
+    encoded before reaching MongoDB and decoded back to hex on the way out.
+    Methods not wrapped here are forwarded untouched.
+    """
+
+    def __init__(self, collection, codec: HandleCodec):
+        self.collection = collection
+        self.codec = codec
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def find(self, mongo_filter=None, *args, **kwargs) -> EncodedCursor:
+        return EncodedCursor(self.collection.find(self.codec.encode_filter(mongo_filter), *args, **kwargs), self.codec)
+
+    def find_one(self, mongo_filter=None, *args, **kwargs) -> Optional[Dict[str, Any]]:
+        document = self.collection.find_one(self.codec.encode_filter(mongo_filter), *args, **kwargs)
+        return self.codec.decode_document(document)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], *args, **kwargs) -> Iterator[Dict[str, Any]]:
+        pipeline = [
+            {'$match': self.codec.encode_filter(stage['$match'])} if '$match' in stage else stage
+            for stage in pipeline
+        ]
+        for document in self.collection.aggregate(pipeline, *args, **kwargs):
+            yield self.codec.decode_document(document)
+
+    def insert_many(self, documents, *args, **kwargs):
+        return self.collection.insert_many(
+            [self.codec.encode_document(document) for document in documents], *args, **kwargs)
+
+    def update_many(self, mongo_filter, *args, **kwargs):
+        return self.collection.update_many(self.codec.encode_filter(mongo_filter), *args, **kwargs)
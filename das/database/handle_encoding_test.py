@@ -0,0 +1,95 @@
+import json
+from das.expression_hasher import ExpressionHasher
+from das.database.handle_encoding import HandleCodec, HandleEncoding, EncodedCollection
+
+def _handles(prefix, n):
+    return [ExpressionHasher._compute_hash(f"{prefix}{i}") for i in range(n)]
+
+def test_hex_codec_is_identity():
+    codec = HandleCodec(HandleEncoding.HEX)
+    handles = _handles("node", 3)
+    document = {"_id": handles[0], "keys": handles}
+    assert codec.encode_document(document) is document
+    assert codec.encode_value("patterns", [[handles[0], handles[1:]]]) == [[handles[0], handles[1:]]]
+    assert codec.couchbase_options == {}
+
+def test_binary_documents():
+    codec = HandleCodec(HandleEncoding.BINARY)
+    handles = _handles("node", 4)
+    document = {
+        "_id": handles[0],
+        "composite_type_hash": handles[1],
+        "composite_type": [handles[1], [handles[2], handles[3]]],
+        "named_type": "Inheritance",
+        "key_0": handles[2],
+        "key_1": handles[3],
+    }
+    encoded = codec.encode_document(document)
+    assert encoded["_id"] == bytes.fromhex(handles[0])
+    assert encoded["composite_type"][1][0] == bytes.fromhex(handles[2])
+    assert encoded["key_1"] == bytes.fromhex(handles[3])
+    assert encoded["named_type"] == "Inheritance"
+    assert codec.decode_document(encoded) == document
+    assert codec.encode_filter({"_id": {"$in": handles[:2]}, "name": "human"}) == {
+        "_id": {"$in": [bytes.fromhex(handles[0]), bytes.fromhex(handles[1])]},
+        "name": "human"}
+    # Things which aren't handles are kept
+    assert codec.encode_handle("*") == "*"
+    assert codec.encode_handle("x" * 32) == "x" * 32
+
+def test_binary_couchbase_values():
+    codec = HandleCodec(HandleEncoding.BINARY)
+    handles = _handles("link", 5)
+    encoded = codec.encode_value("incomming_set", handles)
+    assert len(encoded) == 1 + 5 * 16
+    assert codec.decode_value(encoded) == handles
+    entries = [(handles[0], tuple(handles[1:3])), (handles[3], tuple(handles[1:]))]
+    encoded = codec.encode_value("patterns", entries)
+    assert codec.decode_value(encoded) == [[handle, list(targets)] for handle, targets in entries]
+    assert codec.encode_value("names", ["human"]) == ["human"]
+    assert codec.decode_value(3) == 3
+
+class _Collection:
+    def __init__(self):
+        self.documents = []
+    def insert_many(self, documents, **kwargs):
+        self.documents.extend(documents)
+    def find(self, mongo_filter=None, *args, **kwargs):
+        return [d for d in self.documents if all(d.get(k) == v for k, v in (mongo_filter or {}).items())]
+    def find_one(self, mongo_filter=None, *args, **kwargs):
+        answer = self.find(mongo_filter)
+        return answer[0] if answer else None
+
+def test_encoded_collection():
+    codec = HandleCodec(HandleEncoding.BINARY)
+    handles = _handles("node", 2)
+    collection = _Collection()
+    encoded_collection = EncodedCollection(collection, codec)
+    encoded_collection.insert_many([{"_id": handle, "name": "n"} for handle in handles])
+    assert collection.documents[0]["_id"] == bytes.fromhex(handles[0])
+    assert encoded_collection.find_one({"_id": handles[1]}) == {"_id": handles[1], "name": "n"}
+    assert encoded_collection.find_one({"_id": handles[1][::-1]}) is None
+    assert [d["_id"] for d in encoded_collection.find({"name": "n"})] == handles
+
+def test_compressed_couchbase_values():
+    codec = HandleCodec(HandleEncoding.COMPRESSED)
+    assert codec.binary
+    handles = sorted(_handles("link", 1000))
+    encoded = codec.encode_value("incomming_set", handles)
+    assert codec.decode_value(encoded) == handles
+    # Handles are hashes, so delta encoding saves little compared to raw
+    # 16-byte handles, but a lot compared to JSON
+    assert len(encoded) < len(HandleCodec(HandleEncoding.BINARY).encode_value("incomming_set", handles)) + 8
+    assert len(encoded) * 2 < len(json.dumps(handles))
+    # Lists which aren't sorted are also encoded
+    assert codec.decode_value(codec.encode_value("outgoing_set", handles[::-1])) == handles[::-1]
+    assert codec.decode_value(codec.encode_value("outgoing_set", [])) == []
+    # Targets repeated across entries are stored once
+    targets = _handles("node", 3)
+    entries = [(handle, (targets[0], targets[i % 3])) for i, handle in enumerate(handles)]
+    encoded = codec.encode_value("patterns", entries)
+    assert codec.decode_value(encoded) == [[handle, list(targets)] for handle, targets in entries]
+    assert len(encoded) * 4 < len(json.dumps(entries))
+    # Values written with the other binary format are still read
+    binary = HandleCodec(HandleEncoding.BINARY).encode_value("patterns", entries)
+    assert codec.decode_value(binary) == codec.decode_value(encoded)
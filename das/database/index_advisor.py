@@ -0,0 +1,90 @@
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Optional
+
+from das.database.db_interface import WILDCARD
+from das.database.pattern_index import PatternIndex, PatternIndexPolicy
+
+class PatternUsage:
+    """
+    Number of times each kind of pattern key was requested: (link type, arity,
+    positions of the bound targets). It's what the index advisor optimizes for.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.requests = Counter()
+
+    def record(self, link_type: str, arity: int, bound: FrozenSet[int], count: int = 1) -> None:
+        with self.lock:
+            self.requests[(link_type, arity, tuple(sorted(bound)))] += count
+
+    def merge(self, other: "PatternUsage") -> None:
+        with self.lock:
+            self.requests.update(other.requests)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            return {'requests': [
+                [link_type, arity, list(bound), count]
+                for (link_type, arity, bound), count in sorted(self.requests.items())
+            ]}
+
+    @staticmethod
+    def from_dict(document: Optional[Dict[str, Any]]) -> "PatternUsage":
+        answer = PatternUsage()
+        if document is not None:
+            for link_type, arity, bound, count in document['requests']:
+                answer.record(link_type, arity, frozenset(bound), count)
+        return answer
+
+def advise_pattern_index(
+    usage: PatternUsage,
+    link_type_counts: Dict[str, int],
+    storage_budget: int) -> PatternIndex:
+    """
+    Propose a pattern index for the requested keys whose size (in pattern
+    entries) fits storage_budget.
+
+    Each link is indexed under two keys (typed and untyped) for each
+    materialized set of bound positions, so materializing a set for a type
+    costs twice its number of links (and for requests with a wildcard type,
+    twice the number of all links). Sets are chosen greedily by requests per
+    entry. Types never requested are black listed and the other ones keep the
+    all-wildcards keys. Requests which don't make the cut are answered by
+    intersecting posting lists or incoming sets.
+    """
+    requests = Counter()
+    for (link_type, _, bound), count in usage.requests.items():
+        requests[(link_type, bound)] += count
+    requested_types = set(link_type for link_type, _ in requests)
+    if WILDCARD in requested_types:
+        # Keys with a wildcard type need every type to be indexed
+        indexed_types = set(link_type_counts)
+    else:
+        indexed_types = requested_types & set(link_type_counts)
+    used = sum(2 * link_type_counts[link_type] for link_type in indexed_types)
+    candidates = []
+    for (link_type, bound), count in requests.items():
+        if not bound:
+            continue
+        if link_type == WILDCARD:
+            cost = 2 * sum(link_type_counts.values())
+        elif link_type in indexed_types:
+            cost = 2 * link_type_counts[link_type]
+        else:
+            continue
+        candidates.append((count / max(cost, 1), cost, link_type, bound))
+    positions = {link_type: set() for link_type in [WILDCARD, *indexed_types]}
+    for _, cost, link_type, bound in sorted(candidates, key=lambda c: (-c[0], c[1], c[2], c[3])):
+        if used + cost > storage_budget:
+            continue
+        used += cost
+        for selected_type in ([WILDCARD, *indexed_types] if link_type == WILDCARD else [link_type]):
+            positions[selected_type].add(bound)
+    policies = {
+        link_type: PatternIndexPolicy(positions=[list(bound) for bound in sorted(selected)])
+        for link_type, selected in positions.items()
+    }
+    black_list = [link_type for link_type in link_type_counts if link_type not in indexed_types]
+    return PatternIndex(policies, black_list)
@@ -0,0 +1,42 @@
+from das.database.db_interface import WILDCARD
+from das.database.index_advisor import PatternUsage, advise_pattern_index
+
+def _usage(requests):
+    usage = PatternUsage()
+    for link_type, arity, bound, count in requests:
+        usage.record(link_type, arity, frozenset(bound), count)
+    return usage
+
+def test_pattern_usage():
+    usage = _usage([("Inheritance", 2, [1], 3), ("Inheritance", 2, [1], 2), (WILDCARD, 2, [], 1)])
+    assert usage.requests[("Inheritance", 2, (1,))] == 5
+    other = PatternUsage.from_dict(usage.to_dict())
+    assert other.requests == usage.requests
+    other.merge(usage)
+    assert other.requests[("Inheritance", 2, (1,))] == 10
+    assert PatternUsage.from_dict(None).requests == {}
+
+def test_advise_pattern_index():
+    counts = {"Inheritance": 100, "Similarity": 1000, "Evaluation": 50}
+    usage = _usage([
+        ("Inheritance", 2, [1], 50),
+        ("Inheritance", 2, [0], 1),
+        ("Similarity", 2, [0], 10),
+    ])
+    # Mandatory keys: 2 * (100 + 1000), Inheritance [1] and [0]: 200 each
+    index = advise_pattern_index(usage, counts, 2200 + 200)
+    assert index.black_list == ["Evaluation"]
+    assert index.materialized("Inheritance", frozenset([1]))
+    assert not index.materialized("Inheritance", frozenset([0]))
+    assert not index.materialized("Similarity", frozenset([0]))
+    assert index.materialized("Similarity", frozenset())
+    assert not index.materialized(WILDCARD, frozenset())
+    index = advise_pattern_index(usage, counts, 10 ** 6)
+    assert index.materialized("Inheritance", frozenset([0]))
+    assert index.materialized("Similarity", frozenset([0]))
+    # Keys with a wildcard type need every type
+    usage.record(WILDCARD, 2, frozenset([0]))
+    index = advise_pattern_index(usage, counts, 10 ** 6)
+    assert index.black_list == []
+    assert index.materialized(WILDCARD, frozenset([0]))
+    assert not index.materialized(WILDCARD, frozenset([1]))
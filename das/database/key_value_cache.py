@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from enum import Enum
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional
+
+class CachePolicy(str, Enum):
+    LRU = 'lru'
+    LFU = 'lfu'
+
+def estimate_size(value: Any) -> int:
+    # Rough estimate of the serialized (JSON) size of a value, in bytes
+    if isinstance(value, str):
+        return len(value) + 3
+    elif isinstance(value, (list, tuple)):
+        return 2 + sum(estimate_size(element) for element in value)
+    elif isinstance(value, dict):
+        return 2 + sum(estimate_size(key) + estimate_size(element) for key, element in value.items())
+    elif isinstance(value, (bytes, bytearray)):
+        return len(value)
+    else:
+        return 8
+
+def freeze(value: Any) -> Any:
+    # Lists (and the lists in them) as tuples
+    if isinstance(value, list):
+        return tuple(freeze(element) if isinstance(element, list) else element for element in value)
+    return value
+
+class CacheStatistics:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hit_rate(),
+        }
+
+class KeyValueCache:
+    """
+    Bounded in-memory cache. Entries are weighted by their (estimated) size
+    in bytes and evicted in LRU or LFU order when the byte limit is reached.
+    Values larger than the limit are never cached. Cached values are shared
+    by everyone who gets them so lists are stored frozen (see freeze()) and
+    changing them fails instead of changing the cache.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        policy: CachePolicy = CachePolicy.LRU,
+        size_function: Callable[[Any], int] = estimate_size):
+
+        self.max_size = max_size
+        self.policy = CachePolicy(policy)
+        self.size_function = size_function
+        self.current_size = 0
+        self.statistics = CacheStatistics()
+        self.lock = Lock()
+        # key -> (value, size)
+        self.entries: Dict[Hashable, Any] = {}
+        # LRU: keys in access order (oldest first)
+        self.recency = OrderedDict()
+        # LFU: access count -> keys with that count (oldest first)
+        self.frequency: Dict[Hashable, int] = {}
+        self.frequency_buckets: Dict[int, OrderedDict] = {}
+        self.min_frequency = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def _touch(self, key: Hashable) -> None:
+        if self.policy == CachePolicy.LRU:
+            self.recency.move_to_end(key)
+        else:
+            count = self.frequency[key]
+            bucket = self.frequency_buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self.frequency_buckets[count]
+                if self.min_frequency == count:
+                    self.min_frequency = count + 1
+            self.frequency[key] = count + 1
+            self.frequency_buckets.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _track(self, key: Hashable) -> None:
+        if self.policy == CachePolicy.LRU:
+            self.recency[key] = None
+        else:
+            self.frequency[key] = 1
+            self.frequency_buckets.setdefault(1, OrderedDict())[key] = None
+            self.min_frequency = 1
+
+    def _untrack(self, key: Hashable) -> None:
+        if self.policy == CachePolicy.LRU:
+            del self.recency[key]
+        else:
+            count = self.frequency.pop(key)
+            bucket = self.frequency_buckets[count]
+            del bucket[key]
+            if not bucket:
+                del self.frequency_buckets[count]
+
+    def _victim(self) -> Hashable:
+        if self.policy == CachePolicy.LRU:
+            return next(iter(self.recency))
+        else:
+            if self.min_frequency not in self.frequency_buckets:
+                self.min_frequency = min(self.frequency_buckets)
+            return next(iter(self.frequency_buckets[self.min_frequency]))
+
+    def _remove(self, key: Hashable) -> None:
+        _, size = self.entries.pop(key)
+        self._untrack(key)
+        self.current_size -= size
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.statistics.misses += 1
+                return None
+            self.statistics.hits += 1
+            self._touch(key)
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None) -> bool:
+        value = freeze(value)
+        if size is None:
+            size = self.size_function(value)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            if size > self.max_size:
+                return False
+            while self.current_size + size > self.max_size:
+                self._remove(self._victim())
+                self.statistics.evictions += 1
+            self.entries[key] = (value, size)
+            self._track(key)
+            self.current_size += size
+            return True
+
+    def read_through(self, key: Hashable, loader: Callable[[Hashable], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            value = freeze(loader(key))
+            self.put(key, value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+                self.statistics.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.statistics.invalidations += len(self.entries)
+            self.entries = {}
+            self.recency = OrderedDict()
+            self.frequency = {}
+            self.frequency_buckets = {}
+            self.min_frequency = 0
+            self.current_size = 0
+
+    def statistics_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            answer = self.statistics.to_dict()
+            answer['entries'] = len(self.entries)
+            answer['size'] = self.current_size
+            answer['max_size'] = self.max_size
+            return answer
@@ -0,0 +1,99 @@
+import pytest
+from das.database.key_value_cache import KeyValueCache, CachePolicy, estimate_size
+
+def test_estimate_size():
+    assert estimate_size("abc") == 6
+    assert estimate_size([]) == 2
+    assert estimate_size(["abc", "de"]) == 2 + 6 + 5
+    assert estimate_size([["abc", ["de"]]]) == 2 + (2 + 6 + (2 + 5))
+
+def test_get_and_put():
+    cache = KeyValueCache(100)
+    assert cache.get("k1") is None
+    assert cache.put("k1", ["v1"])
+    assert cache.get("k1") == ("v1",)
+    assert cache.put("k2", [])
+    assert cache.get("k2") == ()
+    assert len(cache) == 2
+    assert cache.statistics.hits == 2
+    assert cache.statistics.misses == 1
+
+def test_frozen_values():
+    cache = KeyValueCache(100)
+    cache.put("k1", [["h1", ["t1", "t2"]], ["h2", []]])
+    value = cache.get("k1")
+    assert value == (("h1", ("t1", "t2")), ("h2", ()))
+    with pytest.raises(AttributeError):
+        value[0][1].append("t3")
+    assert cache.read_through("k2", lambda key: [key]) == ("k2",)
+
+def test_value_larger_than_limit_is_not_cached():
+    cache = KeyValueCache(10)
+    assert not cache.put("k1", "v1", size=11)
+    assert cache.get("k1") is None
+    assert cache.current_size == 0
+
+def test_lru_eviction():
+    cache = KeyValueCache(3, CachePolicy.LRU)
+    cache.put("k1", 1, size=1)
+    cache.put("k2", 2, size=1)
+    cache.put("k3", 3, size=1)
+    assert cache.get("k1") == 1
+    cache.put("k4", 4, size=1)
+    assert "k2" not in cache
+    assert all(key in cache for key in ["k1", "k3", "k4"])
+    cache.put("k5", 5, size=2)
+    assert "k3" not in cache and "k1" not in cache
+    assert cache.current_size == 3
+    assert cache.statistics.evictions == 3
+
+def test_lfu_eviction():
+    cache = KeyValueCache(3, CachePolicy.LFU)
+    cache.put("k1", 1, size=1)
+    cache.put("k2", 2, size=1)
+    cache.put("k3", 3, size=1)
+    for _ in range(3):
+        cache.get("k1")
+    cache.get("k2")
+    cache.put("k4", 4, size=1)
+    assert "k3" not in cache
+    cache.put("k5", 5, size=1)
+    assert "k4" not in cache
+    cache.get("k5")
+    cache.get("k5")
+    cache.put("k6", 6, size=1)
+    assert "k2" not in cache
+    assert all(key in cache for key in ["k1", "k5", "k6"])
+
+def test_update_replaces_size():
+    cache = KeyValueCache(10, CachePolicy.LFU)
+    cache.put("k1", [1], size=4)
+    cache.put("k1", [1, 1], size=8)
+    assert cache.current_size == 8
+    assert cache.get("k1") == (1, 1)
+
+def test_invalidation():
+    cache = KeyValueCache(10)
+    cache.put("k1", 1, size=1)
+    cache.put("k2", 2, size=1)
+    cache.invalidate("k1")
+    cache.invalidate("blah")
+    assert "k1" not in cache
+    assert cache.current_size == 1
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.current_size == 0
+    assert cache.statistics.invalidations == 2
+
+def test_read_through():
+    cache = KeyValueCache(100)
+    loaded = []
+    def loader(key):
+        loaded.append(key)
+        return [key]
+    assert cache.read_through("k1", loader) == ("k1",)
+    assert cache.read_through("k1", loader) == ("k1",)
+    assert loaded == ["k1"]
+    statistics = cache.statistics_dict()
+    assert statistics["hit_rate"] == 0.5
+    assert statistics["entries"] == 1
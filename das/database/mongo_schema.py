@@ -6,6 +6,9 @@ class CollectionNames(str, Enum):
     LINKS_ARITY_1 = 'links_1'
     LINKS_ARITY_2 = 'links_2'
     LINKS_ARITY_N = 'links_n'
+    BLOOM_FILTERS = 'bloom_filters'
+    METADATA = 'metadata'
+    MATERIALIZED_VIEWS = 'materialized_views'
 
 class FieldNames(str, Enum):
     NODE_NAME = 'name'
@@ -16,3 +19,29 @@ class FieldNames(str, Enum):
     COMPOSITE_TYPE = 'composite_type'
     KEY_PREFIX = 'key'
     KEYS = 'keys'
+    IS_TOPLEVEL = 'is_toplevel'
+
+LINK_COLLECTIONS = [
+    CollectionNames.LINKS_ARITY_1,
+    CollectionNames.LINKS_ARITY_2,
+    CollectionNames.LINKS_ARITY_N,
+]
+
+# Secondary indexes used by the queries of CouchMongoDB: (collection, index
+# name, [(field, direction)]). They're built after bulk loads (instead of
+# being updated by every insertion) so they may be missing for a while.
+SECONDARY_INDEXES = [
+    (CollectionNames.NODES, 'type_name', [(FieldNames.TYPE.value, 1), (FieldNames.NODE_NAME.value, 1)]),
+    (CollectionNames.NODES, 'type_id', [(FieldNames.TYPE.value, 1), (FieldNames.ID_HASH.value, 1)]),
+    (CollectionNames.NODES, 'named_type', [(FieldNames.TYPE_NAME.value, 1)]),
+    (CollectionNames.ATOM_TYPES, 'named_type', [(FieldNames.TYPE_NAME.value, 1)]),
+    *[
+        (collection, name, [(field.value, 1)])
+        for collection in LINK_COLLECTIONS
+        for name, field in [
+            ('named_type_hash', FieldNames.TYPE_NAME_HASH),
+            ('named_type', FieldNames.TYPE_NAME),
+            ('is_toplevel', FieldNames.IS_TOPLEVEL),
+        ]
+    ],
+]
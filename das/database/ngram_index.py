@@ -0,0 +1,28 @@
+from typing import Optional, Set, Tuple
+
+from das.expression_hasher import ExpressionHasher
+
+# Node names are indexed by their substrings of this size (trigrams)
+NGRAM_SIZE = 3
+
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+def name_ngrams(name: str) -> Set[str]:
+    return {name[i:i + NGRAM_SIZE] for i in range(len(name) - NGRAM_SIZE + 1)}
+
+def ngram_key(type_hash: str, ngram: str) -> str:
+    # n-grams may contain any character (including the ',' used as separator
+    # in the loader's temporary files) so keys are hashed
+    return ExpressionHasher._compute_hash(type_hash + ngram)
+
+def literal_pattern(pattern: str) -> Optional[Tuple[str, bool]]:
+    """
+    If the regular expression pattern is a plain substring (optionally
+    anchored with '^') that can be answered by the n-gram index, return the
+    substring and whether it's a prefix search. Return None otherwise.
+    """
+    prefix = pattern.startswith('^')
+    substring = pattern[1:] if prefix else pattern
+    if len(substring) < NGRAM_SIZE or any(c in REGEX_METACHARACTERS for c in substring):
+        return None
+    return substring, prefix
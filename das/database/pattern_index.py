@@ -0,0 +1,170 @@
+from functools import lru_cache
+from itertools import combinations
+from typing import Any, Dict, FrozenSet, List, Optional
+
+from das.database.db_interface import WILDCARD
+
+# Pattern keys bind the link type (or not) and some of its targets. By
+# default keys binding up to this number of targets are materialized, so the
+# size of the patterns collection grows polynomially (not exponentially) with
+# the arity of the links. Links with arity up to 3 get every key.
+DEFAULT_MAX_BOUND_TARGETS = 3
+
+class PatternIndexPolicy:
+    """
+    Which pattern keys are materialized for the links of a type. A key binding
+    the targets in positions B is materialized if len(B) <= max_bound_targets
+    (None means no limit) or, when positions is given, if B is one of the
+    listed position sets. Keys binding no targets are always materialized.
+    """
+
+    def __init__(
+        self,
+        max_bound_targets: Optional[int] = DEFAULT_MAX_BOUND_TARGETS,
+        positions: Optional[List[List[int]]] = None):
+
+        if max_bound_targets is not None and max_bound_targets < 0:
+            raise ValueError(f'Invalid max_bound_targets: {max_bound_targets}')
+        self.max_bound_targets = max_bound_targets
+        self.positions = None if positions is None else sorted(sorted(set(p)) for p in positions)
+        self._position_sets = None if positions is None else [frozenset(p) for p in self.positions]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PatternIndexPolicy) and self.to_dict() == other.to_dict()
+
+    def materialized(self, bound: FrozenSet[int]) -> bool:
+        if not bound:
+            return True
+        if self._position_sets is not None:
+            return bound in self._position_sets
+        return self.max_bound_targets is None or len(bound) <= self.max_bound_targets
+
+    def bound_positions(self, arity: int) -> List[FrozenSet[int]]:
+        """
+        Sets of target positions bound by the keys materialized for a link
+        with the passed arity.
+        """
+        return _bound_positions(self.max_bound_targets, _freeze(self.positions), arity)
+
+    def candidates(self, bound: FrozenSet[int]) -> List[FrozenSet[int]]:
+        # Materialized subsets of bound that may be used to cover it
+        if self._position_sets is not None:
+            return [p for p in self._position_sets if p and p <= bound]
+        if self.max_bound_targets is None or self.max_bound_targets >= len(bound):
+            return [bound]
+        if self.max_bound_targets == 0:
+            return []
+        ordered = sorted(bound)
+        size = self.max_bound_targets
+        return [frozenset(ordered[i:i + size]) for i in range(0, len(ordered), size)]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'max_bound_targets': self.max_bound_targets, 'positions': self.positions}
+
+    @staticmethod
+    def from_dict(document: Dict[str, Any]) -> "PatternIndexPolicy":
+        return PatternIndexPolicy(document['max_bound_targets'], document['positions'])
+
+def _freeze(positions):
+    return None if positions is None else tuple(tuple(p) for p in positions)
+
+@lru_cache(maxsize=None)
+def _bound_positions(max_bound_targets, positions, arity) -> List[FrozenSet[int]]:
+    if positions is not None:
+        answer = [frozenset()]
+        answer.extend(frozenset(p) for p in positions if p and max(p) < arity)
+        return answer
+    limit = arity if max_bound_targets is None else min(arity, max_bound_targets)
+    return [frozenset(p) for size in range(limit + 1) for p in combinations(range(arity), size)]
+
+class PatternIndex:
+    """
+    Pattern index policies of an atom space: one per link type (by name)
+    plus the default one (under WILDCARD) used for the other types. Links of
+    the types in black_list have no pattern keys at all.
+    """
+
+    def __init__(
+        self,
+        policies: Optional[Dict[str, PatternIndexPolicy]] = None,
+        black_list: Optional[List[str]] = None):
+
+        self.policies = dict(policies) if policies else {}
+        if WILDCARD not in self.policies:
+            self.policies[WILDCARD] = PatternIndexPolicy()
+        self.black_list = sorted(set(black_list)) if black_list else []
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PatternIndex) and self.to_dict() == other.to_dict()
+
+    def policy(self, link_type: str) -> PatternIndexPolicy:
+        return self.policies.get(link_type, self.policies[WILDCARD])
+
+    def keys(self, link_type: str, type_hash: str, targets: List[str]) -> List[List[str]]:
+        """
+        Pattern keys (lists of type hash and targets, with wildcards) under
+        which a link is indexed.
+        """
+        arity = len(targets)
+        answer = []
+        for bound in self.policy(link_type).bound_positions(arity):
+            key = [target if i in bound else WILDCARD for i, target in enumerate(targets)]
+            if len(bound) < arity:
+                # Keys binding the type and every target are the link itself
+                answer.append([type_hash, *key])
+            answer.append([WILDCARD, *key])
+        return answer
+
+    def _policies_for(self, link_type: str) -> List[PatternIndexPolicy]:
+        # Keys with a wildcard type have entries of every type, so they are
+        # only complete if every policy materializes them
+        if link_type == WILDCARD:
+            return list(self.policies.values())
+        return [self.policy(link_type)]
+
+    def indexed(self, link_type: str) -> bool:
+        # Whether every link of the type (any type for WILDCARD) is in the
+        # pattern keys it should be in
+        return link_type not in self.black_list and not (link_type == WILDCARD and self.black_list)
+
+    def materialized(self, link_type: str, bound: FrozenSet[int]) -> bool:
+        if not self.indexed(link_type):
+            return False
+        return all(policy.materialized(bound) for policy in self._policies_for(link_type))
+
+    def cover(self, link_type: str, bound: FrozenSet[int]) -> Optional[List[FrozenSet[int]]]:
+        """
+        Materialized keys whose posting lists intersect to the one of the
+        (not materialized) key binding the positions in bound, or None if
+        there isn't such set of keys.
+        """
+        if not self.indexed(link_type):
+            return None
+        policies = self._policies_for(link_type)
+        candidates = {frozenset([position]) for position in bound}
+        for policy in policies:
+            candidates.update(policy.candidates(bound))
+        candidates = [c for c in candidates if all(policy.materialized(c) for policy in policies)]
+        answer = []
+        uncovered = set(bound)
+        while uncovered:
+            best = max(candidates, key=lambda c: (len(c & uncovered), len(c), sorted(c)), default=None)
+            if best is None or not best & uncovered:
+                return None
+            answer.append(best)
+            uncovered -= best
+        return answer
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Policies are stored as [type name, policy] pairs because type names
+        # are not always valid MongoDB field names
+        return {
+            'policies': [[link_type, policy.to_dict()] for link_type, policy in sorted(self.policies.items())],
+            'black_list': self.black_list,
+        }
+
+    @staticmethod
+    def from_dict(document: Dict[str, Any]) -> "PatternIndex":
+        return PatternIndex(
+            {link_type: PatternIndexPolicy.from_dict(policy) for link_type, policy in document['policies']},
+            document.get('black_list', None))
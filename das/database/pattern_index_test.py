@@ -0,0 +1,45 @@
+from das.database.db_interface import WILDCARD
+from das.database.pattern_index import PatternIndex, PatternIndexPolicy
+
+T = "type"
+TARGETS = ["h1", "h2", "h3", "h4", "h5"]
+
+def _keys(policy, arity):
+    return PatternIndex({WILDCARD: policy}).keys("Link", T, TARGETS[:arity])
+
+def test_keys():
+    # Same keys as the hard-coded ones for arity up to 3 (without duplicates)
+    assert sorted(_keys(PatternIndexPolicy(), 1)) == sorted([
+        [T, WILDCARD], [WILDCARD, WILDCARD], [WILDCARD, "h1"]])
+    assert len(_keys(PatternIndexPolicy(), 2)) == 7
+    assert len(_keys(PatternIndexPolicy(), 3)) == 15
+    # Arity 5: 2 * (1 + 5 + 10 + 10) instead of 2 ** 6 - 1
+    assert len(_keys(PatternIndexPolicy(), 5)) == 52
+    assert len(_keys(PatternIndexPolicy(None), 5)) == 63
+    assert len(_keys(PatternIndexPolicy(1), 5)) == 12
+    assert sorted(_keys(PatternIndexPolicy(0), 2)) == sorted([[T, WILDCARD, WILDCARD], [WILDCARD, WILDCARD, WILDCARD]])
+    assert sorted(_keys(PatternIndexPolicy(positions=[[1]]), 2)) == sorted([
+        [T, WILDCARD, WILDCARD], [WILDCARD, WILDCARD, WILDCARD],
+        [T, WILDCARD, "h2"], [WILDCARD, WILDCARD, "h2"]])
+
+def test_cover():
+    index = PatternIndex({WILDCARD: PatternIndexPolicy(2), "Sparse": PatternIndexPolicy(0)})
+    bound = frozenset([0, 1, 2])
+    assert not index.materialized("Link", bound)
+    assert index.materialized("Link", frozenset([0, 2]))
+    cover = index.cover("Link", bound)
+    assert frozenset().union(*cover) == bound and len(cover) == 2
+    assert all(len(positions) <= 2 for positions in cover)
+    # Nothing but the all-wildcards key is materialized for Sparse (and so
+    # for wildcard link types)
+    assert index.cover("Sparse", bound) is None
+    assert index.cover(WILDCARD, bound) is None
+    index = PatternIndex({WILDCARD: PatternIndexPolicy(positions=[[0], [1, 2]])})
+    assert sorted(sorted(p) for p in index.cover("Link", bound)) == [[0], [1, 2]]
+    assert index.cover("Link", frozenset([3])) is None
+
+def test_serialization():
+    index = PatternIndex({"Inheritance": PatternIndexPolicy(1), "Quad": PatternIndexPolicy(positions=[[2, 0]])})
+    assert PatternIndex.from_dict(index.to_dict()) == index
+    assert PatternIndex() == PatternIndex({WILDCARD: PatternIndexPolicy()})
+    assert PatternIndex() != index
@@ -0,0 +1,166 @@
+from bisect import bisect_left
+from typing import Any, Dict, List, Optional, Tuple
+
+# Posting lists too long for one Couchbase document are split in blocks
+# (key_0, key_1, ...) and the document under the key itself (the head) has
+# the number of blocks and the first and last handle of each one. Entries are
+# sorted by handle so only the blocks which may contain a handle are read.
+# Values loaded by previous versions have just the number of blocks as head.
+POSTING_BLOCKS = 'blocks'
+POSTING_BOUNDS = 'bounds'
+
+def entry_handle(entry: Any) -> str:
+    # Entries are handles or (handle, targets) pairs
+    return entry if isinstance(entry, str) else entry[0]
+
+def block_bounds(block: List[Any]) -> List[str]:
+    return [entry_handle(block[0]), entry_handle(block[-1])]
+
+def posting_head(bounds: List[List[str]]) -> Dict[str, Any]:
+    return {POSTING_BLOCKS: len(bounds), POSTING_BOUNDS: bounds}
+
+def head_block_count(head: Any) -> Optional[int]:
+    """
+    Number of blocks of a multi-block value given its head, or None if the
+    head is the whole value.
+    """
+    if isinstance(head, int):
+        return head
+    if isinstance(head, dict):
+        return head[POSTING_BLOCKS]
+    return None
+
+def head_bounds(head: Any) -> Optional[List[List[str]]]:
+    return head.get(POSTING_BOUNDS, None) if isinstance(head, dict) else None
+
+def blocks_containing(bounds: List[List[str]], handles: List[str]) -> List[int]:
+    """
+    Indexes of the blocks whose range of handles contains any of the passed
+    ones (which must be sorted).
+    """
+    answer = []
+    for i, (first, last) in enumerate(bounds):
+        position = bisect_left(handles, first)
+        if position < len(handles) and handles[position] <= last:
+            answer.append(i)
+    return answer
+
+def _intersect_two(smaller: List[str], larger: List[str]) -> List[str]:
+    answer = []
+    position = 0
+    for handle in smaller:
+        # The merge skips over the larger list by binary search
+        position = bisect_left(larger, handle, position)
+        if position == len(larger):
+            break
+        if larger[position] == handle:
+            answer.append(handle)
+    return answer
+
+def intersect_postings(postings: List[List[str]]) -> List[str]:
+    """
+    Intersection of posting lists of handles, merging them from the smallest
+    one. Lists are stored sorted (so sorting them is linear) but the ones
+    loaded by previous versions may not be.
+    """
+    if not postings:
+        return []
+    postings = sorted((sorted(posting) for posting in postings), key=len)
+    # A link which has the same target twice is twice in its incoming set
+    answer = [handle for i, handle in enumerate(postings[0]) if i == 0 or postings[0][i - 1] != handle]
+    for posting in postings[1:]:
+        if not answer:
+            break
+        answer = _intersect_two(answer, posting)
+    return answer
+
+# Compressed posting lists: handles are read as 128-bit integers and stored
+# as the (zigzag encoded) difference to the previous one, which is smaller in
+# sorted lists, prefixed by its size in bytes. Handles are hashes so these
+# differences are large and a length prefix is cheaper than 7-bit varints,
+# which are used for counts. Targets of (handle, targets) entries are
+# interned in a per-document dictionary and referenced by their position in
+# it so the targets bound by pattern keys are stored once per document.
+
+def _write_varint(output: bytearray, value: int) -> None:
+    while value >= 0x80:
+        output.append((value & 0x7F) | 0x80)
+        value >>= 7
+    output.append(value)
+
+def _read_varint(data: bytes, position: int) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+def _write_handles(output: bytearray, handles: List[str]) -> None:
+    values = [int(handle, 16) for handle in handles]
+    # Differences in lists which aren't sorted may be negative so they are
+    # zigzag encoded
+    ordered = all(values[i - 1] <= values[i] for i in range(1, len(values)))
+    _write_varint(output, len(values))
+    output.append(1 if ordered else 0)
+    previous = 0
+    for value in values:
+        delta = value - previous
+        if not ordered:
+            delta = delta << 1 if delta >= 0 else ((-delta) << 1) - 1
+        size = (delta.bit_length() + 7) // 8
+        output.append(size)
+        output += delta.to_bytes(size, 'big')
+        previous = value
+
+def _read_handles(data: bytes, position: int) -> Tuple[List[str], int]:
+    count, position = _read_varint(data, position)
+    ordered = data[position] == 1
+    position += 1
+    answer = []
+    previous = 0
+    for _ in range(count):
+        size = data[position]
+        delta = int.from_bytes(data[position + 1:position + 1 + size], 'big')
+        position += 1 + size
+        if not ordered:
+            delta = -((delta + 1) >> 1) if delta & 1 else delta >> 1
+        previous += delta
+        answer.append(f'{previous:032x}')
+    return answer, position
+
+def compress_handles(handles: List[str]) -> bytes:
+    output = bytearray()
+    _write_handles(output, handles)
+    return bytes(output)
+
+def decompress_handles(data: bytes, position: int = 0) -> List[str]:
+    return _read_handles(data, position)[0]
+
+def compress_entries(entries: List[Any]) -> bytes:
+    dictionary = sorted(set(target for _, targets in entries for target in targets))
+    ids = {target: i for i, target in enumerate(dictionary)}
+    output = bytearray()
+    _write_handles(output, dictionary)
+    _write_handles(output, [handle for handle, _ in entries])
+    for _, targets in entries:
+        _write_varint(output, len(targets))
+        for target in targets:
+            _write_varint(output, ids[target])
+    return bytes(output)
+
+def decompress_entries(data: bytes, position: int = 0) -> List[List[Any]]:
+    dictionary, position = _read_handles(data, position)
+    handles, position = _read_handles(data, position)
+    answer = []
+    for handle in handles:
+        count, position = _read_varint(data, position)
+        targets = []
+        for _ in range(count):
+            target_id, position = _read_varint(data, position)
+            targets.append(dictionary[target_id])
+        answer.append([handle, targets])
+    return answer
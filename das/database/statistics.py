@@ -0,0 +1,115 @@
+import heapq
+from collections import Counter
+from typing import Any, Dict, Optional
+
+# Number of heaviest keys kept for each kind of posting list
+TOP_KEYS = 20
+
+class PostingStatistics:
+    """
+    Size distribution of the posting lists of one Couchbase collection:
+    number of keys and entries, a histogram of sizes (in power-of-two
+    buckets) and the TOP_KEYS largest keys.
+    """
+
+    def __init__(self, top_keys: int = TOP_KEYS):
+        self.top_keys = top_keys
+        self.keys = 0
+        self.entries = 0
+        self.histogram = Counter()
+        # min-heap of (size, key)
+        self.top = []
+
+    def add(self, key: str, size: int) -> None:
+        self.keys += 1
+        self.entries += size
+        self.histogram[1 << (size.bit_length() - 1)] += 1
+        if len(self.top) < self.top_keys:
+            heapq.heappush(self.top, (size, key))
+        elif size > self.top[0][0]:
+            heapq.heapreplace(self.top, (size, key))
+
+    def merge(self, delta: "PostingStatistics") -> None:
+        # Keys which got new entries are counted again in the histogram and
+        # their sizes in the top list are a lower bound, so merged
+        # statistics are approximate
+        self.keys += delta.keys
+        self.entries += delta.entries
+        self.histogram.update(delta.histogram)
+        sizes = {key: size for size, key in self.top}
+        for size, key in delta.top:
+            sizes[key] = sizes.get(key, 0) + size
+        self.top = heapq.nlargest(self.top_keys, [(size, key) for key, size in sizes.items()])
+        heapq.heapify(self.top)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'keys': self.keys,
+            'entries': self.entries,
+            'histogram': sorted([size, count] for size, count in self.histogram.items()),
+            'top': [[key, size] for size, key in sorted(self.top, reverse=True)],
+        }
+
+    @staticmethod
+    def from_dict(document: Dict[str, Any]) -> "PostingStatistics":
+        answer = PostingStatistics()
+        answer.keys = document['keys']
+        answer.entries = document['entries']
+        answer.histogram = Counter({size: count for size, count in document['histogram']})
+        answer.top = [(size, key) for key, size in document['top']]
+        heapq.heapify(answer.top)
+        return answer
+
+class StatisticsCatalog:
+    """
+    Statistics about the contents of an atom space, collected by the loader
+    threads while they build the temporary files of each collection.
+    """
+
+    def __init__(self):
+        self.exact = True
+        self.node_types = Counter()
+        self.link_types = Counter()
+        self.link_arities = Counter()
+        self.patterns = PostingStatistics()
+        self.templates = PostingStatistics()
+        self.incoming_degree = PostingStatistics()
+
+    def empty(self) -> bool:
+        return not (self.node_types or self.link_types)
+
+    def merge(self, delta: "StatisticsCatalog") -> None:
+        self.exact = delta.exact and (self.exact and self.empty() or delta.empty())
+        self.node_types.update(delta.node_types)
+        self.link_types.update(delta.link_types)
+        self.link_arities.update(delta.link_arities)
+        self.patterns.merge(delta.patterns)
+        self.templates.merge(delta.templates)
+        self.incoming_degree.merge(delta.incoming_degree)
+
+    def to_dict(self) -> Dict[str, Any]:
+        # Counters are stored as [name, count] pairs because type names
+        # are not always valid MongoDB field names
+        return {
+            'exact': self.exact,
+            'node_types': sorted([name, count] for name, count in self.node_types.items()),
+            'link_types': sorted([name, count] for name, count in self.link_types.items()),
+            'link_arities': sorted([arity, count] for arity, count in self.link_arities.items()),
+            'patterns': self.patterns.to_dict(),
+            'templates': self.templates.to_dict(),
+            'incoming_degree': self.incoming_degree.to_dict(),
+        }
+
+    @staticmethod
+    def from_dict(document: Optional[Dict[str, Any]]) -> "StatisticsCatalog":
+        answer = StatisticsCatalog()
+        if document is None:
+            return answer
+        answer.exact = document['exact']
+        answer.node_types = Counter({name: count for name, count in document['node_types']})
+        answer.link_types = Counter({name: count for name, count in document['link_types']})
+        answer.link_arities = Counter({arity: count for arity, count in document['link_arities']})
+        answer.patterns = PostingStatistics.from_dict(document['patterns'])
+        answer.templates = PostingStatistics.from_dict(document['templates'])
+        answer.incoming_degree = PostingStatistics.from_dict(document['incoming_degree'])
+        return answer
@@ -0,0 +1,44 @@
+from das.database.statistics import PostingStatistics, StatisticsCatalog
+
+def _posting_statistics(sizes, top_keys=2):
+    answer = PostingStatistics(top_keys)
+    for key, size in sizes.items():
+        answer.add(key, size)
+    return answer
+
+def test_posting_statistics():
+    statistics = _posting_statistics({"a": 1, "b": 3, "c": 5, "d": 2})
+    assert statistics.to_dict() == {
+        "keys": 4,
+        "entries": 11,
+        "histogram": [[1, 1], [2, 2], [4, 1]],
+        "top": [["c", 5], ["b", 3]],
+    }
+    assert PostingStatistics.from_dict(statistics.to_dict()).to_dict() == statistics.to_dict()
+    statistics.merge(_posting_statistics({"b": 4, "e": 1}))
+    assert statistics.keys == 6
+    assert statistics.entries == 16
+    assert statistics.to_dict()["top"] == [["b", 7], ["c", 5]]
+
+def test_statistics_catalog():
+    catalog = StatisticsCatalog()
+    delta = StatisticsCatalog()
+    delta.node_types["Concept"] += 2
+    delta.link_types["Inheritance"] += 1
+    delta.link_arities[2] += 1
+    catalog.merge(delta)
+    # Merging into an empty catalog keeps it exact
+    assert catalog.exact
+    assert catalog.to_dict()["node_types"] == [["Concept", 2]]
+    catalog.merge(delta)
+    assert not catalog.exact
+    assert StatisticsCatalog.from_dict(catalog.to_dict()).to_dict() == {
+        "exact": False,
+        "node_types": [["Concept", 4]],
+        "link_types": [["Inheritance", 2]],
+        "link_arities": [[2, 2]],
+        "patterns": PostingStatistics().to_dict(),
+        "templates": PostingStatistics().to_dict(),
+        "incoming_degree": PostingStatistics().to_dict(),
+    }
+    assert StatisticsCatalog.from_dict(None).empty()
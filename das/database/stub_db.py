@@ -1,5 +1,6 @@
 import re
-from typing import List, Any, Tuple
+from copy import deepcopy
+from typing import List, Any, Tuple, Dict, Optional
 
 from das.database.db_interface import DBInterface
 from das.pattern_matcher.pattern_matcher import WILDCARD
@@ -81,6 +82,7 @@ class StubDB(DBInterface):
             v = self.template_index.get(key, [])
             v.append([_build_link_handle(link[0], link[1:]), link[1:]])
             self.template_index[key] = v
+        self.views = {}
 
     def __repr__(self):
         return '<StubDB>'
@@ -186,3 +188,15 @@ class StubDB(DBInterface):
 
     def count_atoms(self):
         return (len(self.all_nodes), len(self.all_links))
+
+    def save_view(self, name: str, view: Dict[str, Any]) -> None:
+        self.views[name] = deepcopy(view)
+
+    def get_view(self, name: str) -> Optional[Dict[str, Any]]:
+        return deepcopy(self.views.get(name, None))
+
+    def get_view_definitions(self) -> Dict[str, Dict[str, Any]]:
+        return {name: view['definition'] for name, view in self.views.items()}
+
+    def drop_view(self, name: str) -> None:
+        self.views.pop(name, None)
@@ -5,23 +5,27 @@ Distributed Atom Space
 
 import os
 import json
-from time import sleep
-from typing import List, Optional, Union, Tuple, Dict
-from pymongo import MongoClient as MongoDBClient
-from couchbase.cluster import Cluster as CouchbaseDB
-from couchbase.auth import PasswordAuthenticator as CouchbasePasswordAuthenticator
-from couchbase.options import LockMode as CouchbaseLockMode
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 from couchbase.management.collections import CollectionSpec as CouchbaseCollectionSpec
 from enum import Enum, auto
-from das.parser_actions import KnowledgeBaseFile, MultiThreadParsing
+from das.metta_yacc import MettaYacc
+from das.parser_actions import MultiThreadParsing
 from das.database.couch_mongo_db import CouchMongoDB
 from das.database.couchbase_schema import CollectionNames as CouchbaseCollections
+from das.database.key_value_cache import CachePolicy
+from das.database.pattern_index import PatternIndex
+from das.database.index_advisor import advise_pattern_index
+from das.external_sort import ExternalSort, SORT_CONCURRENCY, SORT_MEMORY_BUDGET, SORT_WORKERS
+from das.database.connection_manager import connection_manager, CONNECTION_OPTIONS
+from das.parser_processes import FAST_PARSER, PARSER_CHUNK_SIZE, PARSER_WORKERS, parse_files
 from das.parser_threads import SharedData, ParserThread, FlushNonLinksToDBThread, BuildConnectivityThread, \
     BuildPatternsThread, BuildTypeTemplatesThread, PopulateMongoDBLinksThread, PopulateCouchbaseCollectionThread
 from das.logger import logger
 from das.database.db_interface import WILDCARD
 from das.transaction import Transaction
 from das.pattern_matcher.pattern_matcher import PatternMatchingAnswer, LogicalExpression
+from das.pattern_matcher.materialized_view import materialize, maintain, rewrite, stored_views
 
 class QueryOutputFormat(int, Enum):
     HANDLE = auto()
@@ -32,32 +36,53 @@ class DistributedAtomSpace:
 
     def __init__(self, **kwargs):
         self.database_name = kwargs.get("database_name", "das")
+        self.couchbase_cache_size = kwargs.get("couchbase_cache_size", None)
+        self.couchbase_cache_policy = kwargs.get("couchbase_cache_policy", CachePolicy.LRU)
+        self.node_cache_size = kwargs.get("node_cache_size", None)
+        self.node_bloom_filter = kwargs.get("node_bloom_filter", False)
+        self.handle_encoding = kwargs.get("handle_encoding", None)
+        self.pattern_index_policies = kwargs.get("pattern_index_policies", None)
+        self.pattern_black_list = kwargs.get("pattern_black_list", None)
+        self.external_sort = ExternalSort(
+            memory_budget=kwargs.get("sort_memory_budget", SORT_MEMORY_BUDGET),
+            scratch_dir=kwargs.get("sort_scratch_dir", None),
+            compress=kwargs.get("sort_compress", False),
+            workers=kwargs.get("sort_workers", SORT_WORKERS),
+            concurrent_sorts=kwargs.get("sort_concurrency", SORT_CONCURRENCY))
+        self.parser_workers = kwargs.get("parser_workers", PARSER_WORKERS)
+        if self.parser_workers <= 0:
+            raise ValueError(f"Invalid number of parser workers: {self.parser_workers}")
+        self.parser_chunk_size = kwargs.get("parser_chunk_size", PARSER_CHUNK_SIZE)
+        if self.parser_chunk_size <= 0:
+            raise ValueError(f"Invalid parser chunk size: {self.parser_chunk_size}")
+        self.fast_parser = kwargs.get("fast_parser", FAST_PARSER)
+        self.connection_options = {
+            name: kwargs.get(name, None) for name in CONNECTION_OPTIONS
+        }
         self.db = None
+        self.transaction_parser = None
+        self.transaction_lock = Lock()
         logger().info(f"New Distributed Atom Space. Database name: {self.database_name}")
         self._setup_database()
 
     def _setup_database(self):
-        hostname = os.environ.get('DAS_MONGODB_HOSTNAME')
-        port = os.environ.get('DAS_MONGODB_PORT')
-        username = os.environ.get('DAS_DATABASE_USERNAME')
-        password = os.environ.get('DAS_DATABASE_PASSWORD')
-        self.mongo_db = MongoDBClient(f'mongodb://{username}:{password}@{hostname}:{port}')[self.database_name]
-
-        hostname = os.environ.get('DAS_COUCHBASE_HOSTNAME')
-        self.couch_db = CouchbaseDB(
-            f'couchbase://{hostname}',
-            authenticator=CouchbasePasswordAuthenticator(username, password),
-            lockmode=CouchbaseLockMode.WAIT).bucket(self.database_name)
-
-        collection_manager = self.couch_db.collections()
-        for entry in CouchbaseCollections:
-            try:
-                collection_manager.create_collection(CouchbaseCollectionSpec(entry.value))
-            except Exception:
-                #TODO: should we provide a warning here?
-                pass
-
-        self.db = CouchMongoDB(self.couch_db, self.mongo_db)
+        manager = connection_manager()
+        self.mongo_db = manager.mongo_database(self.database_name, **self.connection_options)
+        self.couch_db = manager.couchbase_bucket(self.database_name, **self.connection_options)
+
+        pattern_index = None
+        if self.pattern_index_policies is not None or self.pattern_black_list is not None:
+            pattern_index = PatternIndex(self.pattern_index_policies, self.pattern_black_list)
+
+        self.db = CouchMongoDB(
+            self.couch_db,
+            self.mongo_db,
+            couchbase_cache_size=self.couchbase_cache_size,
+            couchbase_cache_policy=self.couchbase_cache_policy,
+            node_cache_size=self.node_cache_size,
+            node_bloom_filter=self.node_bloom_filter,
+            handle_encoding=self.handle_encoding,
+            pattern_index=pattern_index)
         self.db.prefetch()
 
     def _get_file_list(self, source):
@@ -84,7 +109,8 @@ class DistributedAtomSpace:
         if not atom_list:
             return []
         if isinstance(atom_list[0], str):
-            return atom_list
+            # The DB may answer a (frozen) tuple
+            return list(atom_list)
         else:
             return [handle for handle, _ in atom_list]
 
@@ -107,6 +133,8 @@ class DistributedAtomSpace:
         answer = []
         if db_answer:
             flat_handle = isinstance(db_answer[0], str)
+            handles = []
+            arities = []
             for atom in db_answer:
                 if flat_handle:
                     handle = atom
@@ -114,40 +142,79 @@ class DistributedAtomSpace:
                 else:
                     handle, targets = atom
                     arity = len(targets)
-                answer.append(self.db.get_atom_as_deep_representation(handle, arity))
+                handles.append(handle)
+                arities.append(arity)
+            answer = self.db.get_atoms_as_deep_representation(handles, arities)
         return json.dumps(answer, sort_keys=False, indent=4)
 
-    def _process_parsed_data(self, shared_data: SharedData, update: bool):
-        shared_data.replicate_regular_expressions()
+    def _load(self, shared_data: SharedData, parse: Callable[[], None], update: bool):
+        shared_data.external_sort = self.external_sort
+        shared_data.create_temporary_files()
+        shared_data.pattern_index = self.db.pattern_index
+        shared_data.pattern_black_list = list(self.db.pattern_index.black_list)
+        if update:
+            shared_data.new_link_handles = set()
+        else:
+            # Secondary indexes are rebuilt after bulk loads
+            self.db.drop_mongo_indexes()
+        # Parsed links are uploaded to MongoDB and written to the temporary
+        # files while the files are parsed. The builders must be created
+        # before the links uploader starts (they register their queues).
         file_builder_threads = [
-            FlushNonLinksToDBThread(self.db, shared_data, update),
             BuildConnectivityThread(shared_data),
             BuildPatternsThread(shared_data),
             BuildTypeTemplatesThread(shared_data)
         ]
-        for thread in file_builder_threads:
-            thread.start()
-        links_uploader_to_mongo_thread = PopulateMongoDBLinksThread(self.db, shared_data, update)
-        links_uploader_to_mongo_thread.start()
-        for thread in file_builder_threads:
-            thread.join()
-        assert shared_data.build_ok_count == len(file_builder_threads)
-
+        links_uploader_to_mongo_thread = PopulateMongoDBLinksThread(self.db, shared_data)
+        # Each collection is uploaded as soon as its temporary file is ready
         file_processor_threads = [
             PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.OUTGOING_SET, False, False, update),
             PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.INCOMING_SET, False, False, update),
             PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.PATTERNS, True, False, update),
             PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.TEMPLATES, True, False, update),
-            PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.NAMED_ENTITIES, False, True, update)
+            PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.NAMED_ENTITIES, False, True, update),
+            PopulateCouchbaseCollectionThread(self.db, shared_data, CouchbaseCollections.NAME_NGRAMS, False, False, update)
         ]
-        for thread in file_processor_threads:
+        for thread in [*file_builder_threads, links_uploader_to_mongo_thread, *file_processor_threads]:
             thread.start()
+        try:
+            parse()
+        except Exception:
+            # Parsers stop when a loader thread fails, which is raised below
+            if shared_data.error is None:
+                raise
+        finally:
+            shared_data.end_of_links()
+            # Nodes and types are flushed once every file is parsed
+            file_builder_threads.append(FlushNonLinksToDBThread(self.db, shared_data, update))
+            file_builder_threads[-1].start()
+        for thread in file_builder_threads:
+            thread.join()
         links_uploader_to_mongo_thread.join()
-        assert shared_data.mongo_uploader_ok
         for thread in file_processor_threads:
             thread.join()
+        shared_data.remove_temporary_files()
+        if shared_data.error is not None:
+            raise shared_data.error
+        assert shared_data.build_ok_count == len(file_builder_threads)
+        assert shared_data.mongo_uploader_ok
         assert shared_data.process_ok_count == len(file_processor_threads)
-        self.db.prefetch()
+        if update:
+            for collection_name, keys in shared_data.updated_keys.items():
+                self.db.invalidate_couchbase_cache(collection_name, keys)
+        else:
+            self.db.invalidate_couchbase_cache()
+        self.db.refresh_prefetched(shared_data.typedef_documents, shared_data.terminal_documents)
+        if self.db.ngram_index:
+            self.db.save_ngram_index()
+        self.db.update_statistics(shared_data.statistics)
+        if not update:
+            self.db.build_mongo_indexes()
+        for name, expression in stored_views(self.db).items():
+            if update:
+                maintain(self.db, name, expression, shared_data.new_link_handles)
+            else:
+                materialize(self.db, name, expression)
 
 
     # Public API
@@ -159,10 +226,53 @@ class DistributedAtomSpace:
         for entry in CouchbaseCollections:
             collection_manager.drop_collection(CouchbaseCollectionSpec(entry.value))
             collection_manager.create_collection(CouchbaseCollectionSpec(entry.value))
+        self.db.invalidate_couchbase_cache()
+        self.db.prefetch()
 
     def count_atoms(self) -> Tuple[int, int]:
         return self.db.count_atoms()
 
+    def stats(self) -> Dict[str, Any]:
+        """
+        Statistics collected while loading the knowledge base: number of
+        nodes and links per type, link arities and the size distribution
+        (histogram and heaviest keys) of patterns, type templates and
+        incoming sets. Statistics are exact unless they were merged from
+        several loads or transactions.
+        """
+        return self.db.statistics()
+
+    def index_status(self) -> List[Dict[str, Any]]:
+        """
+        Secondary indexes of the MongoDB collections: collection, name,
+        fields, status ('ready', 'building', 'failed' or 'missing') and size
+        in bytes (None if unknown). Indexes are built in background after
+        each call to load_knowledge_base().
+        """
+        sizes = self.db.mongo_index_sizes()
+        answer = self.db.mongo_index_status()
+        for index in answer:
+            index['size'] = sizes.get(index['collection'], {}).get(index['name'], None)
+        return answer
+
+    def build_indexes(self, wait: bool = True) -> None:
+        """
+        Build the missing secondary indexes of the MongoDB collections.
+        """
+        self.db.build_mongo_indexes(wait)
+
+    def advise_pattern_index(self, storage_budget: int) -> PatternIndex:
+        """
+        Propose pattern index policies (and a black list of link types) for
+        the pattern matching queries answered so far, keeping the number of
+        pattern entries within storage_budget. The proposal can be passed as
+        pattern_index_policies and pattern_black_list when the knowledge base
+        is loaded again.
+        """
+        self.db.save_pattern_usage()
+        link_type_counts = dict(self.stats()['link_types'])
+        return advise_pattern_index(self.db.stored_pattern_usage(), link_type_counts, storage_budget)
+
     def get_atom(self,
         handle: str,
         output_format: QueryOutputFormat = QueryOutputFormat.HANDLE) -> Union[str, Dict]:
@@ -215,7 +325,7 @@ class DistributedAtomSpace:
         elif output_format == QueryOutputFormat.ATOM_INFO:
             return [self.db.get_atom_as_dict(handle) for handle in answer]
         elif output_format == QueryOutputFormat.JSON:
-            answer = [self.db.get_atom_as_deep_representation(handle) for handle in answer]
+            answer = self.db.get_atoms_as_deep_representation(answer)
             return json.dumps(answer, sort_keys=False, indent=4)
         else:
             raise ValueError(f"Invalid output format: '{output_format}'")
@@ -272,6 +382,7 @@ class DistributedAtomSpace:
         query: LogicalExpression,
         output_format: QueryOutputFormat = QueryOutputFormat.HANDLE) -> str:
 
+        query = rewrite(query, stored_views(self.db))
         query_answer = PatternMatchingAnswer()
         matched = query.matched(self.db, query_answer)
         tag_not = ""
@@ -293,18 +404,45 @@ class DistributedAtomSpace:
                 raise ValueError(f"Invalid output format: '{output_format}'")
         return f"{tag_not}{mapping}"
 
+    def create_view(self, name: str, expression: LogicalExpression) -> None:
+        """
+        Declare a materialized view: the answer of expression is stored and
+        kept up to date by load_knowledge_base() and commit_transaction(),
+        and query() reads the sub-queries equal to expression (up to variable
+        names) from it.
+        """
+        materialize(self.db, name, expression)
+
+    def drop_view(self, name: str) -> None:
+        self.db.drop_view(name)
+
+    def views(self) -> List[str]:
+        return sorted(self.db.get_view_definitions())
+
     def open_transaction(self) -> Transaction:
         return Transaction()
 
     def commit_transaction(self, transaction: Transaction) -> None:
-        shared_data = SharedData()
-        parser_thread = ParserThread(
-            MultiThreadParsing(self.db, transaction.metta_string(), shared_data, use_action_broker_cache=True), 
-            use_action_broker_cache=True)
-        parser_thread.start()
-        parser_thread.join()
-        assert shared_data.parse_ok_count == 1
-        self._process_parsed_data(shared_data, True)
+        with self.transaction_lock:
+            shared_data = SharedData()
+            parser_actions_broker = MultiThreadParsing(
+                self.db, transaction.metta_string(), shared_data, use_action_broker_cache=True)
+            # The parser is built once and reused by the next transactions
+            if self.transaction_parser is None:
+                self.transaction_parser = MettaYacc(action_broker=parser_actions_broker, use_action_broker_cache=True)
+            else:
+                self.transaction_parser.reset(parser_actions_broker)
+            parser_thread = ParserThread(
+                parser_actions_broker,
+                use_action_broker_cache=True,
+                parser=self.transaction_parser)
+
+            def parse():
+                parser_thread.start()
+                parser_thread.join()
+                assert shared_data.parse_ok_count == 1
+
+            self._load(shared_data, parse, True)
 
     def load_knowledge_base(self, source):
         """
@@ -317,17 +455,10 @@ class DistributedAtomSpace:
             logger().info(f"Knowledge base file: {file_name}")
         shared_data = SharedData()
 
-        parser_threads = [
-            ParserThread(KnowledgeBaseFile(self.db, file_name, shared_data))
-            for file_name in knowledge_base_file_list
-        ]
-        for i in range(len(parser_threads)):
-            parser_threads[i].start()
-            # Sleep to avoid concurrency harzard in yacc lib startup
-            # (which is not thread safe)
-            if i < (len(parser_threads) - 1):
-                sleep(10)
-        for thread in parser_threads:
-            thread.join()
-        assert shared_data.parse_ok_count == len(parser_threads)
-        self._process_parsed_data(shared_data, False)
+
+        def parse():
+            parse_files(
+                knowledge_base_file_list, shared_data, self.parser_workers, self.parser_chunk_size, self.fast_parser)
+            assert shared_data.parse_ok_count == len(knowledge_base_file_list)
+
+        self._load(shared_data, parse, False)
@@ -4,6 +4,13 @@ import os
 import pytest
 from das.distributed_atom_space import DistributedAtomSpace, WILDCARD, QueryOutputFormat
 from das.database.db_interface import UNORDERED_LINK_TYPES
+from das.database.couchbase_schema import CollectionNames as CouchbaseCollectionNames
+from das.database.mongo_schema import CollectionNames as MongoCollectionNames, FieldNames as MongoFieldNames
+from das.database.posting_list import head_block_count, head_bounds
+from das.database.handle_encoding import HandleEncoding
+from das.database.pattern_index import PatternIndexPolicy
+from das.pattern_matcher.pattern_matcher import And, Link, Node, Variable, PatternMatchingAnswer
+from das.pattern_matcher.materialized_view import MaterializedView, rewrite, stored_views
 
 das = DistributedAtomSpace()
 
@@ -197,3 +204,327 @@ def test_get_links_with_patterns():
         set([human, ent]),
         [human, mammal],
     ])
+
+@pytest.mark.parametrize("encoding", [HandleEncoding.BINARY, HandleEncoding.COMPRESSED])
+def test_binary_handle_encoding(encoding):
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    with pytest.raises(ValueError):
+        DistributedAtomSpace(handle_encoding=encoding)
+    expected_links = das.get_links(inheritance, None, [WILDCARD, mammal])
+    expected_template = das.get_links(inheritance, [concept, concept])
+    link = das.get_link(inheritance, [human, mammal])
+    expected_json = das.get_atom(link, output_format=QueryOutputFormat.JSON)
+    das.clear_database()
+    try:
+        binary_das = DistributedAtomSpace(handle_encoding=encoding)
+        binary_das.load_knowledge_base(animals)
+        with pytest.raises(ValueError):
+            DistributedAtomSpace(handle_encoding=HandleEncoding.HEX)
+        assert binary_das.count_atoms() == (14, 26)
+        assert binary_das.get_node(concept, "human") == human
+        assert sorted(binary_das.get_nodes(concept)) == sorted(all_nodes)
+        assert binary_das.get_link(inheritance, [human, mammal]) == link
+        assert binary_das.get_atom(link, output_format=QueryOutputFormat.ATOM_INFO)["targets"] == [human, mammal]
+        assert sorted(binary_das.get_links(inheritance, None, [WILDCARD, mammal])) == sorted(expected_links)
+        assert sorted(binary_das.get_links(inheritance, [concept, concept])) == sorted(expected_template)
+        assert binary_das.get_atom(link, output_format=QueryOutputFormat.JSON) == expected_json
+        # A link which was loaded as a nested expression becomes a toplevel one
+        transaction = binary_das.open_transaction()
+        transaction.add_toplevel_expression('(: "gorilla" Concept)')
+        transaction.add_toplevel_expression('(Similarity (Inheritance "gorilla" "mammal") "human")')
+        binary_das.commit_transaction(transaction)
+        gorilla = binary_das.get_link(inheritance, [binary_das.get_node(concept, "gorilla"), mammal])
+        links = binary_das.db.mongo_collection(MongoCollectionNames.LINKS_ARITY_2)
+        assert not links.find_one({MongoFieldNames.ID_HASH: gorilla})[MongoFieldNames.IS_TOPLEVEL]
+        transaction = binary_das.open_transaction()
+        transaction.add_toplevel_expression('(Inheritance "gorilla" "mammal")')
+        binary_das.commit_transaction(transaction)
+        assert links.find_one({MongoFieldNames.ID_HASH: gorilla})[MongoFieldNames.IS_TOPLEVEL]
+    finally:
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_stats():
+    stats = das.stats()
+    assert stats["exact"]
+    assert stats["node_types"] == [["Concept", 14]]
+    assert stats["link_types"] == [["Inheritance", 12], ["Similarity", 14]]
+    assert stats["link_arities"] == [[2, 26]]
+    assert stats["templates"]["entries"] == 2 * 26
+    assert stats["incoming_degree"]["entries"] == 2 * 26
+    assert stats["incoming_degree"]["keys"] == 14
+    assert sum(count for _, count in stats["incoming_degree"]["histogram"]) == 14
+    # human is a target of 1 inheritance and 6 similarity links
+    assert stats["incoming_degree"]["top"][0] == [human, 7]
+    assert stats["patterns"]["keys"] > 0
+
+def test_stats_after_transaction():
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    try:
+        transaction = das.open_transaction()
+        transaction.add_toplevel_expression('(: "gorilla" Concept)')
+        transaction.add_toplevel_expression('(Similarity "gorilla" "human")')
+        transaction.add_toplevel_expression('(Similarity "chimp" "monkey")')
+        das.commit_transaction(transaction)
+        # Nodes which were already loaded aren't counted again
+        assert das.stats()["node_types"] == [["Concept", 15]]
+    finally:
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_pattern_index_policies():
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    queries = [
+        (inheritance, [WILDCARD, mammal]),
+        (inheritance, [human, WILDCARD]),
+        (similarity, [human, WILDCARD]),
+        (WILDCARD, [human, WILDCARD]),
+        (WILDCARD, [chimp, monkey]),
+        (WILDCARD, [WILDCARD, WILDCARD]),
+    ]
+    expected = [sorted(das.get_links(link_type, None, targets)) for link_type, targets in queries]
+    policies = {WILDCARD: PatternIndexPolicy(1), inheritance: PatternIndexPolicy(0)}
+    with pytest.raises(ValueError):
+        DistributedAtomSpace(pattern_index_policies=policies)
+    das.clear_database()
+    _, quads = tempfile.mkstemp(suffix=".metta")
+    try:
+        with open(quads, "w") as f:
+            f.write('(: Quad Type)\n(: Concept Type)\n(: "a" Concept)\n(: "b" Concept)\n(: "c" Concept)\n(: "d" Concept)\n')
+            f.write('(Quad "a" "b" "c" "d")\n(Quad "a" "b" "d" "d")\n(Quad "c" "b" "c" "a")\n')
+        restricted_das = DistributedAtomSpace(pattern_index_policies=policies)
+        restricted_das.load_knowledge_base(animals)
+        for (link_type, targets), answer in zip(queries, expected):
+            assert sorted(restricted_das.get_links(link_type, None, targets)) == answer
+        restricted_das.load_knowledge_base(quads)
+        quad = "Quad"
+        a, b, c, d = [restricted_das.get_node(concept, name) for name in "abcd"]
+        abcd = restricted_das.get_link(quad, [a, b, c, d])
+        abdd = restricted_das.get_link(quad, [a, b, d, d])
+        cbca = restricted_das.get_link(quad, [c, b, c, a])
+        assert sorted(restricted_das.get_links(quad, None, [a, b, WILDCARD, d])) == sorted([abcd, abdd])
+        assert sorted(restricted_das.get_links(quad, None, [WILDCARD, b, c, WILDCARD])) == sorted([abcd, cbca])
+        assert restricted_das.get_links(WILDCARD, None, [c, WILDCARD, c, a]) == [cbca]
+        assert restricted_das.get_links(quad, None, [d, b, WILDCARD, WILDCARD]) == []
+    finally:
+        os.remove(quads)
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_pattern_black_list():
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    queries = [
+        (inheritance, [WILDCARD, mammal]),
+        (inheritance, [human, WILDCARD]),
+        (inheritance, [WILDCARD, WILDCARD]),
+        (similarity, [human, WILDCARD]),
+        (similarity, [WILDCARD, WILDCARD]),
+        (WILDCARD, [human, WILDCARD]),
+        (WILDCARD, [chimp, monkey]),
+        (WILDCARD, [WILDCARD, WILDCARD]),
+    ]
+    expected = [sorted(das.get_links(link_type, None, targets)) for link_type, targets in queries]
+    pattern_entries = das.stats()['patterns']['entries']
+    das.clear_database()
+    try:
+        restricted_das = DistributedAtomSpace(pattern_black_list=[similarity])
+        restricted_das.load_knowledge_base(animals)
+        for (link_type, targets), answer in zip(queries, expected):
+            assert sorted(restricted_das.get_links(link_type, None, targets)) == answer
+        assert restricted_das.stats()['patterns']['entries'] < pattern_entries
+        # Queries with a wildcard type need every type to be indexed
+        index = restricted_das.advise_pattern_index(10 ** 6)
+        assert index.black_list == []
+        assert index.materialized(inheritance, frozenset([0]))
+        assert restricted_das.db.stored_pattern_usage().requests[(inheritance, 2, (0,))] == 1
+    finally:
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_materialized_views():
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    view = And([
+        Link(inheritance, [Variable("X"), Node(concept, "mammal")], True),
+        Link(similarity, [Variable("X"), Variable("Y")], False),
+    ])
+    query = And([
+        Link(inheritance, [Variable("V1"), Node(concept, "mammal")], True),
+        Link(similarity, [Variable("V1"), Variable("V2")], False),
+    ])
+
+    def answers(expression):
+        answer = PatternMatchingAnswer()
+        expression.matched(das.db, answer)
+        return set(answer.assignments)
+
+    try:
+        das.create_view("similar_mammals", view)
+        assert das.views() == ["similar_mammals"]
+        rewritten = rewrite(query, stored_views(das.db))
+        assert isinstance(rewritten, MaterializedView)
+        assert answers(rewritten) == answers(query)
+        assert das.query(query) != ""
+        before = answers(rewritten)
+        transaction = das.open_transaction()
+        transaction.add_toplevel_expression('(: "gorilla" Concept)')
+        transaction.add_toplevel_expression('(Inheritance "gorilla" "mammal")')
+        transaction.add_toplevel_expression('(Similarity "gorilla" "human")')
+        das.commit_transaction(transaction)
+        assert len(answers(rewritten)) > len(before)
+        assert answers(rewritten) == answers(query)
+        das.load_knowledge_base(animals)
+        assert answers(rewritten) == answers(query)
+    finally:
+        das.drop_view("similar_mammals")
+        das.clear_database()
+        das.load_knowledge_base(animals)
+    assert das.views() == []
+
+def test_view_definitions_cache():
+    view = And([
+        Link(inheritance, [Variable("X"), Node(concept, "mammal")], True),
+        Link(similarity, [Variable("X"), Variable("Y")], False),
+    ])
+    try:
+        das.create_view("similar_mammals", view)
+        assert das.query(view) != ""
+        # Queries don't read the definitions again
+        definitions = das.db.view_definitions
+        assert definitions is not None
+        assert das.views() == ["similar_mammals"]
+        assert das.query(view) != ""
+        assert das.db.view_definitions is definitions
+        das.drop_view("similar_mammals")
+        assert das.views() == []
+        das.create_view("similar_mammals", view)
+        assert das.views() == ["similar_mammals"]
+    finally:
+        das.drop_view("similar_mammals")
+
+def test_streaming_load(monkeypatch):
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    queries = [
+        (inheritance, [WILDCARD, mammal]),
+        (similarity, [human, WILDCARD]),
+        (WILDCARD, [WILDCARD, WILDCARD]),
+    ]
+    expected = [sorted(das.get_links(link_type, None, targets)) for link_type, targets in queries]
+    expected_stats = das.stats()
+    # Links are passed one at a time through queues of one batch
+    monkeypatch.setattr("das.parser_actions.LINK_BATCH_SIZE", 1)
+    monkeypatch.setattr("das.parser_threads.LINK_QUEUE_SIZE", 1)
+    monkeypatch.setattr("das.parser_threads.LINK_LOCATOR_BATCH_SIZE", 2)
+    das.clear_database()
+    try:
+        streaming_das = DistributedAtomSpace()
+        streaming_das.load_knowledge_base(animals)
+        for (link_type, targets), answer in zip(queries, expected):
+            assert sorted(streaming_das.get_links(link_type, None, targets)) == answer
+        assert streaming_das.count_atoms() == (14, 26)
+        assert streaming_das.stats() == expected_stats
+        # Links already in the database aren't written again
+        streaming_das.load_knowledge_base(animals)
+        assert streaming_das.count_atoms() == (14, 26)
+        for (link_type, targets), answer in zip(queries, expected):
+            assert sorted(streaming_das.get_links(link_type, None, targets)) == answer
+    finally:
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_failed_load(monkeypatch):
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    def failed_insert(*args):
+        raise ConnectionError("MongoDB is gone")
+    # Parsers fill the queues of one batch long before all the links are
+    # parsed, so they'd wait forever for the failed uploader
+    monkeypatch.setattr("das.parser_actions.LINK_BATCH_SIZE", 1)
+    monkeypatch.setattr("das.parser_threads.LINK_QUEUE_SIZE", 1)
+    monkeypatch.setattr("das.parser_threads.PopulateMongoDBLinksThread._insert_many", failed_insert)
+    try:
+        with pytest.raises(ConnectionError):
+            das.load_knowledge_base(animals)
+        transaction = das.open_transaction()
+        transaction.add_toplevel_expression('(: "gorilla" Concept)')
+        for _ in range(3):
+            transaction.add_toplevel_expression('(Inheritance "gorilla" "mammal")')
+            transaction.add_toplevel_expression('(Similarity "gorilla" "human")')
+        with pytest.raises(ConnectionError):
+            das.commit_transaction(transaction)
+    finally:
+        monkeypatch.undo()
+        das.clear_database()
+        das.load_knowledge_base(animals)
+
+def test_sort_scratch_dir(monkeypatch):
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    with tempfile.TemporaryDirectory() as directory:
+        scratch_das = DistributedAtomSpace(sort_scratch_dir=directory)
+        created = []
+        temporary_file = scratch_das.external_sort.temporary_file
+        def record(*args):
+            created.append(temporary_file(*args))
+            return created[-1]
+        monkeypatch.setattr(scratch_das.external_sort, "temporary_file", record)
+        # Links already in the database aren't changed
+        transaction = scratch_das.open_transaction()
+        transaction.add_toplevel_expression('(Inheritance "human" "mammal")')
+        scratch_das.commit_transaction(transaction)
+        assert len(created) > len(CouchbaseCollectionNames)
+        assert all(os.path.dirname(name) == directory for name in created)
+        assert len(set(created)) == len(created)
+        assert os.listdir(directory) == []
+        # Files are removed when the load fails too
+        def failed_insert(*args):
+            raise ConnectionError("MongoDB is gone")
+        monkeypatch.setattr("das.parser_threads.PopulateMongoDBLinksThread._insert_many", failed_insert)
+        try:
+            with pytest.raises(ConnectionError):
+                scratch_das.load_knowledge_base(animals)
+            assert os.listdir(directory) == []
+        finally:
+            monkeypatch.undo()
+            das.clear_database()
+            das.load_knowledge_base(animals)
+
+def test_transaction_on_multi_block_values(monkeypatch):
+    animals = os.path.join(os.path.dirname(__file__), '../data/samples/animals.metta')
+    queries = [
+        (inheritance, [WILDCARD, mammal]),
+        (similarity, [human, WILDCARD]),
+        (WILDCARD, [WILDCARD, WILDCARD]),
+    ]
+    query = And([
+        Link(inheritance, [Variable("V1"), Node(concept, "mammal")], True),
+        Link(similarity, [Variable("V1"), Variable("V2")], False),
+    ])
+
+    def load_and_update():
+        das.clear_database()
+        das.load_knowledge_base(animals)
+        transaction = das.open_transaction()
+        transaction.add_toplevel_expression('(: "gorilla" Concept)')
+        transaction.add_toplevel_expression('(Inheritance "gorilla" "mammal")')
+        transaction.add_toplevel_expression('(Similarity "gorilla" "human")')
+        das.commit_transaction(transaction)
+        return (
+            [sorted(das.get_links(link_type, None, targets)) for link_type, targets in queries],
+            das.query(query),
+        )
+
+    try:
+        expected = load_and_update()
+        # Posting lists of more than 4 entries (1 with targets) are split in
+        # blocks
+        monkeypatch.setattr("das.parser_threads.MAX_COUCHBASE_BLOCK_SIZE", 4)
+        answer = load_and_update()
+        collection = das.db.couch_collection[CouchbaseCollectionNames.INCOMING_SET]
+        head = collection.get(mammal).content
+        assert head_block_count(head) > 1
+        handles = [handle for first, last in head_bounds(head) for handle in (first, last)]
+        assert handles == sorted(handles)
+        assert answer == expected
+        assert len(expected[0][0]) == 5
+    finally:
+        monkeypatch.undo()
+        das.clear_database()
+        das.load_knowledge_base(animals)
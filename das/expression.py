@@ -1,6 +1,6 @@
 import json
 from typing import Optional, List, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 
 @dataclass
 class Expression:
@@ -22,6 +22,14 @@ class Expression:
     def __hash__(self):
         return hash(self.hash_code)
 
+    def to_tuple(self) -> tuple:
+        # Compact form used to pass expressions between processes
+        return tuple(getattr(self, field.name) for field in fields(self))
+
+    @staticmethod
+    def from_tuple(values: tuple) -> "Expression":
+        return Expression(*values)
+
     def to_dict(self):
         assert(self.ordered)
         answer = {
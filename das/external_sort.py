@@ -0,0 +1,151 @@
+import gzip
+import heapq
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from threading import BoundedSemaphore
+from typing import Iterator, List, Optional, Tuple
+
+# Bytes of input sorted in memory at once by all the sorts of an ExternalSort.
+# The budget is split among concurrent_sorts sorts (more sorts wait for a
+# free share) and each share among the workers of the sort, so each worker
+# holds a run of memory_budget / (concurrent_sorts * workers) bytes (plus the
+# overhead of Python objects, about twice that).
+SORT_MEMORY_BUDGET = 512 * 1024 * 1024
+SORT_WORKERS = os.cpu_count() or 1
+# The loader sorts the temporary files of up to 4 builder threads at once
+SORT_CONCURRENCY = 4
+# Runs smaller than this aren't worth a worker process
+MIN_RUN_SIZE = 4 * 1024 * 1024
+# Max number of runs merged at once (each one is an open file)
+MAX_MERGE_FAN_IN = 128
+
+def _open_run(file_name: str, mode: str, compress: bool):
+    if compress:
+        # Runs are read once, so fast compression is enough
+        return gzip.open(file_name, mode, compresslevel=1)
+    return open(file_name, mode)
+
+def _sort_range(file_name: str, start: int, end: int, run_name: str, compress: bool) -> str:
+    # Lines are sorted bytewise (same as LC_ALL=C sort), which is also the
+    # order of Python strings for UTF-8 text
+    with open(file_name, 'rb') as fh:
+        fh.seek(start)
+        lines = fh.read(end - start).split(b'\n')
+    lines = [line for line in lines if line.strip()]
+    lines.sort()
+    with _open_run(run_name, 'wb', compress) as output:
+        for line in lines:
+            output.write(line)
+            output.write(b'\n')
+    return run_name
+
+def _merge_runs(run_names: List[str], compress: bool) -> Iterator[bytes]:
+    with ExitStack() as stack:
+        runs = [stack.enter_context(_open_run(name, 'rb', compress)) for name in run_names]
+        yield from heapq.merge(*[(line.rstrip(b'\n') for line in run) for run in runs])
+
+class SortedRuns:
+    """
+    Sorted runs of a file, which are merged while their lines are read.
+    """
+
+    def __init__(self, run_names: List[str], compress: bool):
+        self.run_names = run_names
+        self.compress = compress
+
+    def lines(self) -> Iterator[str]:
+        for line in _merge_runs(self.run_names, self.compress):
+            yield line.decode('utf-8')
+
+    def remove(self) -> None:
+        for name in self.run_names:
+            os.remove(name)
+        self.run_names = []
+
+class ExternalSort:
+    """
+    Sort text files bigger than memory: the file is split in runs which are
+    sorted in memory by a pool of worker processes and written (optionally
+    gzip compressed) to scratch_dir. The runs are merged by SortedRuns.lines()
+    so the sorted file is never written.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = SORT_MEMORY_BUDGET,
+        scratch_dir: Optional[str] = None,
+        compress: bool = False,
+        workers: int = SORT_WORKERS,
+        concurrent_sorts: int = SORT_CONCURRENCY):
+
+        if memory_budget <= 0:
+            raise ValueError(f'Invalid memory budget: {memory_budget}')
+        if workers <= 0:
+            raise ValueError(f'Invalid number of workers: {workers}')
+        if concurrent_sorts <= 0:
+            raise ValueError(f'Invalid number of concurrent sorts: {concurrent_sorts}')
+        self.memory_budget = memory_budget
+        self.scratch_dir = scratch_dir
+        self.compress = compress
+        self.workers = workers
+        self.concurrent_sorts = concurrent_sorts
+        self.shares = BoundedSemaphore(concurrent_sorts)
+
+    def _ranges(self, file_name: str) -> List[Tuple[int, int]]:
+        # Byte ranges of the file with whole lines
+        size = os.path.getsize(file_name)
+        run_size = max(MIN_RUN_SIZE, self.memory_budget // (self.concurrent_sorts * self.workers))
+        answer = []
+        start = 0
+        with open(file_name, 'rb') as fh:
+            while start < size:
+                fh.seek(min(start + run_size, size))
+                fh.readline()
+                end = min(fh.tell(), size)
+                answer.append((start, end))
+                start = end
+        return answer
+
+    def temporary_file(self, prefix: str, suffix: str = '.txt') -> str:
+        # Unique (and only readable by the owner) file in scratch_dir
+        handle, name = tempfile.mkstemp(prefix=prefix, suffix=suffix, dir=self.scratch_dir)
+        os.close(handle)
+        return name
+
+    def _run_name(self, file_name: str) -> str:
+        return self.temporary_file(f'{os.path.basename(file_name)}.', '.run')
+
+    def _merge(self, run_names: List[str], file_name: str) -> str:
+        name = self._run_name(file_name)
+        with _open_run(name, 'wb', self.compress) as output:
+            for line in _merge_runs(run_names, self.compress):
+                output.write(line)
+                output.write(b'\n')
+        for run_name in run_names:
+            os.remove(run_name)
+        return name
+
+    def sort(self, file_name: str, remove_input: bool = True) -> SortedRuns:
+        ranges = self._ranges(file_name)
+        jobs = [(file_name, start, end, self._run_name(file_name), self.compress) for start, end in ranges]
+        with self.shares:
+            if len(jobs) <= 1:
+                run_names = [_sort_range(*job) for job in jobs]
+            else:
+                # Workers are spawned (not forked) because the loader is
+                # multithreaded
+                with ProcessPoolExecutor(
+                    max_workers=min(self.workers, len(jobs)),
+                    mp_context=multiprocessing.get_context('spawn')) as executor:
+                    run_names = list(executor.map(_sort_range, *zip(*jobs)))
+        while len(run_names) > MAX_MERGE_FAN_IN:
+            run_names = [
+                self._merge(run_names[i:i + MAX_MERGE_FAN_IN], file_name)
+                for i in range(0, len(run_names), MAX_MERGE_FAN_IN)
+            ]
+        if remove_input:
+            os.remove(file_name)
+        return SortedRuns(run_names, self.compress)
@@ -0,0 +1,66 @@
+import os
+import random
+import tempfile
+import pytest
+import das.external_sort
+from das.external_sort import ExternalSort
+
+def _write_lines(directory, lines):
+    file_name = os.path.join(directory, "input.txt")
+    with open(file_name, "w") as fh:
+        for line in lines:
+            fh.write(line)
+            fh.write("\n")
+    return file_name
+
+def _random_lines(count):
+    generator = random.Random(0)
+    # Keys sharing prefixes (and names with non ASCII characters) to check
+    # that lines are sorted bytewise like LC_ALL=C sort
+    return [
+        f"{generator.choice(['a', 'ab', 'b', 'é'])}{generator.randrange(1000):x},{generator.randrange(10 ** 6):x}"
+        for _ in range(count)
+    ]
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_external_sort(monkeypatch, compress):
+    lines = _random_lines(20000)
+    expected = sorted(lines, key=lambda line: line.encode("utf-8"))
+    monkeypatch.setattr(das.external_sort, "MIN_RUN_SIZE", 1)
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = _write_lines(directory, [*lines, ""])
+        # Runs of ~10KB sorted by 2 workers and merged at most 4 at a time
+        monkeypatch.setattr(das.external_sort, "MAX_MERGE_FAN_IN", 4)
+        sorter = ExternalSort(
+            memory_budget=20 * 1024, scratch_dir=directory, compress=compress, workers=2, concurrent_sorts=1)
+        runs = sorter.sort(file_name)
+        assert not os.path.exists(file_name)
+        assert 1 < len(runs.run_names) <= 4
+        assert all(os.path.dirname(name) == directory for name in runs.run_names)
+        assert list(runs.lines()) == expected
+        runs.remove()
+        assert os.listdir(directory) == []
+
+def test_external_sort_small_files():
+    with tempfile.TemporaryDirectory() as directory:
+        runs = ExternalSort(scratch_dir=directory).sort(_write_lines(directory, ["c,1", "a,2", "b,3", "a,1"]))
+        assert len(runs.run_names) == 1
+        assert list(runs.lines()) == ["a,1", "a,2", "b,3", "c,1"]
+        runs.remove()
+        runs = ExternalSort(scratch_dir=directory).sort(_write_lines(directory, []))
+        assert list(runs.lines()) == []
+    with pytest.raises(ValueError):
+        ExternalSort(memory_budget=0)
+    with pytest.raises(ValueError):
+        ExternalSort(workers=0)
+    with pytest.raises(ValueError):
+        ExternalSort(concurrent_sorts=0)
+
+def test_external_sort_budget_shares(monkeypatch):
+    monkeypatch.setattr(das.external_sort, "MIN_RUN_SIZE", 1)
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = _write_lines(directory, _random_lines(2000))
+        # The budget is split among the concurrent sorts
+        alone = ExternalSort(memory_budget=8 * 1024, workers=1, concurrent_sorts=1)
+        shared = ExternalSort(memory_budget=8 * 1024, workers=1, concurrent_sorts=4)
+        assert len(shared._ranges(file_name)) >= 4 * (len(alone._ranges(file_name)) - 1)
@@ -1,4 +1,4 @@
-import ply.lex as lex
+from das.parser_cache import build_lexer
 from das.exceptions import MettaLexerError
  
 BASIC_TYPE = 'Type'
@@ -23,7 +23,7 @@ class MettaLex:
         self.t_EXPRESSION_OPENNING = r'\('
         self.t_EXPRESSION_CLOSING = r'\)'
 
-        self.lexer = lex.lex(module=self, **kwargs)
+        self.lexer = build_lexer(self, **kwargs)
         self.lexer.eof_reported_flag = False
         self.action_broker = None
         self.eof_handler = self.default_eof_handler
@@ -0,0 +1,211 @@
+"""
+Parser of MeTTa files for bulk loads. It accepts the same language as
+MettaYacc (see the grammar in base_yacc.py) and makes the same calls to the
+action broker, with the same Expressions, but tokens are scanned with a
+single regular expression and expressions are built on an explicit stack
+instead of PLY's token objects and per-production callbacks.
+"""
+
+import re
+from typing import Any, List, Optional
+
+from das.base_yacc import BaseYacc
+from das.exceptions import MettaLexerError, MettaSyntaxError
+from das.expression import Expression
+from das.metta_lex import BASIC_TYPE
+
+# The tokens of MettaLex (and the spaces and tabs it ignores before them). Any
+# other character is matched alone so it's reported as an error.
+_TOKEN = re.compile(r'[ \t]*(?:(\()|(\))|(:)|"([^"]+)"|([^\W0-9]\w*)|(\n+)|([^ \t]))')
+_OPENNING, _CLOSING, _TYPE_DEFINITION_MARK, _TERMINAL_NAME, _EXPRESSION_NAME, _NEWLINE, _ERROR = range(1, 8)
+# EXPRESSION_NAMEs which are reserved words
+_BASIC_TYPE = 8
+_TOKEN_TYPES = {
+    _OPENNING: 'EXPRESSION_OPENNING',
+    _CLOSING: 'EXPRESSION_CLOSING',
+    _TYPE_DEFINITION_MARK: 'TYPE_DEFINITION_MARK',
+    _TERMINAL_NAME: 'TERMINAL_NAME',
+    _EXPRESSION_NAME: 'EXPRESSION_NAME',
+    _BASIC_TYPE: 'BASIC_TYPE',
+}
+# Tokens accepted after each token of a type definition
+# "(: NAME TYPE_DESIGNATOR)"
+_TYPEDEF_TOKENS = [
+    (_EXPRESSION_NAME, _TERMINAL_NAME),
+    (_EXPRESSION_NAME, _BASIC_TYPE),
+    (_CLOSING,),
+]
+
+class _Lexer:
+    # What BaseYacc uses of a PLY lexer
+
+    def __init__(self):
+        self.lineno = 1
+        self.eof_reported_flag = False
+
+class MettaParser(BaseYacc):
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.lexer = _Lexer()
+        self.setup()
+
+    def _reset_state(self):
+        super()._reset_state()
+        # Symbols and terminals repeat a lot so the Expression of each one is
+        # built once (until its name is defined again), as well as composite
+        # types (keyed by the composite type hashes of their elements)
+        self.symbols = {}
+        self.terminals = {}
+        self.composite_types = {}
+
+    def setup(self):
+        if self.action_broker is not None:
+            expression = self._typedef(BASIC_TYPE, BASIC_TYPE)
+            self.action_broker.new_top_level_typedef_expression(expression)
+
+    def _typedef(self, name, type_designator, expression=None):
+        self.symbols.pop(name, None)
+        self.terminals.pop(name, None)
+        return super()._typedef(name, type_designator, expression)
+
+    def _new_symbol(self, expression_name, expression=None):
+        if expression is None:
+            cached = self.symbols.get(expression_name)
+            if cached is not None:
+                return cached
+        expression = super()._new_symbol(expression_name, expression)
+        if expression.hash_code is not None:
+            self.symbols[expression_name] = expression
+        return expression
+
+    def _new_terminal(self, terminal_name, expression=None):
+        if expression is None:
+            cached = self.terminals.get(terminal_name)
+            if cached is not None:
+                return cached
+        expression = super()._new_terminal(terminal_name, expression)
+        if expression.hash_code is not None:
+            self.terminals[terminal_name] = expression
+        return expression
+
+    def _nested_expression(self, sub_expressions, expression=None):
+        head = sub_expressions[0]
+        elements = [sub_expression.hash_code for sub_expression in sub_expressions[1:]]
+        if head.hash_code is None or head.named_type is None or None in elements:
+            return super()._nested_expression(sub_expressions, expression)
+        key = tuple(sub_expression.composite_type_hash for sub_expression in sub_expressions)
+        composite_type = self.composite_types.get(key)
+        if composite_type is None:
+            composite_type = (
+                [
+                    sub_expression.composite_type \
+                        if len(sub_expression.composite_type) > 1 \
+                        else sub_expression.composite_type[0] \
+                    for sub_expression in sub_expressions
+                ],
+                self.hasher.composite_hash(list(key)),
+            )
+            self.composite_types[key] = composite_type
+        if expression is None:
+            expression = Expression()
+        expression.named_type = head.named_type
+        expression.named_type_hash = head.named_type_hash
+        expression.composite_type = list(composite_type[0])
+        expression.composite_type_hash = composite_type[1]
+        expression.elements = elements
+        expression.hash_code = self.hasher.expression_hash(head.named_type_hash, elements)
+        return expression
+
+    def _lexer_error(self, input_string: str, position: int):
+        near = input_string[position:position + 81]
+        n = 80 if len(near) > 30 else len(near) - 1
+        error_message = f"File: <input string> - Illegal character at line {self.lexer.lineno}: " + \
+                        f"'{near[0]}' Near: '{near[0:n]}...'"
+        raise MettaLexerError(error_message)
+
+    def _syntax_error(self, token_type: str, value: str, position: int):
+        # Same message as MettaYacc's (with a PLY token)
+        error = f"Syntax error in line {self.lexer.lineno} " + \
+                f"Current token: LexToken({token_type},{value!r},{self.lexer.lineno},{position})"
+        raise MettaSyntaxError(error)
+
+    def _parse(self, input_string: str) -> str:
+        build = not self.check_mode and self.action_broker is not None
+        action_broker = self.action_broker
+        new_symbol = self._new_symbol
+        new_terminal = self._new_terminal
+        nested_expression = self._nested_expression
+        lexer = self.lexer
+        lexer.lineno = 1
+        # Sub-expressions of each open expression, innermost last (just
+        # Nones when expressions aren't built)
+        stack: List[List[Optional[Expression]]] = []
+        # Tokens of the type definition being read, if any
+        typedef: Optional[List[Any]] = None
+        for match in _TOKEN.finditer(input_string):
+            token = match.lastindex
+            if token == _NEWLINE:
+                lexer.lineno += len(match.group(token))
+                continue
+            if token == _ERROR:
+                self._lexer_error(input_string, match.start(token))
+            value = match.group(token)
+            if token == _EXPRESSION_NAME and value == BASIC_TYPE:
+                token = _BASIC_TYPE
+            if typedef is not None:
+                if token not in _TYPEDEF_TOKENS[len(typedef)]:
+                    self._syntax_error(_TOKEN_TYPES[token], value, match.start(match.lastindex))
+                if token != _CLOSING:
+                    typedef.append(value)
+                    continue
+                name, type_designator = typedef
+                typedef = None
+                stack.pop()
+                if not build:
+                    if stack:
+                        stack[-1].append(None)
+                    continue
+                expression = self._typedef(name, type_designator)
+                if stack:
+                    error = f"Error in line {lexer.lineno} " + \
+                            f"Invalid nested type definition: {name}."
+                    raise MettaSyntaxError(error)
+                expression.toplevel = True
+                action_broker.new_top_level_typedef_expression(expression)
+            elif token == _OPENNING:
+                stack.append([])
+            elif not stack or token == _BASIC_TYPE:
+                self._syntax_error(_TOKEN_TYPES[token], value, match.start(match.lastindex))
+            elif token == _EXPRESSION_NAME:
+                stack[-1].append(new_symbol(value) if build else None)
+            elif token == _TERMINAL_NAME:
+                if build:
+                    expression = new_terminal(value)
+                    action_broker.new_terminal(expression)
+                    stack[-1].append(expression)
+                else:
+                    stack[-1].append(None)
+            elif token == _TYPE_DEFINITION_MARK:
+                if stack[-1]:
+                    self._syntax_error(_TOKEN_TYPES[token], value, match.start(match.lastindex))
+                typedef = []
+            else:
+                sub_expressions = stack.pop()
+                if not sub_expressions:
+                    self._syntax_error(_TOKEN_TYPES[token], value, match.start(match.lastindex))
+                if not build:
+                    if stack:
+                        stack[-1].append(None)
+                    continue
+                expression = nested_expression(sub_expressions)
+                if stack:
+                    action_broker.new_expression(expression)
+                    stack[-1].append(expression)
+                else:
+                    expression.toplevel = True
+                    action_broker.new_top_level_expression(expression)
+        if stack:
+            self._syntax_error('EOF', '', len(input_string))
+        self._resolve_pending_symbols()
+        return 'SUCCESS'
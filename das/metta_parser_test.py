@@ -0,0 +1,100 @@
+import os
+import pytest
+from das.exceptions import MettaLexerError, MettaSyntaxError, UndefinedSymbolError
+from das.metta_lex_test import lex_test_data as test_data
+from das.metta_parser import MettaParser
+from das.metta_yacc import MettaYacc
+from das.parser_actions import ParserActions
+
+annotation_service = os.path.join(os.path.dirname(__file__), '../data/annotation_service')
+samples = os.path.join(os.path.dirname(__file__), '../data/samples')
+
+class ActionBroker(ParserActions):
+    # Records the calls of the parser (expressions are compared once the
+    # parsing ends because pending ones are only complete then)
+
+    def __init__(self, data=None):
+        super().__init__()
+        self.file_path = ""
+        self.input_string = data
+        self.calls = []
+
+    def new_expression(self, expression):
+        self.calls.append(("new_expression", expression))
+
+    def new_terminal(self, expression):
+        self.calls.append(("new_terminal", expression))
+
+    def new_top_level_expression(self, expression):
+        self.calls.append(("new_top_level_expression", expression))
+
+    def new_top_level_typedef_expression(self, expression):
+        self.calls.append(("new_top_level_typedef_expression", expression))
+
+def _parse(parser_class, data):
+    action_broker = ActionBroker(data)
+    parser = parser_class(action_broker=action_broker)
+    assert parser.parse_action_broker_input() == "SUCCESS"
+    return action_broker.calls
+
+def _file_names(directory):
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+def test_check():
+    assert MettaParser().check(test_data) == "SUCCESS"
+    assert MettaParser().check("") == "SUCCESS"
+    action_broker = ActionBroker()
+    assert MettaParser(action_broker=action_broker).check(test_data) == "SUCCESS"
+    assert [call for call, expression in action_broker.calls] == ["new_top_level_typedef_expression"]
+
+@pytest.mark.parametrize("file_name", _file_names(samples) + _file_names(annotation_service))
+def test_same_as_metta_yacc(file_name):
+    with open(file_name) as fh:
+        data = fh.read()
+    calls = _parse(MettaParser, data)
+    assert calls == _parse(MettaYacc, data)
+    assert len(calls) > 1
+    assert MettaParser().check(data) == "SUCCESS"
+
+def test_reset():
+    parser = MettaParser(action_broker=ActionBroker())
+    for _ in range(2):
+        action_broker = ActionBroker(test_data)
+        parser.reset(action_broker)
+        assert parser.parse_action_broker_input() == "SUCCESS"
+        assert action_broker.calls == _parse(MettaYacc, test_data)
+        assert parser.lexer.lineno == test_data.count("\n") + 1
+
+@pytest.mark.parametrize("data", [
+    '(: a Type)\n(: b a)\n(: "c" b)\n(b "c" (b "c"))',
+    '(: a Type)\n(: b a)\n(a (a "c" b) "c")\n(: "c" b)',
+    '(: a Type)\t(: b a)\n\n(: "c d" b)  (b "c d")  ',
+    '(: a Type)\n(: b a)\n(: "c\nd" b)\n\n(b "c\nd")',
+])
+def test_cases(data):
+    assert _parse(MettaParser, data) == _parse(MettaYacc, data)
+
+@pytest.mark.parametrize("data, error", [
+    ('(: a Type)\n(: b a)\n(b "c")', UndefinedSymbolError),
+    ('(: a Type)\n(b a)', UndefinedSymbolError),
+    ('(: a b)', UndefinedSymbolError),
+    ('(: a Type)\n(a (: b a))', MettaSyntaxError),
+    ('(: a Type)\n(a ())', MettaSyntaxError),
+    ('(: a Type)\n(a a', MettaSyntaxError),
+    ('(: a Type)\n(a a))', MettaSyntaxError),
+    ('(: a Type)\na', MettaSyntaxError),
+    ('(: a Type)\n(a Type)', MettaSyntaxError),
+    ('(: a Type)\n(a : a)', MettaSyntaxError),
+    ('(: a Type Type)', MettaSyntaxError),
+    ('(: Type Type)', MettaSyntaxError),
+    ('(: a "b")', MettaSyntaxError),
+    ('(: a Type)\n(a 1)', MettaLexerError),
+    ('(: a Type)\n(a "")', MettaLexerError),
+    ('(: a Type)\n(a "b)', MettaLexerError),
+    ('(: a Type)\r\n(a a)', MettaLexerError),
+])
+def test_errors(data, error):
+    with pytest.raises(error):
+        _parse(MettaYacc, data)
+    with pytest.raises(error):
+        _parse(MettaParser, data)
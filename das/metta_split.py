@@ -0,0 +1,87 @@
+import mmap
+import os
+import re
+from typing import List, Tuple
+
+from das.base_yacc import BaseYacc
+
+# Only parenthesis and quotes (which delimit terminal names, see MettaLex)
+# matter to find where top level expressions start and end
+_STRUCTURE = re.compile(rb'[()"]')
+_QUOTE = re.compile(rb'"')
+_TYPEDEF_START = re.compile(rb'\(\s*:')
+_TYPEDEF = re.compile(r'\(\s*:\s*(?:"([^"]+)"\s*|([^\W0-9]\w*)\s+)([^\W0-9]\w*)\s*\)')
+
+def split_metta(file_name: str, chunk_size: int) -> Tuple[List[Tuple[int, int]], List[Tuple[str, str]]]:
+    """
+    Cut a MeTTa file in byte ranges of about chunk_size bytes which end at
+    top level expression boundaries. Also returns the (name, type) of its top
+    level type definitions, in file order, so chunks can be parsed apart
+    (see SymbolTables).
+    """
+    if chunk_size <= 0:
+        raise ValueError(f'Invalid chunk size: {chunk_size}')
+    ranges = []
+    typedefs = []
+    size = os.path.getsize(file_name)
+    if size == 0:
+        return ranges, typedefs
+    with open(file_name, 'rb') as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        depth = 0
+        start = 0
+        expression_start = 0
+        position = 0
+        while True:
+            match = _STRUCTURE.search(data, position)
+            if match is None:
+                break
+            position = match.end()
+            token = match.group()
+            if token == b'"':
+                match = _QUOTE.search(data, position)
+                if match is None:
+                    break
+                position = match.end()
+            elif token == b'(':
+                if depth == 0:
+                    expression_start = match.start()
+                depth += 1
+            else:
+                # Unbalanced closings leave depth negative so the rest of the
+                # file is a single chunk (and the parser reports the error)
+                depth -= 1
+                if depth != 0:
+                    continue
+                if _TYPEDEF_START.match(data, expression_start):
+                    typedef = _TYPEDEF.fullmatch(data[expression_start:position].decode('utf-8'))
+                    if typedef is not None:
+                        terminal_name, symbol_name, type_designator = typedef.groups()
+                        typedefs.append((terminal_name or symbol_name, type_designator))
+                if position - start >= chunk_size:
+                    ranges.append((start, position))
+                    start = position
+        if start < size:
+            if ranges and not data[start:size].strip():
+                ranges[-1] = (ranges[-1][0], size)
+            else:
+                ranges.append((start, size))
+    return ranges, typedefs
+
+class SymbolTables:
+    """
+    Parser caches (see BaseYacc) with the symbols defined by a list of type
+    definitions. Chunks of a file are parsed with the tables of the whole
+    file so they can use symbols defined in other chunks.
+    """
+
+    def __init__(self, typedefs: List[Tuple[str, str]]):
+        parser = BaseYacc()
+        for name, type_designator in typedefs:
+            parser._typedef(name, type_designator)
+        while parser._revisit_pending_named_types():
+            pass
+        self.named_type_hash = parser.named_type_hash
+        self.named_types = parser.named_types
+        self.symbol_hash = parser.symbol_hash
+        self.terminal_hash = parser.terminal_hash
+        self.parent_type = parser.parent_type
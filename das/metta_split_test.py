@@ -0,0 +1,55 @@
+import os
+import tempfile
+import pytest
+from das.metta_split import SymbolTables, split_metta
+from das.metta_yacc import MettaYacc
+
+metta = """(: Similarity Type)
+(Similarity "human" "mon(key")
+(: "human" Concept)
+( : "mon(key" Concept)
+(Similarity
+    (Similarity "human" "mon(key")
+    "human")
+(:Concept Type)
+(: Evaluation Type)
+(: Predicate Type)
+(: is_mammal Predicate)
+(Evaluation is_mammal "human")
+"""
+
+@pytest.fixture
+def file_name():
+    handle, name = tempfile.mkstemp(suffix=".metta")
+    with os.fdopen(handle, "w") as fh:
+        fh.write(metta)
+    yield name
+    os.remove(name)
+
+@pytest.mark.parametrize("chunk_size", [1, 30, 100, 10 ** 6])
+def test_split_metta(file_name, chunk_size):
+    ranges, typedefs = split_metta(file_name, chunk_size)
+    assert typedefs == [
+        ("Similarity", "Type"),
+        ("human", "Concept"),
+        ("mon(key", "Concept"),
+        ("Concept", "Type"),
+        ("Evaluation", "Type"),
+        ("Predicate", "Type"),
+        ("is_mammal", "Predicate"),
+    ]
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(metta)
+    assert all(previous[1] == current[0] for previous, current in zip(ranges, ranges[1:]))
+    for start, end in ranges:
+        # Each chunk is a list of whole top level expressions
+        assert MettaYacc().check(metta[start:end]) == "SUCCESS"
+    if chunk_size == 1:
+        assert len(ranges) == 10
+    with pytest.raises(ValueError):
+        split_metta(file_name, 0)
+
+def test_symbol_tables():
+    # Types can be used before they're defined
+    tables = SymbolTables([("human", "Concept"), ("Concept", "Type"), ("is_mammal", "Predicate")])
+    assert tables.named_types == {"human": "Concept", "Concept": "Type"}
+    assert set(tables.symbol_hash) == {"human", "Concept"}
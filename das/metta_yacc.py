@@ -24,9 +24,9 @@ EXPRESSION -> EXPRESSION_OPENNING LIST_OF_EXPRESSIONS EXPRESSION_CLOSING
 """
 
 from typing import List, Any, Optional
-import ply.yacc as yacc
+from das.parser_cache import build_parser
 from das.metta_lex import MettaLex
-from das.exceptions import MettaSyntaxError, UndefinedSymbolError
+from das.exceptions import MettaSyntaxError
 from das.expression_hasher import ExpressionHasher
 from das.expression import Expression
 from das.base_yacc import BaseYacc
@@ -39,27 +39,19 @@ class MettaYacc(BaseYacc):
         """START : LIST_OF_TOP_LEVEL_EXPRESSIONS EOF
                  | EOF
                  |"""
-        self._revisit_pending_symbols()
-        missing_symbols = []
-        missing_symbols.extend([name for (name, expression) in self.pending_terminal_names])
-        missing_symbols.extend([name for (name, expression) in self.pending_expression_names])
-        missing_symbols.extend([type_designator for ((name, type_designator), expression) in self.pending_named_types])
-        if missing_symbols:
-            raise UndefinedSymbolError(list(set(missing_symbols)))
-        assert not self.pending_expressions
+        self._resolve_pending_symbols()
         p[0] = 'SUCCESS'
 
+    # Top level expressions are passed to the action broker as they're parsed
+    # so they aren't kept in a list (which would hold the whole file)
+
     def p_LIST_OF_TOP_LEVEL_EXPRESSIONS_base(self, p):
         """LIST_OF_TOP_LEVEL_EXPRESSIONS : TOP_LEVEL_EXPRESSION"""
-        if self.check_mode or not self.action_broker:
-            return
-        p[0] = [p[1]]
+        pass
 
     def p_LIST_OF_TOP_LEVEL_EXPRESSIONS_recursion(self, p):
         """LIST_OF_TOP_LEVEL_EXPRESSIONS :  LIST_OF_TOP_LEVEL_EXPRESSIONS TOP_LEVEL_EXPRESSION"""
-        if self.check_mode or not self.action_broker:
-            return
-        p[0] = [*p[1], p[2]]
+        pass
 
     def p_TOP_LEVEL_EXPRESSION_type(self, p):
         """TOP_LEVEL_EXPRESSION : TOP_LEVEL_TYPE_DEFINITION"""
@@ -177,4 +169,4 @@ class MettaYacc(BaseYacc):
         super().__init__(**kwargs)
         self.lex_wrap = MettaLex()
         super().setup()
-        self.parser = yacc.yacc(module=self)
+        self.parser = build_parser(self)
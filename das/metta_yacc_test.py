@@ -61,6 +61,17 @@ def test_action_broker():
     assert action_broker.count_toplevel_expression == 1
     assert action_broker.count_type == 9
 
+def test_reset():
+    yacc_wrap = MettaYacc(action_broker=ActionBroker(test_data))
+    for _ in range(2):
+        action_broker = ActionBroker(test_data)
+        yacc_wrap.reset(action_broker)
+        result = yacc_wrap.parse_action_broker_input()
+        assert result == "SUCCESS"
+        assert action_broker.count_toplevel_expression == 1
+        assert action_broker.count_type == 9
+        assert yacc_wrap.lexer.lineno > 1
+
 def test_terminal_hash():
 
     yacc_wrap = MettaYacc()
@@ -4,6 +4,9 @@ from das.expression import Expression
 from das.database.db_interface import DBInterface
 from das.parser_threads import SharedData
 
+# Number of parsed links passed at once to the loader threads
+LINK_BATCH_SIZE = 10000
+
 class ParserActions(ABC):
 
     @abstractmethod
@@ -40,6 +43,10 @@ class MultiThreadParsing(ParserActions):
         self.file_path = ""
         self.input_string = input_string
         self.shared_data = shared_data
+        self.links = []
+        # Links whose handles are only known at the end of the parsing
+        # (because they use symbols defined later)
+        self.pending_links = []
         if use_action_broker_cache:
             self.named_type_hash = db.named_type_hash
             self.named_types = db.named_types
@@ -47,11 +54,27 @@ class MultiThreadParsing(ParserActions):
             self.terminal_hash = db.terminal_hash
             self.parent_type = db.parent_type
 
+    def _add_link(self, expression: Expression):
+        if expression.hash_code is None:
+            self.pending_links.append(expression)
+            return
+        self.links.append(expression)
+        if len(self.links) >= LINK_BATCH_SIZE:
+            self.shared_data.add_links(self.links)
+            self.links = []
+
+    def flush_links(self):
+        links = [*self.links, *self.pending_links]
+        self.links = []
+        self.pending_links = []
+        if links:
+            self.shared_data.add_links(links)
+
     def new_top_level_expression(self, expression: Expression):
-        self.shared_data.add_regular_expression(expression)
+        self._add_link(expression)
 
     def new_expression(self, expression: Expression):
-        self.shared_data.add_regular_expression(expression)
+        self._add_link(expression)
 
     def new_terminal(self, expression: Expression):
         self.shared_data.add_terminal(expression)
@@ -66,3 +89,16 @@ class KnowledgeBaseFile(MultiThreadParsing):
         with open(file_path, "r") as file_handle:
             input_string = file_handle.read()
         super().__init__(db, input_string, shared_data)
+
+class KnowledgeBaseFileChunk(MultiThreadParsing):
+    """
+    Byte range of a knowledge base file (see metta_split.split_metta()),
+    parsed with the symbol tables of the whole file.
+    """
+
+    def __init__(self, symbol_tables: "SymbolTables", file_path: str, start: int, end: int, shared_data: SharedData):
+        with open(file_path, "rb") as file_handle:
+            file_handle.seek(start)
+            input_string = file_handle.read(end - start).decode("utf-8")
+        super().__init__(symbol_tables, input_string, shared_data, use_action_broker_cache=True)
+        self.file_path = file_path
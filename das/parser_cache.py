@@ -0,0 +1,75 @@
+import hashlib
+import importlib.util
+import os
+import threading
+from typing import Any, Optional
+
+import ply.lex as lex
+import ply.yacc as yacc
+
+from das.logger import logger
+
+# PLY tables of each grammar (and lexer) are generated on first use and kept
+# in this directory. They're named after a digest of the rules so they're
+# loaded without validating the grammar again (PLY's optimize mode). Lexer
+# tables are Python modules and parser tables are pickles, so the directory
+# is private to the user: tables aren't cached if anyone else can write to it.
+PARSER_CACHE_DIR = os.environ.get(
+    'DAS_PARSER_CACHE_DIR',
+    os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'das', 'parser'))
+
+def _cache_dir() -> Optional[str]:
+    os.makedirs(PARSER_CACHE_DIR, mode=0o700, exist_ok=True)
+    status = os.stat(PARSER_CACHE_DIR)
+    if status.st_uid != os.getuid() or status.st_mode & 0o022:
+        logger().warning(f"Parser tables aren't cached: {PARSER_CACHE_DIR} is writable by other users")
+        return None
+    return PARSER_CACHE_DIR
+
+def _table_name(module: Any, kind: str, prefix: str) -> str:
+    hasher = hashlib.md5(yacc.__tabversion__.encode('utf-8'))
+    for name in sorted(dir(module)):
+        if name.startswith(prefix) or name in ['tokens', 'literals', 'states', 'precedence', 'start']:
+            value = getattr(module, name)
+            hasher.update(name.encode('utf-8'))
+            hasher.update(repr(value.__doc__ if callable(value) else value).encode('utf-8'))
+    return f'{type(module).__name__.lower()}_{kind}_{hasher.hexdigest()}'
+
+def _temporary_name(name: str) -> str:
+    # Tables are written to a temporary file which is then renamed so other
+    # parsers (in other threads or processes) never read a partial one
+    return f'{name}_{os.getpid()}_{threading.get_ident()}'
+
+def build_parser(module: Any) -> yacc.LRParser:
+    """
+    yacc.yacc(module=module) with its tables cached in PARSER_CACHE_DIR.
+    """
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return yacc.yacc(module=module, write_tables=False, debug=False)
+    file_name = os.path.join(cache_dir, _table_name(module, 'yacc', 'p_') + '.pickle')
+    if os.path.exists(file_name):
+        return yacc.yacc(module=module, picklefile=file_name, optimize=True, debug=False)
+    temporary_file_name = os.path.join(cache_dir, _temporary_name(os.path.basename(file_name)))
+    parser = yacc.yacc(module=module, picklefile=temporary_file_name, debug=False)
+    os.replace(temporary_file_name, file_name)
+    return parser
+
+def build_lexer(module: Any, **kwargs) -> lex.Lexer:
+    """
+    lex.lex(module=module) with its tables cached in PARSER_CACHE_DIR.
+    """
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return lex.lex(module=module, **kwargs)
+    name = _table_name(module, 'lex', 't_')
+    file_name = os.path.join(cache_dir, name + '.py')
+    if os.path.exists(file_name):
+        spec = importlib.util.spec_from_file_location(name, file_name)
+        lextab = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(lextab)
+        return lex.lex(module=module, optimize=True, lextab=lextab, **kwargs)
+    temporary_name = _temporary_name(name)
+    lexer = lex.lex(module=module, optimize=True, lextab=temporary_name, outputdir=cache_dir, **kwargs)
+    os.replace(os.path.join(cache_dir, temporary_name + '.py'), file_name)
+    return lexer
@@ -0,0 +1,42 @@
+import os
+import tempfile
+import ply.yacc
+import das.parser_cache
+from das.atomese_yacc import AtomeseYacc
+from das.metta_lex_test import lex_test_data as test_data
+from das.metta_yacc import MettaYacc
+
+def test_parser_cache(monkeypatch):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        monkeypatch.setattr(das.parser_cache, "PARSER_CACHE_DIR", cache_dir)
+        assert MettaYacc().check(test_data) == "SUCCESS"
+        AtomeseYacc()
+        # Each grammar and lexer has its own tables
+        files = sorted(os.listdir(cache_dir))
+        assert len(files) == 4
+        assert [name.split("_")[:2] for name in files] == [
+            ["atomeselex", "lex"],
+            ["atomeseyacc", "yacc"],
+            ["mettalex", "lex"],
+            ["mettayacc", "yacc"],
+        ]
+        # Cached tables are loaded without building the grammar
+        def fail(*args, **kwargs):
+            raise AssertionError("Tables were generated again")
+        monkeypatch.setattr(ply.yacc.LRGeneratedTable, "__init__", fail)
+        assert MettaYacc().check(test_data) == "SUCCESS"
+        assert sorted(os.listdir(cache_dir)) == files
+
+def test_shared_parser_cache(monkeypatch):
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Tables in a directory other users can write to aren't trusted
+        os.chmod(cache_dir, 0o777)
+        monkeypatch.setattr(das.parser_cache, "PARSER_CACHE_DIR", cache_dir)
+        assert MettaYacc().check(test_data) == "SUCCESS"
+        assert os.listdir(cache_dir) == []
+    with tempfile.TemporaryDirectory() as parent_dir:
+        cache_dir = os.path.join(parent_dir, "das", "parser")
+        monkeypatch.setattr(das.parser_cache, "PARSER_CACHE_DIR", cache_dir)
+        assert MettaYacc().check(test_data) == "SUCCESS"
+        assert os.stat(cache_dir).st_mode & 0o777 == 0o700
+        assert len(os.listdir(cache_dir)) == 2
@@ -0,0 +1,181 @@
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from queue import Empty
+from typing import List, Optional, Tuple
+
+from das.atomese_yacc import AtomeseYacc
+from das.expression import Expression
+from das.logger import logger
+from das.metta_split import SymbolTables, split_metta
+from das.metta_yacc import MettaYacc
+from das.parser_actions import KnowledgeBaseFile, KnowledgeBaseFileChunk
+from das.parser_threads import LINK_QUEUE_SIZE, LoadAborted, SharedData, new_parser
+
+# Knowledge base files are parsed by a pool of worker processes (PLY parsers
+# are pure Python so threads would be serialized by the GIL). Parsed links
+# are sent back in batches of tuples (see Expression.to_tuple()) through a
+# bounded queue while the files are parsed.
+PARSER_WORKERS = os.cpu_count() or 1
+# MeTTa files bigger than this are cut in chunks of about this size (at top
+# level expression boundaries) which are parsed in parallel
+PARSER_CHUNK_SIZE = 64 * 1024 * 1024
+# MeTTa files are parsed by MettaParser (instead of MettaYacc) unless told
+# otherwise
+FAST_PARSER = True
+# Seconds between checks for failed workers while waiting for links
+PARSER_POLL_INTERVAL = 1
+
+_links = None
+# Symbol tables of the file whose chunks this worker is parsing
+_symbol_tables = (None, None)
+
+def _init_worker(links: multiprocessing.Queue) -> None:
+    global _links
+    _links = links
+
+def _load_symbol_tables(file_name: str) -> SymbolTables:
+    global _symbol_tables
+    if _symbol_tables[0] != file_name:
+        with open(file_name, 'rb') as fh:
+            _symbol_tables = (file_name, pickle.load(fh))
+    return _symbol_tables[1]
+
+class _WorkerSharedData:
+    # What a parser action broker needs from SharedData, in a worker process
+
+    def __init__(self, links: multiprocessing.Queue):
+        self.links = links
+        self.typedef_expressions = set()
+        self.terminals = set()
+
+    def add_links(self, expressions: List[Expression]) -> None:
+        self.links.put([expression.to_tuple() for expression in expressions])
+
+    def add_typedef_expression(self, expression: Expression) -> None:
+        self.typedef_expressions.add(expression)
+
+    def add_terminal(self, terminal: Expression) -> None:
+        self.terminals.add(terminal)
+
+def _parse_file(
+    file_name: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    symbol_tables_file: Optional[str] = None,
+    fast_parser: bool = FAST_PARSER) -> Tuple[List[tuple], List[tuple]]:
+    # Runs in a worker process. Links are sent to the queue followed by a
+    # None; typedefs and terminals (which are few) are returned.
+    try:
+        part = f"{file_name}" if start is None else f"{file_name} [{start}:{end}]"
+        logger().info(f"Parser process {os.getpid()} started. Parsing {part}")
+        stopwatch_start = time.perf_counter()
+        shared_data = _WorkerSharedData(_links)
+        if symbol_tables_file is None:
+            parser_actions_broker = KnowledgeBaseFile(None, file_name, shared_data)
+        else:
+            parser_actions_broker = KnowledgeBaseFileChunk(
+                _load_symbol_tables(symbol_tables_file), file_name, start, end, shared_data)
+        parser = new_parser(parser_actions_broker, symbol_tables_file is not None, fast_parser)
+        parser.parse_action_broker_input()
+        parser_actions_broker.flush_links()
+        elapsed = (time.perf_counter() - stopwatch_start) // 60
+        logger().info(f"Parser process {os.getpid()} finished {part}. {elapsed:.0f} minutes.")
+        return (
+            [expression.to_tuple() for expression in shared_data.typedef_expressions],
+            [expression.to_tuple() for expression in shared_data.terminals],
+        )
+    finally:
+        _links.put(None)
+
+def _generate_tables(file_names: List[str], fast_parser: bool) -> None:
+    # Tables missing from the parser cache are generated once here instead
+    # of by each worker
+    if not fast_parser and any(not file_name.endswith(".scm") for file_name in file_names):
+        MettaYacc()
+    if any(file_name.endswith(".scm") for file_name in file_names):
+        AtomeseYacc()
+
+def _save_symbol_tables(symbol_tables: SymbolTables) -> str:
+    handle, name = tempfile.mkstemp(prefix='das_symbols.', suffix='.pickle')
+    with os.fdopen(handle, 'wb') as fh:
+        pickle.dump(symbol_tables, fh)
+    return name
+
+def parse_files(
+    file_names: List[str],
+    shared_data: SharedData,
+    workers: int = PARSER_WORKERS,
+    chunk_size: int = PARSER_CHUNK_SIZE,
+    fast_parser: bool = FAST_PARSER) -> None:
+    """
+    Parse knowledge base files in worker processes passing their links to
+    shared_data (see SharedData.add_links()) as they're parsed and their
+    typedefs and terminals when they're done. Big MeTTa files are cut in
+    chunks (see metta_split.py) so they're parsed in parallel too. MeTTa
+    files are parsed by MettaParser if fast_parser is set or MettaYacc
+    otherwise.
+    """
+    if workers <= 0:
+        raise ValueError(f'Invalid number of workers: {workers}')
+    if not file_names:
+        return
+    _generate_tables(file_names, fast_parser)
+    tasks = []
+    symbol_tables_files = []
+    try:
+        for file_name in file_names:
+            if file_name.endswith(".scm") or os.path.getsize(file_name) <= chunk_size:
+                tasks.append((file_name, None, None, None, fast_parser))
+                continue
+            ranges, typedefs = split_metta(file_name, chunk_size)
+            symbol_tables_files.append(_save_symbol_tables(SymbolTables(typedefs)))
+            tasks.extend((file_name, start, end, symbol_tables_files[-1], fast_parser) for start, end in ranges)
+        _run_tasks(tasks, shared_data, workers)
+    finally:
+        for name in symbol_tables_files:
+            os.remove(name)
+    for _ in file_names:
+        shared_data.parse_ok()
+
+def _run_tasks(tasks: List[tuple], shared_data: SharedData, workers: int) -> None:
+    context = multiprocessing.get_context('spawn')
+    links = context.Queue(maxsize=LINK_QUEUE_SIZE)
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(tasks)),
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(links,)) as executor:
+
+        # Chunks of the same file are submitted in a row so they're usually
+        # parsed by workers which already loaded its symbol tables
+        futures = [executor.submit(_parse_file, *task) for task in tasks]
+        running = len(futures)
+        while running > 0:
+            try:
+                batch = links.get(timeout=PARSER_POLL_INTERVAL)
+            except Empty:
+                # Workers which die without sending their None break the
+                # pool (and its other workers are terminated)
+                if any(future.done() and isinstance(future.exception(), BrokenProcessPool) for future in futures):
+                    break
+                continue
+            if batch is None:
+                running -= 1
+            else:
+                # Once the load is aborted batches are still read (so the
+                # workers don't block) but dropped
+                try:
+                    shared_data.add_links([Expression.from_tuple(values) for values in batch])
+                except LoadAborted:
+                    pass
+        for future in futures:
+            typedefs, terminals = future.result()
+            for values in typedefs:
+                shared_data.add_typedef_expression(Expression.from_tuple(values))
+            for values in terminals:
+                shared_data.add_terminal(Expression.from_tuple(values))
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from threading import Thread
+import pytest
+from das.expression import Expression
+from das.parser_actions import KnowledgeBaseFile
+from das.parser_processes import parse_files
+from das.parser_threads import ParserThread, SharedData
+
+samples = os.path.join(os.path.dirname(__file__), '../data/samples')
+
+def _parse(parse, shared_data):
+    links = set()
+
+    def consume():
+        while True:
+            batch = shared_data.parsed_links.get()
+            if batch is None:
+                return
+            links.update((expression.hash_code, expression.toplevel) for expression in batch)
+
+    consumer = Thread(target=consume)
+    consumer.start()
+    parse()
+    shared_data.end_of_links()
+    consumer.join()
+    return (
+        links,
+        set(expression.hash_code for expression in shared_data.terminals),
+        set(expression.hash_code for expression in shared_data.typedef_expressions),
+    )
+
+def test_expression_tuple():
+    expression = Expression(
+        toplevel=True, named_type="Similarity", named_type_hash="a", composite_type=["a", ["b", "c"]],
+        composite_type_hash="d", elements=["e", "f"], hash_code="g")
+    assert Expression.from_tuple(expression.to_tuple()) == expression
+
+@pytest.mark.parametrize("fast_parser", [True, False])
+def test_parse_files(fast_parser):
+    file_names = [os.path.join(samples, name) for name in ["animals.metta", "simple.metta"]]
+    shared_data = SharedData()
+    parsed = _parse(lambda: parse_files(file_names, shared_data, workers=2, fast_parser=fast_parser), shared_data)
+    assert shared_data.parse_ok_count == 2
+    expected_data = SharedData()
+
+    def parse_in_threads():
+        for file_name in file_names:
+            thread = ParserThread(KnowledgeBaseFile(None, file_name, expected_data))
+            thread.start()
+            thread.join()
+
+    assert parsed == _parse(parse_in_threads, expected_data)
+    assert len(parsed[0]) > 0
+    with pytest.raises(ValueError):
+        parse_files(file_names, SharedData(), workers=0)
+
+def test_parse_chunks():
+    reactome = os.path.join(os.path.dirname(__file__), '../data/annotation_service/reactome_2020-10-20.metta')
+    handle, forward = tempfile.mkstemp(suffix=".metta")
+    with os.fdopen(handle, "w") as fh:
+        # Symbols are defined in other chunks than the ones using them
+        fh.write('(Similarity "human" "monkey")\n(Similarity (Similarity "human" "monkey") "chimp")\n')
+        fh.write('(: Similarity Type)\n(: Concept Type)\n(: "human" Concept)\n(: "monkey" Concept)\n(: "chimp" Concept)\n')
+    try:
+        for file_name, chunk_size in [(reactome, 64 * 1024), (forward, 1)]:
+            shared_data = SharedData()
+            parsed = _parse(lambda: parse_files([file_name], shared_data, workers=2, chunk_size=chunk_size), shared_data)
+            assert shared_data.parse_ok_count == 1
+            expected_data = SharedData()
+            thread = ParserThread(KnowledgeBaseFile(None, file_name, expected_data))
+            assert parsed == _parse(lambda: (thread.start(), thread.join()), expected_data)
+    finally:
+        os.remove(forward)
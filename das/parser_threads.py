@@ -1,15 +1,25 @@
-import os
 import datetime
+import os
 import time
-from threading import Thread, Lock
+from queue import Empty, Full, Queue
+from threading import Event, Thread, Lock
+from typing import Iterator, List, Optional, Set
+from pymongo.errors import BulkWriteError
 from das.expression import Expression
 from das.database.mongo_schema import CollectionNames as MongoCollections
+from das.database.mongo_schema import FieldNames as MongoFieldNames
 from das.database.couchbase_schema import CollectionNames as CouchbaseCollections
 from das.expression_hasher import ExpressionHasher
 from das.metta_yacc import MettaYacc
+from das.metta_parser import MettaParser
 from das.atomese_yacc import AtomeseYacc
+from das.base_yacc import BaseYacc
 from das.database.db_interface import DBInterface
-from das.database.db_interface import DBInterface, WILDCARD
+from das.database.ngram_index import name_ngrams, ngram_key
+from das.database.pattern_index import PatternIndex
+from das.database.posting_list import block_bounds, head_block_count, posting_head
+from das.database.statistics import StatisticsCatalog
+from das.external_sort import ExternalSort
 from das.logger import logger
 
 # There is a Couchbase limitation for long values (max: 20Mb)
@@ -18,10 +28,35 @@ from das.logger import logger
 # TODO: move this constant to a proper place
 MAX_COUCHBASE_BLOCK_SIZE = 500000
 
+# Parsed links are passed to the loader threads in batches (see
+# parser_actions.LINK_BATCH_SIZE) through queues of at most LINK_QUEUE_SIZE
+# batches, so parsers wait for the loader when it's behind
+LINK_QUEUE_SIZE = 8
+# Seconds between checks for failed loader threads while waiting on the
+# link queues
+LINK_QUEUE_POLL_INTERVAL = 0.5
+# Handles of the links uploaded to MongoDB are added to the link locator
+# in batches of this size
+LINK_LOCATOR_BATCH_SIZE = 100000
+MONGO_DUPLICATE_KEY_ERROR = 11000
+
+class LoadAborted(Exception):
+    """
+    Raised in the threads waiting on a link queue when another thread of
+    the load failed.
+    """
+
 class SharedData():
     def __init__(self):
-        self.regular_expressions = set()
-        self.lock_regular_expressions = Lock()
+        # Batches of links from the parsers to PopulateMongoDBLinksThread,
+        # which passes the ones it inserted to the link queues of the
+        # temporary file builder threads. None marks the end of the links.
+        self.parsed_links = Queue(maxsize=LINK_QUEUE_SIZE)
+        self.link_queues = []
+        # First error of the loader threads (re-raised by the load)
+        self.error = None
+        self.aborted = Event()
+        self.lock_error = Lock()
 
         self.typedef_expressions = set()
         self.lock_typedef_expressions = Lock()
@@ -40,21 +75,86 @@ class SharedData():
 
         self.mongo_uploader_ok = False
 
+        # Documents written by FlushNonLinksToDBThread (used to refresh DB caches)
+        self.typedef_documents = []
+        self.terminal_documents = []
+
+        # Created in the scratch dir of external_sort by create_temporary_files()
+        self.temporary_file_name = {}
+        self.pattern_black_list = []
+        self.pattern_index = PatternIndex()
+        # Filled by the temporary file builder threads (each one updates a
+        # different part of it)
+        self.statistics = StatisticsCatalog()
+        self.updated_keys = {s.value: [] for s in CouchbaseCollections}
+        # Temporary files are sorted in runs which are merged by the
+        # Couchbase uploader threads while they read them
+        self.external_sort = ExternalSort()
+        self.sorted_runs = {}
+        # Set when the temporary file of a collection is ready to be uploaded
+        self.file_ready = {s.value: Event() for s in CouchbaseCollections}
+        # Handles of the links inserted by this load (only collected when
+        # it's set to a set)
+        self.new_link_handles = None
+
+    def create_temporary_files(self) -> None:
         self.temporary_file_name = {
-            s.value: f"/tmp/parser_{s.value}.txt" for s in CouchbaseCollections
+            s.value: self.external_sort.temporary_file(f"parser_{s.value}.") for s in CouchbaseCollections
         }
-        self.pattern_black_list = []
 
-    def add_regular_expression(self, expression: Expression) -> None:
-        self.lock_regular_expressions.acquire()
-        self.regular_expressions.add(expression)
-        self.lock_regular_expressions.release()
+    def remove_temporary_files(self) -> None:
+        # Files which weren't sorted (or uploaded) because the load failed
+        # and the file of named entities, which isn't sorted
+        for file_name in self.temporary_file_name.values():
+            if os.path.exists(file_name):
+                os.remove(file_name)
+        for runs in self.sorted_runs.values():
+            runs.remove()
+        self.sorted_runs = {}
+
+    def abort(self, error: Exception) -> None:
+        with self.lock_error:
+            if self.error is None:
+                logger().error(f"Load aborted: {error}")
+                self.error = error
+                self.aborted.set()
+
+    def _put(self, queue: Queue, expressions: Optional[List[Expression]]) -> None:
+        # Consumers stop reading when the load is aborted, so producers
+        # stop waiting too. End marks are just dropped then.
+        while True:
+            try:
+                queue.put(expressions, timeout=LINK_QUEUE_POLL_INTERVAL)
+                return
+            except Full:
+                if self.aborted.is_set():
+                    if expressions is None:
+                        return
+                    raise LoadAborted()
+
+    def _get(self, queue: Queue) -> Optional[List[Expression]]:
+        while True:
+            try:
+                return queue.get(timeout=LINK_QUEUE_POLL_INTERVAL)
+            except Empty:
+                if self.aborted.is_set():
+                    raise LoadAborted()
+
+    def add_links(self, expressions: List[Expression]) -> None:
+        self._put(self.parsed_links, expressions)
+
+    def end_of_links(self) -> None:
+        self._put(self.parsed_links, None)
+
+    def new_link_queue(self) -> Queue:
+        queue = Queue(maxsize=LINK_QUEUE_SIZE)
+        self.link_queues.append(queue)
+        return queue
+
+    def broadcast_links(self, expressions: List[Expression]) -> None:
+        for queue in self.link_queues:
+            self._put(queue, expressions)
 
-    def replicate_regular_expressions(self) -> None:
-        self.lock_regular_expressions.acquire()
-        self.regular_expressions_list = [expression for expression in self.regular_expressions]
-        self.lock_regular_expressions.release()
-        
     def add_typedef_expression(self, expression: Expression) -> None:
         self.lock_typedef_expressions.acquire()
         self.typedef_expressions.add(expression)
@@ -89,79 +189,130 @@ def _write_key_value(file, key, value):
     file.write(line)
     file.write("\n")
 
-def _key_value_generator(input_filename, *, block_size=MAX_COUCHBASE_BLOCK_SIZE, merge_rest=False):
+def _sort_file(shared_data, collection_name):
+    # Lines are sorted by key and then by value (bytewise, which is also the
+    # order of Python strings) so each key's posting list is stored sorted
+    file_name = shared_data.temporary_file_name[collection_name]
+    shared_data.sorted_runs[collection_name] = shared_data.external_sort.sort(file_name)
+    shared_data.file_ready[collection_name].set()
+
+def _release_files(shared_data, collection_names):
+    # Uploaders waiting for files which weren't built (because the builder
+    # failed) are released and find no sorted runs
+    for collection_name in collection_names:
+        shared_data.file_ready[collection_name].set()
+
+def _batches(shared_data: SharedData, queue: Queue) -> Iterator[List[Expression]]:
+    while True:
+        batch = shared_data._get(queue)
+        if batch is None:
+            return
+        yield batch
+
+def _arity_key(expression: Expression) -> str:
+    arity = len(expression.elements)
+    return str(arity) if arity <= 2 else 'N'
+
+def _file_lines(file_name):
+    with open(file_name, 'r') as fh:
+        yield from fh
+
+def _key_value_generator(lines, *, block_size=MAX_COUCHBASE_BLOCK_SIZE, merge_rest=False):
     last_key = ''
     last_list = []
     block_count = 0
-    with open(input_filename, 'r') as fh:
-        for line in fh:
-            line = line.strip()
-            if line == '':
-                continue
-            if merge_rest:
-                v = line.split(",")
-                key = v[0]
-                value = ",".join(v[1:])
-            else:
-                key, value = line.split(",")
-            if last_key == key:
-                last_list.append(value)
-                if len(last_list) >= block_size:
-                    yield last_key, last_list, block_count
-                    block_count += 1
-                    last_list = []
-            else:
-                if last_key != '':
-                    yield last_key, last_list, block_count
-                block_count = 0
-                last_key = key
-                last_list = [value]
-    if last_key != '':
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            continue
+        if merge_rest:
+            v = line.split(",")
+            key = v[0]
+            value = ",".join(v[1:])
+        else:
+            key, value = line.split(",")
+        if last_key == key:
+            last_list.append(value)
+            if len(last_list) >= block_size:
+                yield last_key, last_list, block_count
+                block_count += 1
+                last_list = []
+        else:
+            # Lists which filled their last block are already yielded
+            if last_key != '' and last_list:
+                yield last_key, last_list, block_count
+            block_count = 0
+            last_key = key
+            last_list = [value]
+    if last_key != '' and last_list:
         yield last_key, last_list, block_count
 
-def _key_value_targets_generator(input_filename, *, block_size=MAX_COUCHBASE_BLOCK_SIZE/4, merge_rest=False):
+def _key_value_targets_generator(lines, *, block_size=MAX_COUCHBASE_BLOCK_SIZE/4, merge_rest=False):
     last_key = ''
     last_list = []
     block_count = 0
-    with open(input_filename, 'r') as fh:
-        for line in fh:
-            line = line.strip()
-            if line == '':
-                continue
-            key, value, *targets = line.split(",")
-            if last_key == key:
-                last_list.append(tuple([value, tuple(targets)]))
-                if len(last_list) >= block_size:
-                    yield last_key, last_list, block_count
-                    block_count += 1
-                    last_list = []
-            else:
-                if last_key != '':
-                    yield last_key, last_list, block_count
-                block_count = 0
-                last_key = key
-                last_list = [tuple([value, tuple(targets)])]
-    if last_key != '':
+    for line in lines:
+        line = line.strip()
+        if line == '':
+            continue
+        key, value, *targets = line.split(",")
+        if last_key == key:
+            last_list.append(tuple([value, tuple(targets)]))
+            if len(last_list) >= block_size:
+                yield last_key, last_list, block_count
+                block_count += 1
+                last_list = []
+        else:
+            # Lists which filled their last block are already yielded
+            if last_key != '' and last_list:
+                yield last_key, last_list, block_count
+            block_count = 0
+            last_key = key
+            last_list = [tuple([value, tuple(targets)])]
+    if last_key != '' and last_list:
         yield last_key, last_list, block_count
 
+def new_parser(
+    parser_actions_broker: "ParserActions",
+    use_action_broker_cache: bool = False,
+    fast_parser: bool = False):
+
+    if parser_actions_broker.file_path.endswith(".scm"):
+        return AtomeseYacc(action_broker=parser_actions_broker)
+    if fast_parser:
+        return MettaParser(
+            action_broker=parser_actions_broker,
+            use_action_broker_cache=use_action_broker_cache)
+    return MettaYacc(
+        action_broker=parser_actions_broker, 
+        use_action_broker_cache=use_action_broker_cache)
+
 class ParserThread(Thread):
 
-    def __init__(self, parser_actions_broker: "ParserActions", use_action_broker_cache: bool = False):
+    def __init__(
+        self,
+        parser_actions_broker: "ParserActions",
+        use_action_broker_cache: bool = False,
+        parser: Optional[BaseYacc] = None):
+
         super().__init__()
         self.parser_actions_broker = parser_actions_broker
         self.use_action_broker_cache = use_action_broker_cache
+        # A parser to reuse (already reset to parser_actions_broker)
+        self.parser = parser
 
     def run(self):
         logger().info(f"Parser thread {self.name} (TID {self.native_id}) started. " + \
             f"Parsing {self.parser_actions_broker.file_path}")
         stopwatch_start = time.perf_counter()
-        if self.parser_actions_broker.file_path.endswith(".scm"):
-            parser = AtomeseYacc(action_broker=self.parser_actions_broker)
-        else:
-            parser = MettaYacc(
-                action_broker=self.parser_actions_broker, 
-                use_action_broker_cache=self.use_action_broker_cache)
-        parser.parse_action_broker_input()
+        parser = self.parser
+        if parser is None:
+            parser = new_parser(self.parser_actions_broker, self.use_action_broker_cache)
+        try:
+            parser.parse_action_broker_input()
+            self.parser_actions_broker.flush_links()
+        except LoadAborted:
+            return
         self.parser_actions_broker.shared_data.parse_ok()
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         logger().info(f"Parser thread {self.name} (TID {self.native_id}) Finished. " + \
@@ -175,43 +326,76 @@ class FlushNonLinksToDBThread(Thread):
         self.shared_data = shared_data
         self.allow_duplicates = allow_duplicates
 
-    def _insert_many(self, collection, bulk_insertion):
+    def _insert_many(self, collection, bulk_insertion) -> Set[int]:
+        # Returns the positions of the documents which weren't inserted
         try:
             collection.insert_many(bulk_insertion, ordered=False)
-        except Exception as e:
-            if not self.allow_duplicates:
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if not self.allow_duplicates or any(error["code"] != MONGO_DUPLICATE_KEY_ERROR for error in errors):
                 logger().error(str(e))
+            return set(error["index"] for error in errors)
+        except Exception as e:
+            logger().error(str(e))
+            return set(range(len(bulk_insertion)))
+        return set()
 
     def run(self):
         logger().info(f"Flush thread {self.name} (TID {self.native_id}) started.")
         stopwatch_start = time.perf_counter()
+        try:
+            self._flush()
+        except Exception as e:
+            self.shared_data.abort(e)
+            return
+        finally:
+            _release_files(self.shared_data, [CouchbaseCollections.NAMED_ENTITIES, CouchbaseCollections.NAME_NGRAMS])
+        self.shared_data.build_ok()
+        elapsed = (time.perf_counter() - stopwatch_start) // 60
+        logger().info(f"Flush thread {self.name} (TID {self.native_id}) finished. {elapsed:.0f} minutes.")
+
+    def _flush(self):
         bulk_insertion = []
         while self.shared_data.typedef_expressions:
             bulk_insertion.append(self.shared_data.typedef_expressions.pop().to_dict())
         if bulk_insertion:
-            mongo_collection = self.db.mongo_db[MongoCollections.ATOM_TYPES]
+            mongo_collection = self.db.mongo_collection(MongoCollections.ATOM_TYPES)
             self._insert_many(mongo_collection, bulk_insertion)
+        self.shared_data.typedef_documents = bulk_insertion
 
         named_entities = open(self.shared_data.temporary_file_name[CouchbaseCollections.NAMED_ENTITIES], "w")
+        ngrams_file_name = self.shared_data.temporary_file_name[CouchbaseCollections.NAME_NGRAMS]
+        ngrams = open(ngrams_file_name, "w")
         bulk_insertion = []
         while self.shared_data.terminals:
             terminal = self.shared_data.terminals.pop()
             bulk_insertion.append(terminal.to_dict())
             _write_key_value(named_entities, terminal.hash_code, terminal.terminal_name)
+            for ngram in name_ngrams(terminal.terminal_name):
+                _write_key_value(ngrams, ngram_key(terminal.composite_type_hash, ngram), terminal.hash_code)
         named_entities.close()
+        ngrams.close()
+        # Named entities are uploaded unsorted
+        self.shared_data.file_ready[CouchbaseCollections.NAMED_ENTITIES].set()
+        _sort_file(self.shared_data, CouchbaseCollections.NAME_NGRAMS)
+        rejected = set()
         if bulk_insertion:
-            mongo_collection = self.db.mongo_db[MongoCollections.NODES]
-            self._insert_many(mongo_collection, bulk_insertion)
-        named_entities.close()
-        self.shared_data.build_ok()
-        elapsed = (time.perf_counter() - stopwatch_start) // 60
-        logger().info(f"Flush thread {self.name} (TID {self.native_id}) finished. {elapsed:.0f} minutes.")
+            mongo_collection = self.db.mongo_collection(MongoCollections.NODES)
+            rejected = self._insert_many(mongo_collection, bulk_insertion)
+        self.shared_data.terminal_documents = bulk_insertion
+        # Nodes already in the database (rejected as duplicates) aren't
+        # counted again
+        inserted = [document for i, document in enumerate(bulk_insertion) if i not in rejected]
+        for document in inserted:
+            self.shared_data.statistics.node_types[document[MongoFieldNames.TYPE_NAME]] += 1
+        self.db.update_node_filter([document[MongoFieldNames.ID_HASH] for document in inserted])
 
 class BuildConnectivityThread(Thread):
 
     def __init__(self, shared_data: SharedData):
         super().__init__()
         self.shared_data = shared_data
+        self.links = shared_data.new_link_queue()
 
     def run(self):
         outgoing_file_name = self.shared_data.temporary_file_name[CouchbaseCollections.OUTGOING_SET]
@@ -219,19 +403,23 @@ class BuildConnectivityThread(Thread):
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) started. Building " + \
             f"{outgoing_file_name} and {incoming_file_name}")
         stopwatch_start = time.perf_counter()
-        outgoing = open(outgoing_file_name, "w")
-        incoming = open(incoming_file_name, "w")
-        for i in range(len(self.shared_data.regular_expressions_list)):
-            expression = self.shared_data.regular_expressions_list[i]
-            for element in expression.elements:
-                _write_key_value(outgoing, expression.hash_code, element)
-                _write_key_value(incoming, element, expression.hash_code)
-        outgoing.close()
-        incoming.close()
-        os.system(f"sort -t , -k 1,1 {outgoing_file_name} > {outgoing_file_name}.sorted")
-        os.rename(f"{outgoing_file_name}.sorted", outgoing_file_name)
-        os.system(f"sort -t , -k 1,1 {incoming_file_name} > {incoming_file_name}.sorted")
-        os.rename(f"{incoming_file_name}.sorted", incoming_file_name)
+        try:
+            outgoing = open(outgoing_file_name, "w")
+            incoming = open(incoming_file_name, "w")
+            for expressions in _batches(self.shared_data, self.links):
+                for expression in expressions:
+                    for element in expression.elements:
+                        _write_key_value(outgoing, expression.hash_code, element)
+                        _write_key_value(incoming, element, expression.hash_code)
+            outgoing.close()
+            incoming.close()
+            _sort_file(self.shared_data, CouchbaseCollections.OUTGOING_SET)
+            _sort_file(self.shared_data, CouchbaseCollections.INCOMING_SET)
+        except Exception as e:
+            self.shared_data.abort(e)
+            return
+        finally:
+            _release_files(self.shared_data, [CouchbaseCollections.OUTGOING_SET, CouchbaseCollections.INCOMING_SET])
         self.shared_data.build_ok()
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) finished. " + \
@@ -242,53 +430,29 @@ class BuildPatternsThread(Thread):
     def __init__(self, shared_data: SharedData):
         super().__init__()
         self.shared_data = shared_data
+        self.links = shared_data.new_link_queue()
 
     def run(self):
         file_name = self.shared_data.temporary_file_name[CouchbaseCollections.PATTERNS]
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) started. " + \
             f"Building {file_name}")
         stopwatch_start = time.perf_counter()
-        patterns = open(file_name, "w")
-        for i in range(len(self.shared_data.regular_expressions_list)):
-            expression = self.shared_data.regular_expressions_list[i]
-            if expression.named_type not in self.shared_data.pattern_black_list:
-                arity = len(expression.elements)
-                type_hash = expression.named_type_hash
-                keys = []
-                keys.append([WILDCARD, *expression.elements])
-                if arity == 1:
-                    keys.append([type_hash, WILDCARD])
-                    keys.append([WILDCARD, expression.elements[0]])
-                    keys.append([WILDCARD, WILDCARD])
-                elif arity == 2:
-                    keys.append([type_hash, expression.elements[0], WILDCARD])
-                    keys.append([type_hash, WILDCARD, expression.elements[1]])
-                    keys.append([type_hash, WILDCARD, WILDCARD])
-                    keys.append([WILDCARD, expression.elements[0], expression.elements[1]])
-                    keys.append([WILDCARD, expression.elements[0], WILDCARD])
-                    keys.append([WILDCARD, WILDCARD, expression.elements[1]])
-                    keys.append([WILDCARD, WILDCARD, WILDCARD])
-                elif arity == 3:
-                    keys.append([type_hash, expression.elements[0], expression.elements[1], WILDCARD])
-                    keys.append([type_hash, expression.elements[0], WILDCARD, expression.elements[2]])
-                    keys.append([type_hash, WILDCARD, expression.elements[1], expression.elements[2]])
-                    keys.append([type_hash, expression.elements[0], WILDCARD, WILDCARD])
-                    keys.append([type_hash, WILDCARD, expression.elements[1], WILDCARD])
-                    keys.append([type_hash, WILDCARD, WILDCARD, expression.elements[2]])
-                    keys.append([type_hash, WILDCARD, WILDCARD, WILDCARD])
-                    keys.append([WILDCARD, expression.elements[0], expression.elements[1], expression.elements[2]])
-                    keys.append([WILDCARD, expression.elements[0], expression.elements[1], WILDCARD])
-                    keys.append([WILDCARD, expression.elements[0], WILDCARD, expression.elements[2]])
-                    keys.append([WILDCARD, WILDCARD, expression.elements[1], expression.elements[2]])
-                    keys.append([WILDCARD, expression.elements[0], WILDCARD, WILDCARD])
-                    keys.append([WILDCARD, WILDCARD, expression.elements[1], WILDCARD])
-                    keys.append([WILDCARD, WILDCARD, WILDCARD, expression.elements[2]])
-                    keys.append([WILDCARD, WILDCARD, WILDCARD, WILDCARD])
-            for key in keys:
-                _write_key_value(patterns, key, [expression.hash_code, *expression.elements])
-        patterns.close()
-        os.system(f"sort -t , -k 1,1 {file_name} > {file_name}.sorted")
-        os.rename(f"{file_name}.sorted", file_name)
+        pattern_index = self.shared_data.pattern_index
+        try:
+            patterns = open(file_name, "w")
+            for expressions in _batches(self.shared_data, self.links):
+                for expression in expressions:
+                    if expression.named_type in self.shared_data.pattern_black_list:
+                        continue
+                    for key in pattern_index.keys(expression.named_type, expression.named_type_hash, expression.elements):
+                        _write_key_value(patterns, key, [expression.hash_code, *expression.elements])
+            patterns.close()
+            _sort_file(self.shared_data, CouchbaseCollections.PATTERNS)
+        except Exception as e:
+            self.shared_data.abort(e)
+            return
+        finally:
+            _release_files(self.shared_data, [CouchbaseCollections.PATTERNS])
         self.shared_data.build_ok()
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) finished. {elapsed:.0f} minutes.")
@@ -298,73 +462,119 @@ class BuildTypeTemplatesThread(Thread):
     def __init__(self, shared_data: SharedData):
         super().__init__()
         self.shared_data = shared_data
+        self.links = shared_data.new_link_queue()
 
     def run(self):
         file_name = self.shared_data.temporary_file_name[CouchbaseCollections.TEMPLATES]
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) started. Building {file_name}")
         stopwatch_start = time.perf_counter()
-        template = open(file_name, "w")
-        for i in range(len(self.shared_data.regular_expressions_list)):
-            expression = self.shared_data.regular_expressions_list[i]
-            _write_key_value(
-                template,
-                expression.composite_type_hash, 
-                [expression.hash_code, *expression.elements])
-            _write_key_value(
-                template,
-                expression.named_type_hash,
-                [expression.hash_code, *expression.elements])
-        template.close()
-        os.system(f"sort -t , -k 1,1 {file_name} > {file_name}.sorted")
-        os.rename(f"{file_name}.sorted", file_name)
+        statistics = self.shared_data.statistics
+        try:
+            template = open(file_name, "w")
+            for expressions in _batches(self.shared_data, self.links):
+                for expression in expressions:
+                    statistics.link_types[expression.named_type] += 1
+                    statistics.link_arities[len(expression.elements)] += 1
+                    _write_key_value(
+                        template,
+                        expression.composite_type_hash, 
+                        [expression.hash_code, *expression.elements])
+                    _write_key_value(
+                        template,
+                        expression.named_type_hash,
+                        [expression.hash_code, *expression.elements])
+            template.close()
+            _sort_file(self.shared_data, CouchbaseCollections.TEMPLATES)
+        except Exception as e:
+            self.shared_data.abort(e)
+            return
+        finally:
+            _release_files(self.shared_data, [CouchbaseCollections.TEMPLATES])
         self.shared_data.build_ok()
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         logger().info(f"Temporary file builder thread {self.name} (TID {self.native_id}) finished. {elapsed:.0f} minutes.")
 
 class PopulateMongoDBLinksThread(Thread):
-
-    def __init__(self, db: DBInterface, shared_data: SharedData, allow_duplicates: bool):
+    """
+    Inserts the links parsed so far in MongoDB and passes the inserted ones
+    to the temporary file builder threads. Links already in the database (or
+    seen before in this load) are rejected by MongoDB, so each link is
+    written once to the temporary files.
+    """
+
+    def __init__(self, db: DBInterface, shared_data: SharedData):
         super().__init__()
         self.db = db
         self.shared_data = shared_data
-        self.allow_duplicates = allow_duplicates
 
-    def _insert_many(self, collection, bulk_insertion):
+    def _insert_many(self, collection, bulk_insertion) -> Set[int]:
+        # Returns the positions of the documents which weren't inserted
         try:
             collection.insert_many(bulk_insertion, ordered=False)
-        except Exception as e:
-            if not self.allow_duplicates:
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != MONGO_DUPLICATE_KEY_ERROR for error in errors):
                 logger().error(str(e))
+            # A link seen before as a nested expression may be a toplevel one
+            toplevel = [
+                bulk_insertion[error["index"]]["_id"]
+                for error in errors
+                if error["code"] == MONGO_DUPLICATE_KEY_ERROR and bulk_insertion[error["index"]][MongoFieldNames.IS_TOPLEVEL]
+            ]
+            if toplevel:
+                collection.update_many(
+                    {MongoFieldNames.ID_HASH: {"$in": toplevel}},
+                    {"$set": {MongoFieldNames.IS_TOPLEVEL: True}})
+            return set(error["index"] for error in errors)
+        return set()
 
     def run(self):
         logger().info(f"MongoDB links uploader thread {self.name} (TID {self.native_id}) started.")
         duplicates = 0
         stopwatch_start = time.perf_counter()
-        bulk_insertion_1 = []
-        bulk_insertion_2 = []
-        bulk_insertion_N = []
-        for i in range(len(self.shared_data.regular_expressions_list)):
-            expression = self.shared_data.regular_expressions_list[i]
-            arity = len(expression.elements)
-            if arity == 1:
-                bulk_insertion_1.append(expression.to_dict())
-            elif arity == 2:
-                bulk_insertion_2.append(expression.to_dict())
-            else:
-                bulk_insertion_N.append(expression.to_dict())
-        if bulk_insertion_1:
-            mongo_collection = self.db.mongo_db[MongoCollections.LINKS_ARITY_1]
-            self._insert_many(mongo_collection, bulk_insertion_1)
-        if bulk_insertion_2:
-            mongo_collection = self.db.mongo_db[MongoCollections.LINKS_ARITY_2]
-            self._insert_many(mongo_collection, bulk_insertion_2)
-        if bulk_insertion_N:
-            mongo_collection = self.db.mongo_db[MongoCollections.LINKS_ARITY_N]
-            self._insert_many(mongo_collection, bulk_insertion_N)
+        mongo_collections = {
+            '1': self.db.mongo_collection(MongoCollections.LINKS_ARITY_1),
+            '2': self.db.mongo_collection(MongoCollections.LINKS_ARITY_2),
+            'N': self.db.mongo_collection(MongoCollections.LINKS_ARITY_N),
+        }
+        new_handles = {key: [] for key in mongo_collections}
+        try:
+            for expressions in _batches(self.shared_data, self.shared_data.parsed_links):
+                inserted = []
+                for key, collection in mongo_collections.items():
+                    batch = [expression for expression in expressions if _arity_key(expression) == key]
+                    if not batch:
+                        continue
+                    rejected = self._insert_many(collection, [expression.to_dict() for expression in batch])
+                    duplicates += len(rejected)
+                    batch = [expression for i, expression in enumerate(batch) if i not in rejected]
+                    new_handles[key].extend(expression.hash_code for expression in batch)
+                    inserted.extend(batch)
+                if inserted:
+                    self.shared_data.broadcast_links(inserted)
+                if self.shared_data.new_link_handles is not None:
+                    self.shared_data.new_link_handles.update(expression.hash_code for expression in inserted)
+                if sum(len(handles) for handles in new_handles.values()) >= LINK_LOCATOR_BATCH_SIZE:
+                    self.db.update_link_locator(new_handles, persist=False)
+                    new_handles = {key: [] for key in mongo_collections}
+            self.db.update_link_locator(new_handles, persist=False)
+            self.db.save_link_locator()
+        except Exception as e:
+            self.shared_data.abort(e)
+            return
+        finally:
+            self.shared_data.broadcast_links(None)
         self.shared_data.mongo_uploader_ok = True
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         logger().info(f"MongoDB links uploader thread {self.name} (TID {self.native_id}) finished. " + \
-            f"{duplicates} hash colisions. {elapsed:.0f} minutes.")
+            f"{duplicates} duplicated links. {elapsed:.0f} minutes.")
+
+def _hashable_entry(entry):
+    # Entries are decoded as lists but are compared and sorted as tuples
+    if isinstance(entry, str):
+        return entry
+    handle, targets = entry
+    return tuple([handle, tuple(targets)])
 
 class PopulateCouchbaseCollectionThread(Thread):
     
@@ -385,42 +595,107 @@ class PopulateCouchbaseCollectionThread(Thread):
         self.merge_rest = merge_rest
         self.update = update
 
+    def _merge_blocks(self, couchbase_collection, key: str, head, value: List, block_size: int) -> List[str]:
+        # Updates a value split in blocks (see posting_list.py): its entries
+        # are merged with the new ones and split again in sorted blocks so
+        # the bounds in its head stay right. Returns the keys of the blocks.
+        codec = self.db.handle_codec
+        options = codec.couchbase_options
+        block_keys = [f"{key}_{i}" for i in range(head_block_count(head))]
+        blocks = couchbase_collection.get_multi(block_keys, **options)
+        entries = set(value)
+        for block_key in block_keys:
+            entries.update(_hashable_entry(entry) for entry in codec.decode_value(blocks[block_key].content))
+        entries = sorted(entries)
+        bounds = []
+        for start in range(0, len(entries), block_size):
+            block = entries[start:start + block_size]
+            couchbase_collection.upsert(
+                f"{key}_{len(bounds)}",
+                codec.encode_value(self.collection_name, block),
+                timeout=datetime.timedelta(seconds=100),
+                **options)
+            bounds.append(block_bounds(block))
+        couchbase_collection.upsert(key, posting_head(bounds), **options)
+        return [f"{key}_{i}" for i in range(len(bounds))]
+
     def run(self):
+        try:
+            self._upload()
+        except Exception as e:
+            self.shared_data.abort(e)
+
+    def _upload(self):
         file_name = self.shared_data.temporary_file_name[self.collection_name]
         couchbase_collection = self.db.couch_db.collection(self.collection_name)
         logger().info(f"Couchbase collection uploader thread {self.name} (TID {self.native_id}) started. " + \
             f"Uploading {self.collection_name}")
         stopwatch_start = time.perf_counter()
         generator = _key_value_targets_generator if self.use_targets else _key_value_generator
-        for key, value, block_count in generator(file_name, merge_rest=self.merge_rest):
+        block_size = MAX_COUCHBASE_BLOCK_SIZE // 4 if self.use_targets else MAX_COUCHBASE_BLOCK_SIZE
+        codec = self.db.handle_codec
+        options = codec.couchbase_options
+        def encode(value):
+            return codec.encode_value(self.collection_name, value)
+        # Each collection is uploaded as soon as its temporary file is ready
+        self.shared_data.file_ready[self.collection_name].wait()
+        runs = self.shared_data.sorted_runs.pop(self.collection_name, None)
+        if runs is not None:
+            lines = runs.lines()
+        elif self.collection_name == CouchbaseCollections.NAMED_ENTITIES:
+            lines = _file_lines(file_name)
+        else:
+            logger().error(f"Couchbase collection uploader thread {self.name} (TID {self.native_id}) aborted. " + \
+                f"{self.collection_name} wasn't built")
+            return
+        # Sizes of the posting lists are collected while they're uploaded
+        statistics = {
+            CouchbaseCollections.INCOMING_SET: self.shared_data.statistics.incoming_degree,
+            CouchbaseCollections.PATTERNS: self.shared_data.statistics.patterns,
+            CouchbaseCollections.TEMPLATES: self.shared_data.statistics.templates,
+        }.get(self.collection_name, None)
+        last_key = None
+        size = 0
+        bounds = []
+        for key, value, block_count in generator(lines, block_size=block_size, merge_rest=self.merge_rest):
             assert not (block_count > 0 and self.update)
+            if statistics is not None:
+                if block_count == 0 and last_key is not None:
+                    statistics.add(last_key, size)
+                    size = 0
+                last_key = key
+                size += len(value)
             if block_count == 0:
+                bounds = [block_bounds(value)]
                 if self.update:
+                    self.shared_data.updated_keys[self.collection_name].append(key)
                     outdated = None
                     try:
-                        outdated = couchbase_collection.get(key)
+                        outdated = couchbase_collection.get(key, **options)
                     except Exception:
                         pass
                     if outdated is None:
-                        couchbase_collection.upsert(key, list(set(value)), timeout=datetime.timedelta(seconds=100))
+                        couchbase_collection.upsert(key, encode(sorted(set(value))), timeout=datetime.timedelta(seconds=100), **options)
+                    elif head_block_count(outdated.content) is not None:
+                        self.shared_data.updated_keys[self.collection_name].extend(
+                            self._merge_blocks(couchbase_collection, key, outdated.content, value, block_size))
                     else:
-                        converted_outdated = []
-                        for entry in outdated.content:
-                            if isinstance(entry, str):
-                                converted_outdated.append(entry)
-                            else:
-                                handle = entry[0]
-                                targets = entry[1]
-                                converted_outdated.append(tuple([handle, tuple(targets)]))
-                        couchbase_collection.upsert(key, list(set([*converted_outdated, *value])), timeout=datetime.timedelta(seconds=100))
+                        converted_outdated = [_hashable_entry(entry) for entry in codec.decode_value(outdated.content)]
+                        couchbase_collection.upsert(key, encode(sorted(set([*converted_outdated, *value]))), timeout=datetime.timedelta(seconds=100), **options)
                 else:
-                    couchbase_collection.upsert(key, value, timeout=datetime.timedelta(seconds=100))
+                    couchbase_collection.upsert(key, encode(value), timeout=datetime.timedelta(seconds=100), **options)
             else:
                 if block_count == 1:
-                    first_block = couchbase_collection.get(key)
-                    couchbase_collection.upsert(f"{key}_0", first_block.content, timeout=datetime.timedelta(seconds=100))
-                couchbase_collection.upsert(key, block_count + 1)
-                couchbase_collection.upsert(f"{key}_{block_count}", value, timeout=datetime.timedelta(seconds=100))
+                    first_block = couchbase_collection.get(key, **options)
+                    couchbase_collection.upsert(f"{key}_0", first_block.content, timeout=datetime.timedelta(seconds=100), **options)
+                couchbase_collection.upsert(f"{key}_{block_count}", encode(value), timeout=datetime.timedelta(seconds=100), **options)
+                # The head is a directory of the blocks (see posting_list.py)
+                bounds.append(block_bounds(value))
+                couchbase_collection.upsert(key, posting_head(bounds), **options)
+        if statistics is not None and last_key is not None:
+            statistics.add(last_key, size)
+        if runs is not None:
+            runs.remove()
         elapsed = (time.perf_counter() - stopwatch_start) // 60
         self.shared_data.process_ok()
         logger().info(f"Couchbase collection uploader thread {self.name} (TID {self.native_id}) finished. " + \
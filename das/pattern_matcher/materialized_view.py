@@ -0,0 +1,285 @@
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from das.database.db_interface import DBInterface
+from das.pattern_matcher.pattern_matcher import (And, Assignment,
+                                                 CompositeAssignment, Link,
+                                                 LinkTemplate,
+                                                 LogicalExpression, Node, Not,
+                                                 Or, OrderedAssignment,
+                                                 PatternMatchingAnswer,
+                                                 TypedVariable,
+                                                 UnorderedAssignment, Variable)
+
+# A materialized view is a named LogicalExpression whose answer (matched flag,
+# negation flag and assignments, the binding table) is stored in the DB. It's
+# computed when the view is created and after each load_knowledge_base() and
+# updated with the new links of each transaction. Queries are rewritten to read
+# the sub-queries which are equal to a view (up to variable names) from it.
+VIEW_DEFINITION = 'definition'
+VIEW_MATCHED = 'matched'
+VIEW_NEGATION = 'negation'
+VIEW_ROWS = 'rows'
+
+def expression_to_dict(expression: LogicalExpression) -> Dict[str, Any]:
+    if isinstance(expression, Node):
+        return {'kind': 'node', 'type': expression.atom_type, 'name': expression.name}
+    if isinstance(expression, TypedVariable):
+        return {'kind': 'typed_variable', 'name': expression.name, 'type': expression.type}
+    if isinstance(expression, Variable):
+        return {'kind': 'variable', 'name': expression.name}
+    if isinstance(expression, Link):
+        return {
+            'kind': 'link',
+            'type': expression.atom_type,
+            'targets': [expression_to_dict(target) for target in expression.targets],
+            'ordered': expression.ordered,
+        }
+    if isinstance(expression, LinkTemplate):
+        return {
+            'kind': 'link_template',
+            'type': expression.link_type,
+            'targets': [expression_to_dict(target) for target in expression.targets],
+            'ordered': expression.ordered,
+        }
+    if isinstance(expression, Not):
+        return {'kind': 'not', 'term': expression_to_dict(expression.term)}
+    if isinstance(expression, Or):
+        return {'kind': 'or', 'terms': [expression_to_dict(term) for term in expression.terms]}
+    if isinstance(expression, And):
+        return {'kind': 'and', 'terms': [expression_to_dict(term) for term in expression.terms]}
+    raise ValueError(f'Invalid view expression: {expression}')
+
+def expression_from_dict(document: Dict[str, Any]) -> LogicalExpression:
+    kind = document['kind']
+    if kind == 'node':
+        return Node(document['type'], document['name'])
+    if kind == 'typed_variable':
+        return TypedVariable(document['name'], document['type'])
+    if kind == 'variable':
+        return Variable(document['name'])
+    if kind == 'link':
+        return Link(document['type'], [expression_from_dict(t) for t in document['targets']], document['ordered'])
+    if kind == 'link_template':
+        return LinkTemplate(document['type'], [expression_from_dict(t) for t in document['targets']], document['ordered'])
+    if kind == 'not':
+        return Not(expression_from_dict(document['term']))
+    if kind == 'or':
+        return Or([expression_from_dict(term) for term in document['terms']])
+    if kind == 'and':
+        return And([expression_from_dict(term) for term in document['terms']])
+    raise ValueError(f'Invalid view expression kind: {kind}')
+
+# Variable names aren't always valid MongoDB field names so mappings are
+# stored as lists of pairs
+
+def assignment_to_dict(assignment: Assignment) -> Dict[str, Any]:
+    if isinstance(assignment, OrderedAssignment):
+        return {'mapping': sorted([variable, value] for variable, value in assignment.mapping.items())}
+    if isinstance(assignment, UnorderedAssignment):
+        return {
+            'symbols': sorted([symbol, count] for symbol, count in assignment.symbols.items()),
+            'values': sorted([value, count] for value, count in assignment.values.items()),
+        }
+    ordered = assignment.ordered_mapping
+    return {
+        'ordered': None if ordered is None else assignment_to_dict(ordered),
+        'unordered': [assignment_to_dict(unordered) for unordered in assignment.unordered_mappings],
+    }
+
+def assignment_from_dict(document: Dict[str, Any], renaming: Optional[Dict[str, str]] = None) -> Assignment:
+    renaming = renaming or {}
+    if 'mapping' in document:
+        answer = OrderedAssignment()
+        for variable, value in document['mapping']:
+            answer.assign(renaming.get(variable, variable), value)
+        answer.freeze()
+        return answer
+    if 'symbols' in document:
+        answer = UnorderedAssignment()
+        answer.symbols = {renaming.get(symbol, symbol): count for symbol, count in document['symbols']}
+        answer.values = {value: count for value, count in document['values']}
+        answer.variables = set(answer.symbols)
+        answer.freeze()
+        return answer
+    unordered = [assignment_from_dict(u, renaming) for u in document['unordered']]
+    answer = CompositeAssignment(unordered[0])
+    if document['ordered'] is not None:
+        answer.ordered_mapping = assignment_from_dict(document['ordered'], renaming)
+    answer.unordered_mappings = unordered
+    answer._recompute_hash()
+    return answer
+
+class MaterializedView(LogicalExpression):
+    """
+    Sub-query answered by reading the binding table of a view, with the
+    variables of the view renamed to the ones of the sub-query.
+    """
+
+    def __init__(self, name: str, renaming: Dict[str, str]):
+        self.name = name
+        self.renaming = renaming
+
+    def __repr__(self):
+        return f'VIEW({self.name}, {self.renaming})'
+
+    def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
+        view = db.get_view(self.name)
+        if view is None:
+            raise ValueError(f'Invalid view: {self.name}')
+        answer.assignments = set(assignment_from_dict(row, self.renaming) for row in view[VIEW_ROWS])
+        answer.negation = view[VIEW_NEGATION]
+        return view[VIEW_MATCHED]
+
+def _canonical(expression: LogicalExpression, variables: List[str]) -> Any:
+    # Hashable form of the expression with variables numbered by their first
+    # occurrence (which are appended to variables)
+    if isinstance(expression, Variable):
+        if expression.name not in variables:
+            variables.append(expression.name)
+        position = variables.index(expression.name)
+        if isinstance(expression, TypedVariable):
+            return ('typed_variable', position, expression.type)
+        return ('variable', position)
+    if isinstance(expression, Node):
+        return ('node', expression.atom_type, expression.name)
+    if isinstance(expression, Link):
+        targets = tuple(_canonical(target, variables) for target in expression.targets)
+        return ('link', expression.atom_type, expression.ordered, targets)
+    if isinstance(expression, LinkTemplate):
+        targets = tuple(_canonical(target, variables) for target in expression.targets)
+        return ('link_template', expression.link_type, expression.ordered, targets)
+    if isinstance(expression, Not):
+        return ('not', _canonical(expression.term, variables))
+    if isinstance(expression, (And, Or)):
+        kind = 'and' if isinstance(expression, And) else 'or'
+        return (kind, tuple(_canonical(term, variables) for term in expression.terms))
+    return ('opaque', id(expression))
+
+def _rewrite(expression: LogicalExpression, signatures: Dict[Any, Any]) -> LogicalExpression:
+    variables = []
+    view = signatures.get(_canonical(expression, variables), None)
+    if view is not None:
+        name, view_variables = view
+        return MaterializedView(name, dict(zip(view_variables, variables)))
+    if isinstance(expression, Not):
+        return Not(_rewrite(expression.term, signatures))
+    if isinstance(expression, And):
+        return And([_rewrite(term, signatures) for term in expression.terms])
+    if isinstance(expression, Or):
+        # Or handles its Not terms apart so they're kept as Not
+        return Or([
+            Not(_rewrite(term.term, signatures)) if isinstance(term, Not) else _rewrite(term, signatures)
+            for term in expression.terms
+        ])
+    return expression
+
+def rewrite(expression: LogicalExpression, views: Dict[str, LogicalExpression]) -> LogicalExpression:
+    """
+    Replace the sub-expressions of expression which are equal to a view
+    (up to variable names) by a MaterializedView reading it.
+    """
+    if not views:
+        return expression
+    signatures = {}
+    for name, definition in sorted(views.items()):
+        variables = []
+        signatures.setdefault(_canonical(definition, variables), (name, variables))
+    return _rewrite(expression, signatures)
+
+def _validate(expression: LogicalExpression) -> None:
+    if isinstance(expression, (Node, Variable)):
+        raise ValueError(f'Invalid view expression (not a query): {expression}')
+    expression_to_dict(expression)
+
+def _evaluate(db: DBInterface, expression: LogicalExpression) -> Dict[str, Any]:
+    answer = PatternMatchingAnswer()
+    matched = expression.matched(db, answer)
+    return {
+        VIEW_DEFINITION: expression_to_dict(expression),
+        VIEW_MATCHED: matched,
+        VIEW_NEGATION: answer.negation,
+        VIEW_ROWS: [assignment_to_dict(assignment) for assignment in answer.assignments],
+    }
+
+def materialize(db: DBInterface, name: str, expression: LogicalExpression) -> None:
+    """
+    Compute and store the binding table of a view.
+    """
+    _validate(expression)
+    db.save_view(name, _evaluate(db, expression))
+
+def stored_views(db: DBInterface) -> Dict[str, LogicalExpression]:
+    return {name: expression_from_dict(definition) for name, definition in db.get_view_definitions().items()}
+
+def _conjunctive_terms(expression: LogicalExpression) -> Optional[List[LogicalExpression]]:
+    # Terms of a view whose answer only grows when links are added and is
+    # the join of its terms' answers, or None if it isn't such a view
+    if isinstance(expression, And):
+        answer = []
+        for term in expression.terms:
+            terms = _conjunctive_terms(term)
+            if terms is None:
+                return None
+            answer.extend(terms)
+        return answer or None
+    if isinstance(expression, LinkTemplate):
+        return [expression]
+    if isinstance(expression, Link):
+        if not all(isinstance(target, (Node, Variable)) for target in expression.targets):
+            return None
+        if not any(isinstance(target, Variable) for target in expression.targets):
+            return None
+        return [expression]
+    return None
+
+class _NewLinksDB:
+    # Same as db but matching only the passed links
+
+    def __init__(self, db: DBInterface, handles: Set[str]):
+        self.db = db
+        self.handles = handles
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def get_matched_links_iterator(self, link_type: str, target_handles: List[str]) -> Iterator[Any]:
+        return (m for m in self.db.get_matched_links_iterator(link_type, target_handles) if m[0] in self.handles)
+
+    def get_matched_type_template_iterator(self, template: List[Any]) -> Iterator[Any]:
+        return (m for m in self.db.get_matched_type_template_iterator(template) if m[0] in self.handles)
+
+class _MatchedOn(LogicalExpression):
+    # A term matched against another DB than the one of the enclosing query
+
+    def __init__(self, term: LogicalExpression, db: Any):
+        self.term = term
+        self.db = db
+
+    def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
+        return self.term.matched(self.db, answer)
+
+def maintain(db: DBInterface, name: str, expression: LogicalExpression, new_links: Set[str]) -> None:
+    """
+    Update the binding table of a view after new_links (handles) were added
+    to db. Conjunctions of links are updated incrementally: new rows have at
+    least one term matched by a new link, so each term is matched against
+    the new links only and joined with the other ones. Views with Not or Or
+    are computed again.
+    """
+    terms = _conjunctive_terms(expression)
+    view = db.get_view(name)
+    if terms is None or view is None:
+        materialize(db, name, expression)
+        return
+    new_links_db = _NewLinksDB(db, new_links)
+    rows = set(assignment_from_dict(row) for row in view[VIEW_ROWS])
+    for i, term in enumerate(terms):
+        answer = PatternMatchingAnswer()
+        # And stops at the first term without matches, which is usually
+        # the one matched against the new links
+        delta = And([_MatchedOn(term, new_links_db), *terms[:i], *terms[i + 1:]])
+        if delta.matched(db, answer):
+            rows.update(answer.assignments)
+    view[VIEW_ROWS] = [assignment_to_dict(assignment) for assignment in rows]
+    view[VIEW_MATCHED] = bool(rows)
+    db.save_view(name, view)
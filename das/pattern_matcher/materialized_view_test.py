@@ -0,0 +1,87 @@
+from das.database.stub_db import StubDB, _build_node_handle, _build_link_handle
+from das.pattern_matcher.pattern_matcher import (And, Link, LinkTemplate, Node,
+                                                 Not, Or, PatternMatchingAnswer,
+                                                 TypedVariable, Variable)
+from das.pattern_matcher.materialized_view import (MaterializedView,
+                                                   assignment_from_dict,
+                                                   assignment_to_dict,
+                                                   expression_from_dict,
+                                                   expression_to_dict,
+                                                   maintain, materialize,
+                                                   rewrite, stored_views)
+
+mammal = Node('Concept', 'mammal')
+human = Node('Concept', 'human')
+
+def _similar_mammals(v1, v2):
+    return And([
+        Link('Inheritance', [Variable(v1), mammal], True),
+        Link('Similarity', [Variable(v1), Variable(v2)], False),
+    ])
+
+def _answer(db, expression):
+    answer = PatternMatchingAnswer()
+    matched = expression.matched(db, answer)
+    return matched, answer.negation, set(answer.assignments)
+
+def test_serialization():
+    expressions = [
+        _similar_mammals('X', 'Y'),
+        Or([Link('Inheritance', [Variable('X'), mammal], True), Not(Link('Similarity', [human, Variable('X')], False))]),
+        LinkTemplate('Inheritance', [TypedVariable('X', 'Concept'), TypedVariable('Y', 'Concept')], True),
+    ]
+    for expression in expressions:
+        assert repr(expression_from_dict(expression_to_dict(expression))) == repr(expression)
+    db = StubDB()
+    for expression in [*expressions, Link('Set', [human, Variable('X'), Variable('Y')], False)]:
+        _, _, assignments = _answer(db, expression)
+        assert assignments
+        assert set(assignment_from_dict(assignment_to_dict(a)) for a in assignments) == assignments
+
+def test_rewrite():
+    db = StubDB()
+    materialize(db, 'similar_mammals', _similar_mammals('X', 'Y'))
+    assert list(stored_views(db)) == ['similar_mammals']
+    query = _similar_mammals('V1', 'V2')
+    rewritten = rewrite(query, stored_views(db))
+    assert isinstance(rewritten, MaterializedView)
+    assert rewritten.renaming == {'X': 'V1', 'Y': 'V2'}
+    assert _answer(db, rewritten) == _answer(db, query)
+    # Sub-queries are rewritten too
+    query = And([_similar_mammals('V1', 'V2'), Link('Inheritance', [Variable('V2'), mammal], True)])
+    rewritten = rewrite(query, stored_views(db))
+    assert isinstance(rewritten.terms[0], MaterializedView)
+    assert _answer(db, rewritten) == _answer(db, query)
+    query = Or([Not(_similar_mammals('V1', 'V2')), Link('Inheritance', [Variable('V1'), mammal], True)])
+    rewritten = rewrite(query, stored_views(db))
+    assert isinstance(rewritten.terms[0], Not)
+    assert isinstance(rewritten.terms[0].term, MaterializedView)
+    # Same shape with other nodes or types isn't rewritten
+    query = And([Link('Inheritance', [Variable('V1'), human], True), Link('Similarity', [Variable('V1'), Variable('V2')], False)])
+    rewritten = rewrite(query, stored_views(db))
+    assert not any(isinstance(term, MaterializedView) for term in rewritten.terms)
+
+def test_maintain():
+    chimp = _build_node_handle('Concept', 'chimp')
+    monkey = _build_node_handle('Concept', 'monkey')
+    new_links = [['Inheritance', chimp, _build_node_handle('Concept', 'mammal')], ['Similarity', chimp, monkey]]
+    views = {
+        'similar_mammals': _similar_mammals('X', 'Y'),
+        'mammals': LinkTemplate('Inheritance', [TypedVariable('X', 'Concept'), TypedVariable('Y', 'Concept')], True),
+        'not_mammals': Not(Link('Inheritance', [Variable('X'), mammal], True)),
+    }
+    new_handles = set(_build_link_handle(link[0], link[1:]) for link in new_links)
+    db = StubDB()
+    old_db = StubDB()
+    old_db.all_links = [link for link in old_db.all_links if link not in new_links]
+    old_db.template_index = {
+        key: [entry for entry in entries if entry[0] not in new_handles]
+        for key, entries in old_db.template_index.items()
+    }
+    for name, expression in views.items():
+        materialize(old_db, name, expression)
+        assert _answer(old_db, MaterializedView(name, {})) != _answer(db, expression)
+    db.views = old_db.views
+    for name, expression in views.items():
+        maintain(db, name, expression, new_handles)
+        assert _answer(db, MaterializedView(name, {})) == _answer(db, expression)
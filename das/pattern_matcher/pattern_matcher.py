@@ -1,4 +1,3 @@
-import time
 from abc import ABC, abstractmethod
 from copy import deepcopy
 from enum import Enum, auto
@@ -476,6 +475,8 @@ class Link(Atom):
             return answer if answer.freeze() else None
         else:
             answer = UnorderedAssignment()
+            # link_targets may be a tuple from the DB cache
+            link_targets = list(link_targets)
             targets_to_match = []
             for atom in self.targets:
                 if isinstance(atom, Variable):
@@ -514,12 +515,7 @@ class Link(Atom):
         if DEBUG_LINK: print(f'target_handles = {target_handles}')
         if any(handle == WILDCARD for handle in target_handles):
             if DEBUG_LINK: print(f'self.atom_type = {self.atom_type} target_handles = {target_handles}')
-            matched = db.get_matched_links(self.atom_type, target_handles)
-            if DEBUG_LINK: print(f'matched = {matched}')
-            if DEBUG_LINK: print(f'len(matched) = {len(matched)}')
-            count = 1
-            total = len(matched)
-            start = time.perf_counter()
+            matched = db.get_matched_links_iterator(self.atom_type, target_handles)
             answer.assignments = set()
             for match in matched:
                 link, targets = match
@@ -602,8 +598,7 @@ class LinkTemplate(LogicalExpression):
 
     def matched(self, db: DBInterface, answer: PatternMatchingAnswer) -> bool:
         if DEBUG_LINK_TEMPLATE: print('link template match', self)
-        matched = db.get_matched_type_template([self.link_type, *[v.type for v in self.targets]])
-        if DEBUG_LINK_TEMPLATE: print('len(matched)', len(matched))
+        matched = db.get_matched_type_template_iterator([self.link_type, *[v.type for v in self.targets]])
         answer.assignments = set()
         for match in matched:
             link, targets = match
@@ -0,0 +1,47 @@
+import sys
+import time
+from das.metta_parser import MettaParser
+from das.metta_yacc import MettaYacc
+from das.parser_actions import ParserActions
+
+# Compares the time MettaParser and MettaYacc take to parse MeTTa files:
+#
+#   python scripts/parser_benchmark.py data/annotation_service/*.metta
+
+ROUNDS = 3
+
+class ActionBroker(ParserActions):
+
+    def __init__(self, data):
+        super().__init__()
+        self.file_path = ""
+        self.input_string = data
+
+    def new_expression(self, expression):
+        pass
+
+    def new_terminal(self, expression):
+        pass
+
+    def new_top_level_expression(self, expression):
+        pass
+
+    def new_top_level_typedef_expression(self, expression):
+        pass
+
+def best_time(parser_class, data):
+    answer = None
+    for _ in range(ROUNDS):
+        parser = parser_class(action_broker=ActionBroker(data))
+        start = time.perf_counter()
+        assert parser.parse_action_broker_input() == "SUCCESS"
+        elapsed = time.perf_counter() - start
+        answer = elapsed if answer is None else min(answer, elapsed)
+    return answer
+
+for file_name in sys.argv[1:]:
+    with open(file_name) as fh:
+        data = fh.read()
+    fast = best_time(MettaParser, data)
+    ply = best_time(MettaYacc, data)
+    print(f'{file_name}: MettaParser {fast:.3f}s MettaYacc {ply:.3f}s ({ply / fast:.1f}x)')
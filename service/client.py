@@ -17,6 +17,7 @@ class ClientCommands(str, Enum):
     CHECK = "check"
     CLEAR = "clear"
     COUNT = "count"
+    STATS = "stats"
     ATOM = "atom"
     SEARCH_LINKS = "search_links"
     SEARCH_NODES = "search_nodes"
@@ -108,6 +109,11 @@ def main():
             das_key = pb2.DASKey(key=args.das_key)
             response = _check(stub.count(das_key))
             print(f"{response.msg}")
+        elif command == ClientCommands.STATS:
+            assert args.das_key
+            das_key = pb2.DASKey(key=args.das_key)
+            response = _check(stub.stats(das_key))
+            print(f"{response.msg}")
         elif command == ClientCommands.ATOM:
             assert args.das_key
             assert args.handle
@@ -208,6 +208,10 @@ class ServiceDefinition(pb2_grpc.ServiceDefinitionServicer):
         with self.locked_scope:
             return self._basic_das_call(request.key, "count_atoms", [])
 
+    def stats(self, request, context):
+        with self.locked_scope:
+            return self._basic_das_call(request.key, "stats", [])
+
     def get_atom(self, request, context):
         with self.locked_scope:
             handle = request.handle
@@ -0,0 +1,57 @@
+import importlib
+import os
+import subprocess
+import sys
+import tempfile
+from concurrent import futures
+import grpc
+import pytest
+from das.distributed_atom_space import DistributedAtomSpace
+
+SERVICE_SPEC_DIR = os.path.join(os.path.dirname(__file__), "service_spec")
+
+@pytest.fixture(scope="module")
+def stubs():
+    # The stubs are built from das.proto the same way as build-proto.sh
+    # (so RPCs missing from the built image are caught here)
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([
+            sys.executable, "-m", "grpc_tools.protoc", f"-I{SERVICE_SPEC_DIR}",
+            f"--python_out={directory}", f"--grpc_python_out={directory}",
+            os.path.join(SERVICE_SPEC_DIR, "das.proto")], check=True)
+        sys.path.insert(0, directory)
+        try:
+            pb2 = importlib.import_module("das_pb2")
+            pb2_grpc = importlib.import_module("das_pb2_grpc")
+            os.environ.setdefault("COUCHBASE_SETUP_DIR", directory)
+            sys.path.insert(0, os.path.dirname(__file__))
+            server = importlib.import_module("server")
+            yield pb2, pb2_grpc, server
+        finally:
+            sys.path.remove(directory)
+            for name in ["das_pb2", "das_pb2_grpc", "server"]:
+                sys.modules.pop(name, None)
+
+def test_stats(stubs):
+    pb2, pb2_grpc, server = stubs
+    method = pb2.DESCRIPTOR.services_by_name["ServiceDefinition"].methods_by_name["stats"]
+    assert method.input_type.name == "DASKey"
+    assert method.output_type.name == "Status"
+    service = server.ServiceDefinition()
+    das = DistributedAtomSpace()
+    service.atom_spaces["key"] = das
+    service.atom_space_status["key"] = server.AtomSpaceStatus.READY
+    grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=1))
+    pb2_grpc.add_ServiceDefinitionServicer_to_server(service, grpc_server)
+    port = grpc_server.add_insecure_port("localhost:0")
+    grpc_server.start()
+    try:
+        with grpc.insecure_channel(f"localhost:{port}") as channel:
+            stub = pb2_grpc.ServiceDefinitionStub(channel)
+            response = stub.stats(pb2.DASKey(key="key"))
+            assert response.success
+            assert response.msg == str(das.stats())
+            response = stub.stats(pb2.DASKey(key="blah"))
+            assert not response.success
+    finally:
+        grpc_server.stop(0)